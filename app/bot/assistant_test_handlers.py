@@ -5,28 +5,26 @@ from pathlib import Path
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command, CommandStart
-from aiogram.types import CallbackQuery, FSInputFile, InlineKeyboardMarkup, InputMediaPhoto, Message, ReplyKeyboardRemove
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup, Message, ReplyKeyboardRemove
 from aiogram.utils.keyboard import InlineKeyboardBuilder
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.bot.keyboards import build_single_choice_keyboard, format_question_text
-from app.config import BASE_DIR, settings
-from app.db import AsyncSessionLocal
-from app.models import Option, Response
+from app.bot.cleanup import schedule_message_cleanup
+from app.config import settings
+from app.db import unit_of_work
+from app.services.media_cache import send_cached_document, send_cached_photo_album
+from app.services.media_manifest import question_album
+from app.services.scoring import add_option_scores, store_result_type
 from app.services.survey import (
+    StaleResponse,
     abandon_active_responses,
     advance_response,
-    append_question_message_id,
-    get_active_response,
     get_or_create_user,
-    get_question,
-    get_questions,
-    get_survey_by_code,
-    get_response_answers,
+    get_user_with_active_response,
+    record_question_messages,
     save_option_answer,
     start_new_response,
 )
+from app.services.survey_cache import CompiledQuestion, get_compiled_survey
 
 
 INTRO_MESSAGE_1 = (
@@ -150,12 +148,12 @@ async def restart_command(message: Message) -> None:
 
 
 async def start_test_callback(callback: CallbackQuery) -> None:
-    async with AsyncSessionLocal() as session:
-        try:
-            survey = await get_survey_by_code(session, settings.ASSISTANT_TEST_SURVEY_CODE)
-        except Exception:
-            await callback.answer("Тест пока не настроен.", show_alert=True)
-            return
+    try:
+        survey = await get_compiled_survey(settings.ASSISTANT_TEST_SURVEY_CODE)
+    except Exception:
+        await callback.answer("Тест пока не настроен.", show_alert=True)
+        return
+    async with unit_of_work() as session:
         user = await get_or_create_user(
             session,
             callback.from_user.id,
@@ -164,13 +162,13 @@ async def start_test_callback(callback: CallbackQuery) -> None:
             callback.from_user.last_name,
         )
         await abandon_active_responses(session, user.id, survey.id)
-        questions = await get_questions(session, survey.id)
-        if not questions:
-            await callback.message.answer("Тест пока не настроен.")
-            await callback.answer()
-            return
-        response = await start_new_response(session, user.id, survey.id, questions[0].id)
-        await _send_test_question(callback.message.bot, callback.message.chat.id, questions[0], session, response.id)
+        first_question = survey.first_question
+        response = await start_new_response(session, user.id, survey.id, first_question.id) if first_question else None
+    if not response:
+        await callback.message.answer("Тест пока не настроен.")
+        await callback.answer()
+        return
+    await _send_test_question(callback.message.bot, callback.message.chat.id, first_question, response.id)
 
     with suppress(Exception):
         await callback.message.delete()
@@ -185,39 +183,51 @@ async def handle_callbacks(callback: CallbackQuery) -> None:
         await callback.answer()
         return
 
-    async with AsyncSessionLocal() as session:
-        try:
-            survey = await get_survey_by_code(session, settings.ASSISTANT_TEST_SURVEY_CODE)
-        except Exception:
-            await callback.answer("Тест пока не настроен.", show_alert=True)
-            return
-        user = await get_or_create_user(
-            session,
-            callback.from_user.id,
-            callback.from_user.username,
-            callback.from_user.first_name,
-            callback.from_user.last_name,
-        )
-        response = await get_active_response(session, user.id, survey.id)
-        if not response or response.current_question_id != question_id:
-            await callback.answer("Этот тест уже завершён или устарел.", show_alert=True)
-            return
-        question = await get_question(session, question_id)
-
-        if action.startswith("opt"):
-            option_id = int(action.replace("opt", ""))
-            await save_option_answer(session, response.id, question.id, [option_id])
-            with suppress(Exception):
-                await callback.message.edit_reply_markup(reply_markup=None)
-            next_question = await advance_response(session, response)
-            await callback.answer("Принято")
-            if next_question:
-                await _send_test_question(callback.message.bot, callback.message.chat.id, next_question, session, response.id)
-            else:
-                await finish_response(callback.message, session, response.id)
-            return
-
-    await callback.answer()
+    try:
+        survey = await get_compiled_survey(settings.ASSISTANT_TEST_SURVEY_CODE)
+    except Exception:
+        await callback.answer("Тест пока не настроен.", show_alert=True)
+        return
+    next_question = result_type = None
+    message_ids: list[int] = []
+    # The answer, scores and next step are committed before anything is sent to Telegram.
+    try:
+        async with unit_of_work() as session:
+            user, response = await get_user_with_active_response(
+                session,
+                survey.id,
+                callback.from_user.id,
+                callback.from_user.username,
+                callback.from_user.first_name,
+                callback.from_user.last_name,
+            )
+            if not response or response.current_question_id != question_id:
+                response = None
+            elif action.startswith("opt"):
+                question = survey.question(question_id)
+                option_id = int(action.replace("opt", ""))
+                await save_option_answer(session, response.id, question.id, [option_id])
+                add_option_scores(response, question, [option_id])
+                next_question = await advance_response(session, response, survey)
+                if not next_question:
+                    result_type = store_result_type(response)
+                    message_ids = list(response.question_message_ids or [])
+    except StaleResponse:
+        response = None
+
+    if response is None:
+        await callback.answer("Этот тест уже завершён или устарел.", show_alert=True)
+        return
+    if not action.startswith("opt"):
+        await callback.answer()
+        return
+    with suppress(Exception):
+        await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.answer("Принято")
+    if next_question:
+        await _send_test_question(callback.message.bot, callback.message.chat.id, next_question, response.id)
+    else:
+        await finish_response(callback.message, result_type, message_ids)
 
 
 async def handle_messages(message: Message) -> None:
@@ -226,19 +236,11 @@ async def handle_messages(message: Message) -> None:
     await message.answer("Нажмите /start чтобы начать тест.")
 
 
-async def finish_response(message: Message, session: AsyncSession, response_id: int) -> None:
-    loading = await message.answer("loading....")
-    result_type = await _compute_result(session, response_id)
-    with suppress(Exception):
-        await message.bot.delete_message(chat_id=loading.chat.id, message_id=loading.message_id)
-
-    response = await session.get(Response, response_id)
-    if response:
-        await _delete_messages(message.bot, message.chat.id, list(response.question_message_ids or []))
-
+async def finish_response(message: Message, result_type: str, message_ids: list[int]) -> None:
     text = RESULT_TEXTS.get(result_type, RESULT_TEXTS["MULTI"])
     await message.answer(text, parse_mode="HTML", reply_markup=ReplyKeyboardRemove())
     await _send_result_pdf(message.bot, message.chat.id, result_type)
+    schedule_message_cleanup(message.bot, message.chat.id, message_ids)
 
 
 def _build_start_keyboard() -> InlineKeyboardMarkup:
@@ -248,84 +250,25 @@ def _build_start_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def _get_question_images(question) -> list[Path]:
-    settings_data = question.settings or {}
-    image_dir = settings_data.get("image_dir")
-    if not image_dir:
-        code = (question.code or "").lower()
-        if code.startswith("q") and code[1:].isdigit():
-            image_dir = str(Path("assistant_images_questions") / f"question{int(code[1:])}")
-        else:
-            return []
-    path = Path(str(image_dir))
-    if not path.is_absolute():
-        path = Path(BASE_DIR) / path
-    if not path.exists() or not path.is_dir():
-        return []
-    allowed = {".jpg", ".jpeg", ".png", ".webp"}
-    files = [p for p in sorted(path.iterdir()) if p.is_file() and p.suffix.lower() in allowed]
-    return files
-
-
 async def _send_test_question(
     bot: Bot,
     chat_id: int,
-    question,
-    session: AsyncSession,
+    question: CompiledQuestion,
     response_id: int | None,
 ) -> None:
-    images = _get_question_images(question)
+    message_ids = []
+    images = await question_album(question)
     if images:
-        media = [InputMediaPhoto(media=FSInputFile(path)) for path in images]
         try:
-            messages = await bot.send_media_group(chat_id, media)
-            if response_id is not None:
-                for msg in messages:
-                    await append_question_message_id(session, response_id, msg.message_id)
+            messages = await send_cached_photo_album(bot, chat_id, images)
+            message_ids.extend(msg.message_id for msg in messages)
         except Exception:
             pass
 
-    keyboard = build_single_choice_keyboard(question.id, question.options)
-    text = format_question_text(question)
-    sent = await bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode="HTML")
+    sent = await bot.send_message(chat_id, question.rendered_text, reply_markup=question.keyboard, parse_mode="HTML")
+    message_ids.append(sent.message_id)
     if response_id is not None:
-        await append_question_message_id(session, response_id, sent.message_id)
-
-
-async def _compute_result(session: AsyncSession, response_id: int) -> str:
-    response = await session.get(Response, response_id)
-    if not response:
-        return "MULTI"
-    answers = await get_response_answers(session, response_id)
-    option_ids = [opt_id for answer in answers for opt_id in (answer.option_values or [])]
-    if not option_ids:
-        return "MULTI"
-    options_result = await session.execute(select(Option).where(Option.id.in_(option_ids)))
-    option_value_map = {opt.id: (opt.value or "").strip().upper() for opt in options_result.scalars().all()}
-
-    office = 0
-    personal = 0
-    business = 0
-    for answer in answers:
-        for opt_id in answer.option_values or []:
-            value = option_value_map.get(opt_id, "")
-            if value == "A":
-                office += 1
-            elif value == "B":
-                personal += 1
-            elif value == "C":
-                business += 1
-
-    scores = {"OFFICE": office, "PERSONAL": personal, "BUSINESS": business}
-    ordered = sorted(scores.values(), reverse=True)
-    top = ordered[0] if ordered else 0
-    second = ordered[1] if len(ordered) > 1 else 0
-
-    if top >= 5 and (top - second) >= 2:
-        for key, value in scores.items():
-            if value == top:
-                return key
-    return "MULTI"
+        await record_question_messages(response_id, message_ids)
 
 
 async def _send_result_pdf(bot: Bot, chat_id: int, result_type: str) -> None:
@@ -336,15 +279,7 @@ async def _send_result_pdf(bot: Bot, chat_id: int, result_type: str) -> None:
     if not path.exists():
         await bot.send_message(chat_id, "Файл пока не загружен. Напишите администратору.")
         return
-    await bot.send_document(chat_id, FSInputFile(path))
-
-
-async def _delete_messages(bot: Bot, chat_id: int, message_ids: list[int]) -> None:
-    for message_id in message_ids:
-        try:
-            await bot.delete_message(chat_id=chat_id, message_id=message_id)
-        except Exception:
-            continue
+    await send_cached_document(bot, chat_id, path)
 
 
 def _parse_callback(data: str) -> tuple[int | None, str]:
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import suppress
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from app.bot.scheduler import Priority, send_priority
+from app.metrics import detached_task
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH_SIZE = 100
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def delete_messages(bot: Bot, chat_id: int, message_ids: list[int]) -> None:
+    unique_ids = sorted(set(message_ids))
+    for start in range(0, len(unique_ids), DELETE_BATCH_SIZE):
+        chunk = unique_ids[start : start + DELETE_BATCH_SIZE]
+        try:
+            await bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+            continue
+        except TelegramAPIError:
+            pass
+        for message_id in chunk:
+            with suppress(TelegramAPIError):
+                await bot.delete_message(chat_id=chat_id, message_id=message_id)
+
+
+async def _run_cleanup(bot: Bot, chat_id: int, message_ids: list[int]) -> None:
+    try:
+        with send_priority(Priority.BACKGROUND):
+            await delete_messages(bot, chat_id, message_ids)
+    except Exception:
+        logger.exception("Failed to clean up %d messages in chat %s", len(message_ids), chat_id)
+
+
+def schedule_message_cleanup(bot: Bot, chat_id: int, message_ids: list[int]) -> None:
+    if not message_ids:
+        return
+    task = detached_task(_run_cleanup(bot, chat_id, list(message_ids)))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def drain_cleanup_tasks() -> None:
+    if _background_tasks:
+        await asyncio.gather(*list(_background_tasks), return_exceptions=True)
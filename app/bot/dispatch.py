@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import CallbackQuery, TelegramObject, Update
+
+from app.bot.scheduler import replying_to
+from app.config import settings
+
+Handler = Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]]
+
+CALLBACK_ID_TTL = 300.0
+MAX_REMEMBERED_TAPS = 10000
+
+
+@dataclass
+class _ChatSlot:
+    lock: asyncio.Lock
+    users: int = 0
+
+
+class _ExpiringKeys:
+    def __init__(self, ttl: float, max_size: int = MAX_REMEMBERED_TAPS) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._expires: OrderedDict[Hashable, float] = OrderedDict()
+
+    def seen(self, key: Hashable, now: float) -> bool:
+        while self._expires and (next(iter(self._expires.values())) <= now or len(self._expires) > self.max_size):
+            self._expires.popitem(last=False)
+        if key in self._expires:
+            return True
+        self._expires[key] = now + self.ttl
+        return False
+
+
+class UpdateSerializer(BaseMiddleware):
+    def __init__(self, max_concurrent: int | None = None, duplicate_tap_window: float | None = None) -> None:
+        self.max_concurrent = max_concurrent or settings.BOT_MAX_CONCURRENT_UPDATES
+        window = settings.BOT_DUPLICATE_TAP_WINDOW if duplicate_tap_window is None else duplicate_tap_window
+        self.active = 0
+        self.dropped = 0
+        self._inflight = 0
+        self._slots: dict[Hashable, _ChatSlot] = {}
+        self._semaphore: asyncio.Semaphore | None = None
+        self._callback_ids = _ExpiringKeys(CALLBACK_ID_TTL)
+        self._taps = _ExpiringKeys(window)
+
+    @property
+    def waiting(self) -> int:
+        return self._inflight - self.active
+
+    def _chat_key(self, event: Update, data: dict[str, Any]) -> Hashable | None:
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        if chat is None and user is None:
+            return None
+        bot = data.get("bot")
+        return (bot.id if bot else None, chat.id if chat else None, user.id if user else None)
+
+    def _is_duplicate(self, callback: CallbackQuery, chat_key: Hashable) -> bool:
+        now = time.monotonic()
+        if self._callback_ids.seen(callback.id, now):
+            return True
+        # A double tap sends two callbacks with different ids but the same button on the same message.
+        message_id = callback.message.message_id if callback.message else callback.inline_message_id
+        return self._taps.seen((chat_key, message_id, callback.data), now)
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: dict[str, Any]) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        chat_key = self._chat_key(event, data)
+        if chat_key is None:
+            return await handler(event, data)
+        if event.callback_query and self._is_duplicate(event.callback_query, chat_key):
+            self.dropped += 1
+            with suppress(TelegramAPIError):
+                await event.callback_query.answer()
+            return None
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        slot = self._slots.get(chat_key)
+        if slot is None:
+            slot = self._slots[chat_key] = _ChatSlot(asyncio.Lock())
+        chat = data.get("event_chat")
+        slot.users += 1
+        self._inflight += 1
+        try:
+            # The chat lock comes first so a busy chat queues on itself without holding global slots.
+            async with slot.lock:
+                async with self._semaphore:
+                    self.active += 1
+                    try:
+                        with replying_to(chat.id if chat else None):
+                            return await handler(event, data)
+                    finally:
+                        self.active -= 1
+        finally:
+            self._inflight -= 1
+            slot.users -= 1
+            if slot.users == 0:
+                self._slots.pop(chat_key, None)
@@ -1,46 +1,43 @@
 from __future__ import annotations
 
-import os
+from dataclasses import dataclass
+from typing import Any, Optional
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command, CommandStart
-from aiogram.types import CallbackQuery, FSInputFile, Message, ReplyKeyboardRemove
+from aiogram.types import CallbackQuery, Message, ReplyKeyboardRemove
 from html import escape as html_escape
 from jinja2 import pass_environment
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.bot.keyboards import (
-    build_contact_keyboard,
-    build_file_keyboard,
-    build_multi_choice_keyboard,
-    build_single_choice_keyboard,
-    format_question_text,
-)
-from app.db import AsyncSessionLocal
-from app.models import Question, Response, Survey, User
-from app.services.files import download_telegram_file
-from app.services.sheets import send_to_google_sheets, sheets_enabled
-from app.services.sheets_stub import send_to_google_sheets_stub
+from app.bot.cleanup import schedule_message_cleanup
+from app.bot.ingestion import run_after_uploads, schedule_file_ingestion
+from app.bot.keyboards import build_multi_choice_keyboard
+from app.bot.scheduler import Priority, send_priority
+from app.db import AsyncSessionLocal, unit_of_work
+from app.models import Response, UploadedFile, User
+from app.services.files import get_pending_file_ids, register_telegram_file
+from app.services.media_cache import send_cached_document, send_cached_photo
+from app.services.media_manifest import photos_for, question_photo
+from app.services.sheets_outbox import enqueue_sheets_export
 from app.services.survey import (
+    StaleResponse,
     abandon_active_responses,
     advance_response,
     append_file_answer,
-    append_question_message_id,
     append_user_message_id,
-    get_active_response,
-    get_active_survey,
     get_answer,
-    get_options_map,
     get_or_create_user,
-    get_question,
-    get_questions,
     get_response_answers,
+    get_user_with_active_response,
     get_uploaded_files,
+    record_question_messages,
     save_option_answer,
     save_text_answer,
     toggle_option_answer,
     update_user_phone,
 )
+from app.services.survey_cache import CompiledQuestion, CompiledSurvey, get_compiled_survey, get_compiled_survey_by_id
 from app.config import BASE_DIR, settings
 
 ADMIN_NOTIFY_USER_IDS = [765466497, 1924535035]
@@ -95,8 +92,8 @@ def register_handlers(dp: Dispatcher) -> None:
 
 
 async def start_command(message: Message) -> None:
-    async with AsyncSessionLocal() as session:
-        survey = await get_active_survey(session, settings.ASSISTANT_MAIN_SURVEY_CODE)
+    survey = await get_compiled_survey(settings.ASSISTANT_MAIN_SURVEY_CODE, require_active=True)
+    async with unit_of_work() as session:
         user = await get_or_create_user(
             session,
             message.from_user.id,
@@ -105,19 +102,21 @@ async def start_command(message: Message) -> None:
             message.from_user.last_name,
         )
         await abandon_active_responses(session, user.id, survey.id)
-        questions = await get_questions(session, survey.id)
-        if not questions:
-            await message.answer("Анкета пока не настроена.")
-            return
-        response = await start_response_flow(session, user.id, survey.id, questions[0].id) 
+        first_question = survey.first_question
+        response = await start_response_flow(session, user.id, survey.id, first_question.id) if first_question else None
+    if not response:
+        await message.answer("Анкета пока не настроена.")
+        return
     text = ("Если Вы смотрели фильм <b>«Дьявол носит Прада»</b> и помните успевающую во всем ассистенку, которая успевала всё — приятно познакомиться!\n\n"
         "За годы работы я узнала, как <b>«крутится каждый винтик»</b> бизнес-процессов, "
         "и получила обширный опыт в <b>fashion-retail</b>, <b>продажах</b>, <b>IT</b> и <b>управлении операционными задачами</b>. "
         "Более 7 лет я работаю в роли той самой <b>right hand</b> руководителя — и теперь помогаю другим ассистентам находить своё место рядом с сильными лидерами👠 \n\n"
         "Заполни короткую анкету, чтобы мы могли предложить тебе подходящие вакансии.")
-    sent = await message.bot.send_photo(
+    intro_photos = await photos_for(BASE_DIR / "bot_intro.jpg")
+    sent = await send_cached_photo(
+            message.bot,
             message.from_user.id,
-            FSInputFile(BASE_DIR / "bot_intro.jpg"),
+            intro_photos[0] if intro_photos else BASE_DIR / "bot_intro.jpg",
             caption=text,
             reply_markup=ReplyKeyboardRemove(),
             parse_mode="HTML",
@@ -126,14 +125,12 @@ async def start_command(message: Message) -> None:
         
     #     reply_markup=ReplyKeyboardRemove(),
     # )
-    async with AsyncSessionLocal() as session:
-        question = await get_question(session, response.current_question_id)
-        await send_question(message.bot, message.chat.id, question, session, response.id)
+    await send_question(message.bot, message.chat.id, survey.question(response.current_question_id), response.id)
 
 
 async def restart_command(message: Message) -> None:
-    async with AsyncSessionLocal() as session:
-        survey = await get_active_survey(session, settings.ASSISTANT_MAIN_SURVEY_CODE)
+    survey = await get_compiled_survey(settings.ASSISTANT_MAIN_SURVEY_CODE, require_active=True)
+    async with unit_of_work() as session:
         user = await get_or_create_user(
             session,
             message.from_user.id,
@@ -142,16 +139,14 @@ async def restart_command(message: Message) -> None:
             message.from_user.last_name,
         )
         await abandon_active_responses(session, user.id, survey.id)
-        questions = await get_questions(session, survey.id)
-        if not questions:
-            await message.answer("Анкета пока не настроена.")
-            return
-        response = await start_response_flow(session, user.id, survey.id, questions[0].id)
+        first_question = survey.first_question
+        response = await start_response_flow(session, user.id, survey.id, first_question.id) if first_question else None
+    if not response:
+        await message.answer("Анкета пока не настроена.")
+        return
 
     await message.answer("Начнём сначала.", reply_markup=ReplyKeyboardRemove())
-    async with AsyncSessionLocal() as session:
-        question = await get_question(session, response.current_question_id)
-        await send_question(message.bot, message.chat.id, question, session, response.id)
+    await send_question(message.bot, message.chat.id, survey.question(response.current_question_id), response.id)
 
 
 async def start_response_flow(session: AsyncSession, user_id: int, survey_id: int, first_question_id: int):
@@ -160,6 +155,56 @@ async def start_response_flow(session: AsyncSession, user_id: int, survey_id: in
     return await start_new_response(session, user_id, survey_id, first_question_id)
 
 
+# Handlers change the database in one short transaction and only then talk to Telegram:
+# the SQLite write lock and the pooled connection must not wait on the network.
+
+
+@dataclass
+class FinishedResponse:
+    summary: str
+    admin_text: Optional[str]
+    message_ids: list[int]
+
+
+async def _current_response(session: AsyncSession, survey: CompiledSurvey, from_user, question_id: int) -> Optional[Response]:
+    user, response = await get_user_with_active_response(
+        session,
+        survey.id,
+        from_user.id,
+        from_user.username,
+        from_user.first_name,
+        from_user.last_name,
+    )
+    if not response or response.current_question_id != question_id:
+        return None
+    return response
+
+
+async def _advance(
+    session: AsyncSession, response: Response, survey: CompiledSurvey
+) -> tuple[Optional[CompiledQuestion], Optional[FinishedResponse]]:
+    next_question = await advance_response(session, response, survey)
+    if next_question:
+        return next_question, None
+    return None, await complete_response(session, response.id)
+
+
+async def _continue_survey(
+    message: Message,
+    response_id: int,
+    next_question: Optional[CompiledQuestion],
+    finished: Optional[FinishedResponse],
+) -> None:
+    if next_question:
+        await send_question(message.bot, message.chat.id, next_question, response_id)
+    elif finished:
+        await finish_response(message, finished)
+
+
+async def _reject_stale(callback: CallbackQuery) -> None:
+    await callback.answer("Эта анкета уже завершена или устарела.", show_alert=True)
+
+
 async def handle_callbacks(callback: CallbackQuery) -> None:
     if not callback.data:
         return
@@ -169,283 +214,287 @@ async def handle_callbacks(callback: CallbackQuery) -> None:
         await callback.answer()
         return
 
-    async with AsyncSessionLocal() as session:
-        survey = await get_active_survey(session, settings.ASSISTANT_MAIN_SURVEY_CODE)
-        user = await get_or_create_user(
-            session,
-            callback.from_user.id,
-            callback.from_user.username,
-            callback.from_user.first_name,
-            callback.from_user.last_name,
-        )
-        response = await get_active_response(session, user.id, survey.id)
-        if not response or response.current_question_id != question_id:
-            await callback.answer("Эта анкета уже завершена или устарела.", show_alert=True)
-            return
-        question = await get_question(session, question_id)
-
+    survey = await get_compiled_survey(settings.ASSISTANT_MAIN_SURVEY_CODE, require_active=True)
+    try:
         if action.startswith("opt"):
-            option_id = int(action.replace("opt", ""))
-            if question.type == "single_choice":
-                await save_option_answer(session, response.id, question.id, [option_id])
-                answer_text = _format_option_values(question, [option_id])
-                await _edit_callback_message(callback, question, answer_text)
-                next_question = await advance_response(session, response)
-                await callback.answer("Принято")
-                if next_question:
-                    await send_question(callback.message.bot, callback.message.chat.id, next_question, session, response.id)
-                else:
-                    await finish_response(callback.message, session, response.id)
-                return
+            await _handle_option(callback, survey, question_id, int(action.replace("opt", "")))
+        elif action == "done":
+            await _handle_multi_choice_done(callback, survey, question_id)
+        elif action == "done_files":
+            await _handle_files_done(callback, survey, question_id)
+        else:
+            await callback.answer()
+    except StaleResponse:
+        # The same tap was handled by another process first; its transaction already moved the user on.
+        await _reject_stale(callback)
+
+
+async def _handle_option(callback: CallbackQuery, survey: CompiledSurvey, question_id: int, option_id: int) -> None:
+    keyboard = next_question = finished = None
+    async with unit_of_work() as session:
+        response = await _current_response(session, survey, callback.from_user, question_id)
+        question = survey.question(question_id) if response else None
+        if question is not None and question.type == "single_choice":
+            await save_option_answer(session, response.id, question.id, [option_id])
+            next_question, finished = await _advance(session, response, survey)
+        elif question is not None and question.type == "multi_choice":
+            answer = await toggle_option_answer(session, response.id, question.id, option_id)
+            keyboard = build_multi_choice_keyboard(question.id, question.options, set(answer.option_values or []))
+
+    if question is None:
+        await _reject_stale(callback)
+        return
+    if question.type == "single_choice":
+        await _edit_callback_message(callback, question, _format_option_values(question, [option_id]))
+        await callback.answer("Принято")
+        await _continue_survey(callback.message, response.id, next_question, finished)
+    elif question.type == "multi_choice":
+        await callback.message.edit_reply_markup(reply_markup=keyboard)
+        await callback.answer()
+    else:
+        await callback.answer()
 
-            if question.type == "multi_choice":
-                answer = await toggle_option_answer(session, response.id, question.id, option_id)
-                selected = set(answer.option_values or [])
-                keyboard = build_multi_choice_keyboard(question.id, question.options, selected)
-                await callback.message.edit_reply_markup(reply_markup=keyboard)
-                await callback.answer()
-                return
 
-        if action == "done" and question.type == "multi_choice":
+async def _handle_multi_choice_done(callback: CallbackQuery, survey: CompiledSurvey, question_id: int) -> None:
+    next_question = finished = None
+    async with unit_of_work() as session:
+        response = await _current_response(session, survey, callback.from_user, question_id)
+        question = survey.question(question_id) if response else None
+        if question is not None and question.type == "multi_choice":
             answer = await get_answer(session, response.id, question.id)
             answer_text = _format_option_values(question, answer.option_values if answer else [])
-            await _edit_callback_message(callback, question, answer_text)
-            next_question = await advance_response(session, response)
-            await callback.answer("Дальше")
-            if next_question:
-                await send_question(callback.message.bot, callback.message.chat.id, next_question, session, response.id)
-            else:
-                await finish_response(callback.message, session, response.id)
-            return
+            next_question, finished = await _advance(session, response, survey)
 
-        if action == "done_files" and question.type == "file":
+    if question is None:
+        await _reject_stale(callback)
+        return
+    if question.type != "multi_choice":
+        await callback.answer()
+        return
+    await _edit_callback_message(callback, question, answer_text)
+    await callback.answer("Дальше")
+    await _continue_survey(callback.message, response.id, next_question, finished)
+
+
+async def _handle_files_done(callback: CallbackQuery, survey: CompiledSurvey, question_id: int) -> None:
+    file_ids: list[int] = []
+    pending: list[int] = []
+    files = next_question = finished = None
+    async with unit_of_work() as session:
+        response = await _current_response(session, survey, callback.from_user, question_id)
+        question = survey.question(question_id) if response else None
+        if question is not None and question.type == "file":
             answer = await get_answer(session, response.id, question.id)
-            if not answer or not answer.file_ids:
-                await callback.answer("Сначала отправьте файл.", show_alert=True)
-                return
-            files = await get_uploaded_files(session, answer.file_ids)
-            answer_text = _format_file_list(files)
-            await _edit_callback_message(callback, question, answer_text)
-            next_question = await advance_response(session, response)
-            await callback.answer("Файлы приняты")
-            if next_question:
-                await send_question(callback.message.bot, callback.message.chat.id, next_question, session, response.id)
-            else:
-                await finish_response(callback.message, session, response.id)
-            return
+            file_ids = list(answer.file_ids or []) if answer else []
+            # Finishing with a download still running would export and report the file without its link.
+            pending = await get_pending_file_ids(session, file_ids) if file_ids else []
+            if file_ids and not pending:
+                files = await get_uploaded_files(session, file_ids)
+                next_question, finished = await _advance(session, response, survey)
+
+    if question is None:
+        await _reject_stale(callback)
+        return
+    if question.type != "file":
+        await callback.answer()
+        return
+    if not file_ids:
+        await callback.answer("Сначала отправьте файл.", show_alert=True)
+        return
+    if pending:
+        await callback.answer("Файлы ещё загружаются, следующий вопрос придёт, когда они сохранятся.")
+        run_after_uploads(pending, lambda: _finish_files_question(callback, survey, question_id))
+        return
+    await _edit_callback_message(callback, question, _format_file_list(files))
+    await callback.answer("Файлы приняты")
+    await _continue_survey(callback.message, response.id, next_question, finished)
+
 
-    await callback.answer()
+async def _finish_files_question(callback: CallbackQuery, survey: CompiledSurvey, question_id: int) -> None:
+    # Runs once the wait is over, outside the update: the user may have sent more files or moved on meanwhile.
+    files = next_question = finished = None
+    try:
+        async with unit_of_work() as session:
+            response = await _current_response(session, survey, callback.from_user, question_id)
+            if response is None:
+                return
+            answer = await get_answer(session, response.id, question_id)
+            file_ids = list(answer.file_ids or []) if answer else []
+            pending = await get_pending_file_ids(session, file_ids)
+            if not pending:
+                files = await get_uploaded_files(session, file_ids)
+                next_question, finished = await _advance(session, response, survey)
+    except StaleResponse:
+        return
+    if pending:
+        await callback.message.answer("Файлы всё ещё загружаются. Нажмите «Завершить загрузку» чуть позже.")
+        return
+    await _edit_callback_message(callback, survey.question(question_id), _format_file_list(files))
+    await _continue_survey(callback.message, response.id, next_question, finished)
 
 
 async def handle_messages(message: Message) -> None:
     if message.text and message.text.startswith("/"):
         return
 
-    async with AsyncSessionLocal() as session:
-        survey = await get_active_survey(session, settings.ASSISTANT_MAIN_SURVEY_CODE)
-        user = await get_or_create_user(
-            session,
-            message.from_user.id,
-            message.from_user.username,
-            message.from_user.first_name,
-            message.from_user.last_name,
-        )
-        response = await get_active_response(session, user.id, survey.id)
-        if not response or response.current_question_id is None:
-            await message.answer("Нажмите /start чтобы начать анкету.")
-            return
-        question = await get_question(session, response.current_question_id)
-        await append_user_message_id(session, response.id, message.message_id)
-
-        if question.type == "text":
-            if not message.text:
-                await message.answer("Пожалуйста, отправьте текстовый ответ.")
-                return
-            await save_text_answer(session, response.id, question.id, message.text.strip())
-            await _edit_last_question_message(
-                message.bot,
-                message.chat.id,
-                response,
-                question,
-                message.text.strip(),
+    survey = await get_compiled_survey(settings.ASSISTANT_MAIN_SURVEY_CODE, require_active=True)
+    question = uploaded = files = answer_text = reply = next_question = finished = None
+    try:
+        async with unit_of_work() as session:
+            user, response = await get_user_with_active_response(
+                session,
+                survey.id,
+                message.from_user.id,
+                message.from_user.username,
+                message.from_user.first_name,
+                message.from_user.last_name,
             )
-            next_question = await advance_response(session, response)
-            if next_question:
-                await send_question(message.bot, message.chat.id, next_question, session, response.id)
-            else:
-                await finish_response(message, session, response.id)
-            return
+            if response and response.current_question_id is not None:
+                question = survey.question(response.current_question_id)
+                await append_user_message_id(session, response.id, message.message_id)
+                if question.type == "file" and _is_file_message(message):
+                    uploaded = await register_telegram_file(session, response.id, question.id, message)
+                    answer = await append_file_answer(session, response.id, question.id, uploaded.id)
+                    files = await get_uploaded_files(session, answer.file_ids)
+                elif question.type in ("text", "contact"):
+                    answer_text, reply = await _save_typed_answer(session, message, user, response, question)
+                    if answer_text is not None:
+                        next_question, finished = await _advance(session, response, survey)
+    except StaleResponse:
+        # A message handled concurrently by another process already answered this question.
+        return
 
-        if question.type == "contact":
-            if message.contact:
-                phone = message.contact.phone_number
-            elif message.text:
-                if message.text.strip().lower() == "ввести вручную":
-                    await message.answer(
-                        "Введите номер телефона или ссылку на соцсеть.",
-                        reply_markup=ReplyKeyboardRemove(),
-                    )
-                    return
-                phone = message.text.strip()
-            else:
-                await message.answer("Пожалуйста, отправьте контакт или текст.")
-                return
+    if question is None:
+        await message.answer("Нажмите /start чтобы начать анкету.")
+        return
 
-            await update_user_phone(session, user.id, phone)
-            await save_text_answer(session, response.id, question.id, phone)
-            await _edit_last_question_message(message.bot, message.chat.id, response, question, phone)
-            next_question = await advance_response(session, response)
-            if next_question:
-                await send_question(message.bot, message.chat.id, next_question, session, response.id)
-            else:
-                await finish_response(message, session, response.id)
+    if question.type in ("text", "contact"):
+        if reply is not None:
+            text, reply_markup = reply
+            await message.answer(text, reply_markup=reply_markup)
             return
+        await _edit_last_question_message(message.bot, message.chat.id, response, question, answer_text)
+        await _continue_survey(message, response.id, next_question, finished)
+        return
 
-        if question.type == "file":
-            if not _is_file_message(message):
-                await message.answer("Отправьте файл или нажмите 'Завершить загрузку'.")
-                return
-            uploaded = await download_telegram_file(message.bot, session, response.id, question.id, message)
-            await append_file_answer(session, response.id, question.id, uploaded.id)
-            answer = await get_answer(session, response.id, question.id)
-            files = await get_uploaded_files(session, answer.file_ids if answer else [])
-            await _edit_last_question_message(
-                message.bot,
-                message.chat.id,
-                response,
-                question,
-                _format_file_list(files),
-                keep_file_keyboard=True,
-            )
+    if question.type == "file":
+        if uploaded is None:
+            await message.answer("Отправьте файл или нажмите 'Завершить загрузку'.")
             return
+        if uploaded.status == "pending":
+            # The row is committed by now, so the worker's own session can see it.
+            schedule_file_ingestion(message.bot, uploaded.id, on_file_ingested)
+        await _edit_last_question_message(
+            message.bot,
+            message.chat.id,
+            response,
+            question,
+            _format_file_list(files),
+            keep_file_keyboard=True,
+        )
+        return
 
-        await message.answer("Используйте кнопки под вопросом.")
+    await message.answer("Используйте кнопки под вопросом.")
 
 
-async def send_question(
-    bot: Bot, chat_id: int, question: Question, session: AsyncSession, response_id: int | None
-) -> Message | None:
-    if question.code == "consent":
-        await _send_consent_files(bot, chat_id)
-    text = format_question_text(question)
-    has_image = _has_question_image(question)
-
+async def _save_typed_answer(
+    session: AsyncSession, message: Message, user: User, response: Response, question: CompiledQuestion
+) -> tuple[Optional[str], Optional[tuple[str, Any]]]:
     if question.type == "text":
-        if has_image:
-            sent = await bot.send_photo(
-                chat_id,
-                FSInputFile(question.image_path),
-                caption=text,
-                reply_markup=ReplyKeyboardRemove(),
-                parse_mode="HTML",
-            )
-        else:
-            sent = await bot.send_message(chat_id, text, reply_markup=ReplyKeyboardRemove(), parse_mode="HTML")
-        if response_id is not None:
-            await append_question_message_id(session, response_id, sent.message_id)
-        return sent
-
-    if question.type == "contact":
-        if has_image:
-            sent = await bot.send_photo(
-                chat_id,
-                FSInputFile(question.image_path),
-                caption=text,
-                reply_markup=build_contact_keyboard(),
-                parse_mode="HTML",
-            )
-        else:
-            sent = await bot.send_message(chat_id, text, reply_markup=build_contact_keyboard(), parse_mode="HTML")
-        if response_id is not None:
-            await append_question_message_id(session, response_id, sent.message_id)
-        return sent
+        if not message.text:
+            return None, ("Пожалуйста, отправьте текстовый ответ.", None)
+        value = message.text.strip()
+        await save_text_answer(session, response.id, question.id, value)
+        return value, None
+
+    if message.contact:
+        phone = message.contact.phone_number
+    elif message.text:
+        if message.text.strip().lower() == "ввести вручную":
+            return None, ("Введите номер телефона или ссылку на соцсеть.", ReplyKeyboardRemove())
+        phone = message.text.strip()
+    else:
+        return None, ("Пожалуйста, отправьте контакт или текст.", None)
+
+    await update_user_phone(session, user.id, phone)
+    await save_text_answer(session, response.id, question.id, phone)
+    return phone, None
+
+
+async def on_file_ingested(bot: Bot, uploaded_id: int) -> None:
+    async with unit_of_work() as session:
+        uploaded = await session.get(UploadedFile, uploaded_id)
+        if not uploaded:
+            return
+        response = await session.get(Response, uploaded.response_id)
+        if not response or response.status != "in_progress" or response.current_question_id != uploaded.question_id:
+            return
+        user = await session.get(User, response.user_id)
+        answer = await get_answer(session, response.id, uploaded.question_id)
+        files = await get_uploaded_files(session, answer.file_ids if answer else [])
+    survey = await get_compiled_survey_by_id(response.survey_id)
+    if not user:
+        return
+    await _edit_last_question_message(
+        bot, user.tg_id, response, survey.question(uploaded.question_id), _format_file_list(files), keep_file_keyboard=True
+    )
 
-    if question.type == "single_choice":
-        if has_image:
-            sent = await bot.send_photo(
-                chat_id,
-                FSInputFile(question.image_path),
-                caption=text,
-                reply_markup=build_single_choice_keyboard(question.id, question.options),
-                parse_mode="HTML",
-            )
-        else:
-            sent = await bot.send_message(
-                chat_id,
-                text,
-                reply_markup=build_single_choice_keyboard(question.id, question.options),
-                parse_mode="HTML",
-            )
-        if response_id is not None:
-            await append_question_message_id(session, response_id, sent.message_id)
-        return sent
 
-    if question.type == "multi_choice":
-        answer = None
-        if response_id is not None:
-            answer = await get_answer(session, response_id, question.id)
-        selected = set(answer.option_values or []) if answer else set()
-        keyboard = build_multi_choice_keyboard(question.id, question.options, selected)
-        if has_image:
-            sent = await bot.send_photo(
-                chat_id,
-                FSInputFile(question.image_path),
-                caption=text,
-                reply_markup=keyboard,
-                parse_mode="HTML",
-            )
-        else:
-            sent = await bot.send_message(chat_id, text, reply_markup=keyboard, parse_mode="HTML")
-        if response_id is not None:
-            await append_question_message_id(session, response_id, sent.message_id)
-        return sent
+async def send_question(bot: Bot, chat_id: int, question: CompiledQuestion, response_id: int | None) -> Message | None:
+    if question.code == "consent":
+        await _send_consent_files(bot, chat_id)
 
-    if question.type == "file":
-        if has_image:
-            sent = await bot.send_photo(
-                chat_id,
-                FSInputFile(question.image_path),
-                caption=text,
-                reply_markup=build_file_keyboard(question.id),
-                parse_mode="HTML",
-            )
-        else:
-            sent = await bot.send_message(chat_id, text, reply_markup=build_file_keyboard(question.id), parse_mode="HTML")
+    if question.type == "text":
+        reply_markup = ReplyKeyboardRemove()
+    elif question.type == "multi_choice":
+        reply_markup = question.keyboard
         if response_id is not None:
-            await append_question_message_id(session, response_id, sent.message_id)
-        return sent
-
-
-async def finish_response(message: Message, session: AsyncSession, response_id: int) -> None:
-    try:
-        if sheets_enabled():
-            await send_to_google_sheets(session, response_id)
-        else:
-            await send_to_google_sheets_stub(session, response_id)
-    except Exception:
-        pass
+            async with AsyncSessionLocal() as session:
+                answer = await get_answer(session, response_id, question.id)
+            if answer and answer.option_values:
+                reply_markup = build_multi_choice_keyboard(question.id, question.options, set(answer.option_values))
+    elif question.type in ("contact", "single_choice", "file"):
+        reply_markup = question.keyboard
+    else:
+        return None
+
+    text = question.rendered_text
+    photo = await question_photo(question)
+    if photo:
+        sent = await send_cached_photo(bot, chat_id, photo, caption=text, reply_markup=reply_markup, parse_mode="HTML")
+    else:
+        sent = await bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode="HTML")
+    if response_id is not None:
+        await record_question_messages(response_id, [sent.message_id])
+    return sent
+
+
+async def complete_response(session: AsyncSession, response_id: int) -> FinishedResponse:
+    await enqueue_sheets_export(session, response_id)
     summary = await _build_summary(session, response_id)
-    await _notify_admins(message.bot, session, response_id, summary)
+    admin_text = await _admin_notification(session, response_id, summary)
     response = await session.get(Response, response_id)
-    if response:
-        await _delete_messages(
-            message.bot,
-            message.chat.id,
-            list(response.question_message_ids or []) + list(response.user_message_ids or []),
-        )
-    await message.answer(summary, reply_markup=ReplyKeyboardRemove(), parse_mode="HTML")
+    message_ids = list(response.question_message_ids or []) + list(response.user_message_ids or []) if response else []
+    return FinishedResponse(summary=summary, admin_text=admin_text, message_ids=message_ids)
+
+
+async def finish_response(message: Message, finished: FinishedResponse) -> None:
+    if finished.admin_text:
+        await _notify_admins(message.bot, finished.admin_text)
+    await message.answer(finished.summary, reply_markup=ReplyKeyboardRemove(), parse_mode="HTML")
     await message.answer(SECOND_SURVEY_FOLLOWUP_MESSAGE, reply_markup=ReplyKeyboardRemove(), parse_mode="HTML")
     await message.answer(FOLLOW_UP_MESSAGE, parse_mode="HTML")
+    schedule_message_cleanup(message.bot, message.chat.id, finished.message_ids)
 
 
-async def _notify_admins(bot: Bot, session: AsyncSession, response_id: int, summary: str) -> None:
+async def _admin_notification(session: AsyncSession, response_id: int, summary: str) -> Optional[str]:
     response = await session.get(Response, response_id)
     if not response:
-        return
+        return None
     user = await session.get(User, response.user_id)
     if not user:
-        return
-    survey = await session.get(Survey, response.survey_id)
+        return None
+    survey = await get_compiled_survey_by_id(response.survey_id)
 
     name = " ".join([part for part in [user.first_name, user.last_name] if part]) or "—"
     username = f"@{user.username}" if user.username else "—"
@@ -459,20 +508,23 @@ async def _notify_admins(bot: Bot, session: AsyncSession, response_id: int, summ
             f"Telegram ID: {user.tg_id}",
         ]
     )
-    text = f"{header}\n\n{summary}"
+    return f"{header}\n\n{summary}"
 
-    for admin_id in ADMIN_NOTIFY_USER_IDS:
-        try:
-            await bot.send_message(admin_id, text, parse_mode="HTML")
-        except Exception:
-            continue
+
+async def _notify_admins(bot: Bot, text: str) -> None:
+    with send_priority(Priority.NOTIFICATION):
+        for admin_id in ADMIN_NOTIFY_USER_IDS:
+            try:
+                await bot.send_message(admin_id, text, parse_mode="HTML")
+            except Exception:
+                continue
 
 
-def _render_answered_question(question: Question, answer_text: str) -> str:
+def _render_answered_question(question: CompiledQuestion, answer_text: str) -> str:
     return f"<b>{question.text}</b>\n\n{answer_text}"
 
 
-def _format_option_values(question: Question, option_ids: list[int]) -> str:
+def _format_option_values(question: CompiledQuestion, option_ids: list[int]) -> str:
     if not option_ids:
         return "—"
     option_map = {opt.id: opt.text for opt in question.options}
@@ -485,11 +537,16 @@ def _format_file_list(files: list) -> str:
         return "Файлы не получены."
     lines = []
     for file in files:
-        lines.append(file.public_url or file.file_name)
+        if file.status == "pending":
+            lines.append(f"⏳ {file.file_name} — загружается")
+        elif file.status == "failed":
+            lines.append(f"⚠️ {file.file_name} — не удалось загрузить, отправьте ещё раз")
+        else:
+            lines.append(file.public_url or file.file_name)
     return "\n".join(lines)
 
 
-async def _edit_callback_message(callback: CallbackQuery, question: Question, answer_text: str) -> None:
+async def _edit_callback_message(callback: CallbackQuery, question: CompiledQuestion, answer_text: str) -> None:
     try:
         if callback.message.photo:
             await callback.message.edit_caption(
@@ -507,7 +564,7 @@ async def _edit_last_question_message(
     bot: Bot,
     chat_id: int,
     response: Response,
-    question: Question,
+    question: CompiledQuestion,
     answer_text: str,
     keep_file_keyboard: bool = False,
 ) -> None:
@@ -515,9 +572,9 @@ async def _edit_last_question_message(
     if not message_ids:
         return
     message_id = message_ids[-1]
-    reply_markup = build_file_keyboard(question.id) if keep_file_keyboard else None
+    reply_markup = question.keyboard if keep_file_keyboard else None
     try:
-        if _has_question_image(question):
+        if await question_photo(question):
             await bot.edit_message_caption(
                 caption=_render_answered_question(question, answer_text),
                 chat_id=chat_id,
@@ -537,10 +594,6 @@ async def _edit_last_question_message(
         return
 
 
-def _has_question_image(question: Question) -> bool:
-    return bool(question.image_path and os.path.exists(question.image_path))
-
-
 async def _send_consent_files(bot: Bot, chat_id: int) -> None:
     files = [
         BASE_DIR / "СОГЛАСИЕ_НА_ОБРАБОТКУ_ПЕРСОНАЛЬНЫХ_ДАННЫХ.pdf",
@@ -549,7 +602,7 @@ async def _send_consent_files(bot: Bot, chat_id: int) -> None:
         if not path.exists():
             continue
         try:
-            await bot.send_document(chat_id, FSInputFile(path))
+            await send_cached_document(bot, chat_id, path)
         except Exception:
             continue
 
@@ -558,11 +611,11 @@ async def _build_summary(session: AsyncSession, response_id: int) -> str:
     response = await session.get(Response, response_id)
     if not response:
         return "Спасибо! Анкета завершена."
-    survey = await session.get(Survey, response.survey_id)
-    questions = await get_questions(session, response.survey_id)
+    survey = await get_compiled_survey_by_id(response.survey_id)
+    questions = survey.questions
     answers = await get_response_answers(session, response.id)
     answers_map = {answer.question_id: answer for answer in answers}
-    options_map = await get_options_map(session, [q.id for q in questions])
+    options_map = survey.options_map()
 
     title_raw = f"Сводка анкеты: {survey.title}" if survey else "Сводка анкеты"
     lines = [html_escape(title_raw)]
@@ -580,7 +633,7 @@ async def _build_summary(session: AsyncSession, response_id: int) -> str:
 
 async def _format_answer_value(
     session: AsyncSession,
-    question: Question,
+    question: CompiledQuestion,
     answer,
     options_map: dict[int, dict[int, str]],
 ) -> str:
@@ -598,14 +651,6 @@ async def _format_answer_value(
     return "—"
 
 
-async def _delete_messages(bot: Bot, chat_id: int, message_ids: list[int]) -> None:
-    for message_id in message_ids:
-        try:
-            await bot.delete_message(chat_id=chat_id, message_id=message_id)
-        except Exception:
-            continue
-
-
 def _parse_callback(data: str) -> tuple[int | None, str]:
     if ":" not in data:
         return None, ""
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from contextlib import suppress
+from typing import Awaitable, Callable, Iterable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+from app.bot.scheduler import Priority, send_priority
+from app.config import settings
+from app.db import AsyncSessionLocal
+from app.metrics import detached_task
+from app.services.files import get_pending_file_ids, ingest_pending_file, mark_file_failed
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 2.0
+# How often a wait re-reads uploads that are downloaded elsewhere
+PENDING_POLL_INTERVAL = 1.0
+
+# Called with the bot and the uploaded file id once the file is stored or has failed for good.
+OnIngested = Callable[[Bot, int], Awaitable[None]]
+
+_jobs: dict[int, asyncio.Task] = {}
+_waiters: set[asyncio.Task] = set()
+_slots: Optional[asyncio.Semaphore] = None
+
+
+async def _ingest(bot: Bot, uploaded_id: int) -> None:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(settings.FILE_INGEST_WORKERS)
+    attempts = max(1, settings.FILE_INGEST_RETRIES)
+    async with _slots:
+        for attempt in range(1, attempts + 1):
+            try:
+                with send_priority(Priority.BACKGROUND):
+                    await ingest_pending_file(bot, uploaded_id)
+                return
+            except TelegramBadRequest as exc:
+                # e.g. "file is too big": retrying will not help.
+                logger.warning("Telegram refused file upload %s: %s", uploaded_id, exc)
+                break
+            except Exception:
+                logger.exception("Failed to ingest upload %s (attempt %d/%d)", uploaded_id, attempt, attempts)
+                if attempt < attempts:
+                    await asyncio.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+    await mark_file_failed(uploaded_id)
+
+
+async def _run(bot: Bot, uploaded_id: int, on_ingested: OnIngested) -> None:
+    try:
+        await _ingest(bot, uploaded_id)
+        await on_ingested(bot, uploaded_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Failed to finish upload %s", uploaded_id)
+
+
+def schedule_file_ingestion(bot: Bot, uploaded_id: int, on_ingested: OnIngested) -> None:
+    if uploaded_id in _jobs:
+        return
+    task = detached_task(_run(bot, uploaded_id, on_ingested))
+    _jobs[uploaded_id] = task
+    task.add_done_callback(lambda _: _jobs.pop(uploaded_id, None))
+
+
+async def wait_for_uploads(file_ids: Iterable[int], timeout: float | None = None) -> list[int]:
+    # The download may run in another process (the polling process, a restart in between), so the row status decides.
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + (settings.FILE_INGEST_WAIT_TIMEOUT if timeout is None else timeout)
+    pending = list(file_ids)
+    while pending:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        tasks = [_jobs[file_id] for file_id in pending if file_id in _jobs]
+        if tasks:
+            await asyncio.wait(tasks, timeout=remaining)
+        else:
+            await asyncio.sleep(min(PENDING_POLL_INTERVAL, remaining))
+        async with AsyncSessionLocal() as session:
+            pending = await get_pending_file_ids(session, pending)
+    return pending
+
+
+async def _run_after_uploads(file_ids: list[int], then: Callable[[], Awaitable[None]]) -> None:
+    try:
+        await wait_for_uploads(file_ids)
+        await then()
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Failed to finish after uploads %s", file_ids)
+
+
+def run_after_uploads(file_ids: Iterable[int], then: Callable[[], Awaitable[None]]) -> None:
+    # Waits outside the update handler, so a slow download holds neither the chat's turn nor a concurrency slot.
+    task = detached_task(_run_after_uploads(list(file_ids), then))
+    _waiters.add(task)
+    task.add_done_callback(_waiters.discard)
+
+
+async def resume_file_ingestion(bot: Bot, on_ingested: OnIngested) -> int:
+    async with AsyncSessionLocal() as session:
+        file_ids = await get_pending_file_ids(session)
+    for file_id in file_ids:
+        schedule_file_ingestion(bot, file_id, on_ingested)
+    if file_ids:
+        logger.info("Resumed %d pending uploads", len(file_ids))
+    return len(file_ids)
+
+
+async def drain_file_ingestion() -> None:
+    # Unfinished rows stay pending and are picked up again on the next start.
+    tasks = [*_jobs.values(), *_waiters]
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        with suppress(asyncio.CancelledError):
+            await task
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+
+from app.bot.dispatch import UpdateSerializer
+from app.bot.scheduler import SendScheduler
+from app.config import settings
+from app.metrics import COUNT_BUCKETS, REGISTRY, Counter, Gauge, Histogram, UpdateStats, current_update
+
+if TYPE_CHECKING:
+    from app.bot.runner import BotApp
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]]
+
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Time to handle one update", ("bot",))
+UPDATE_STATEMENTS = Histogram(
+    "bot_update_sql_statements", "SQL statements executed per update", ("bot",), buckets=COUNT_BUCKETS
+)
+UPDATE_COMMITS = Histogram("bot_update_sql_commits", "Commits per update", ("bot",), buckets=COUNT_BUCKETS)
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Handler latency", ("bot", "handler"))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Exceptions raised by handlers", ("bot", "handler", "error"))
+API_SECONDS = Histogram("telegram_api_seconds", "Telegram Bot API request latency", ("method",))
+API_ERRORS = Counter("telegram_api_errors_total", "Failed Telegram Bot API requests", ("method", "error"))
+SEND_QUEUE_DEPTH = Gauge("telegram_send_queue_depth", "Requests waiting for a rate limit slot", ("bot",))
+SEND_RETRIES = Counter("telegram_send_retries_total", "Requests retried after a 429", ("bot",))
+UPDATES_ACTIVE = Gauge("bot_updates_active", "Updates being handled right now")
+UPDATES_WAITING = Gauge("bot_updates_waiting", "Updates queued behind their chat or the concurrency limit")
+DUPLICATE_TAPS = Counter("bot_duplicate_taps_dropped_total", "Repeated button taps that were ignored")
+
+
+class UpdateMetrics(BaseMiddleware):
+    def __init__(self, bot_name: str) -> None:
+        self.bot_name = bot_name
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: dict[str, Any]) -> Any:
+        stats = UpdateStats(label=getattr(event, "event_type", "update"))
+        token = current_update.set(stats)
+        try:
+            return await handler(event, data)
+        finally:
+            current_update.reset(token)
+            elapsed = time.perf_counter() - stats.started
+            UPDATE_SECONDS.observe(elapsed, bot=self.bot_name)
+            UPDATE_STATEMENTS.observe(stats.statements, bot=self.bot_name)
+            UPDATE_COMMITS.observe(stats.commits, bot=self.bot_name)
+            if settings.SLOW_UPDATE_SECONDS and elapsed >= settings.SLOW_UPDATE_SECONDS:
+                logger.warning(
+                    "Slow update %s for bot %s (%s): %.0f ms, %s",
+                    getattr(event, "update_id", "?"),
+                    self.bot_name,
+                    stats.label,
+                    elapsed * 1000,
+                    stats.format_trace(),
+                )
+
+
+class HandlerMetrics(BaseMiddleware):
+    def __init__(self, bot_name: str) -> None:
+        self.bot_name = bot_name
+
+    async def __call__(self, handler: Handler, event: TelegramObject, data: dict[str, Any]) -> Any:
+        handler_object = data.get("handler")
+        callback = getattr(handler_object, "callback", None)
+        name = getattr(callback, "__name__", "unknown")
+        if callback is not None:
+            name = f"{callback.__module__.rsplit('.', 1)[-1]}.{name}"
+        stats = current_update.get()
+        if stats is not None:
+            stats.label = name
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as exc:
+            HANDLER_ERRORS.inc(bot=self.bot_name, handler=name, error=type(exc).__name__)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, bot=self.bot_name, handler=name)
+
+
+class ApiMetrics(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[Any],
+        bot: Bot,
+        method: TelegramMethod[Any],
+    ) -> Any:
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as exc:
+            API_ERRORS.inc(method=name, error=type(exc).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=name)
+
+
+def install_dispatcher_metrics(dp: Dispatcher, bot_name: str) -> None:
+    dp.update.outer_middleware(UpdateMetrics(bot_name))
+    handler_metrics = HandlerMetrics(bot_name)
+    for event_name, observer in dp.observers.items():
+        if event_name != "update":
+            observer.middleware(handler_metrics)
+
+
+def _scheduler(bot: Bot) -> SendScheduler | None:
+    return next((mw for mw in bot.session.middleware if isinstance(mw, SendScheduler)), None)
+
+
+def register_bot_collectors(apps: list[BotApp], serializer: UpdateSerializer) -> None:
+    def collect() -> None:
+        for bot_app in apps:
+            scheduler = _scheduler(bot_app.bot)
+            if scheduler is not None:
+                SEND_QUEUE_DEPTH.set(scheduler.queue_depth, bot=bot_app.name)
+                SEND_RETRIES.set_total(scheduler.retries, bot=bot_app.name)
+        UPDATES_ACTIVE.set(serializer.active)
+        UPDATES_WAITING.set(serializer.waiting)
+        DUPLICATE_TAPS.set_total(serializer.dropped)
+
+    REGISTRY.add_collector("bots", collect)
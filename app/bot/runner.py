@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import hmac
+import signal
+from contextlib import suppress
+from dataclasses import dataclass
+from pathlib import Path
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import (
+    BareFilesPathWrapper,
+    FilesPathWrapper,
+    SimpleFilesPathWrapper,
+    TelegramAPIServer,
+)
+
+from app.bot.assistant_test_handlers import register_assistant_test_handlers
+from app.bot.dispatch import UpdateSerializer
+from app.bot.handlers import on_file_ingested, register_handlers
+from app.bot.ingestion import resume_file_ingestion
+from app.bot.metrics import ApiMetrics, install_dispatcher_metrics, register_bot_collectors
+from app.bot.scheduler import SendScheduler
+from app.config import settings
+
+
+@dataclass
+class BotApp:
+    name: str
+    bot: Bot
+    dp: Dispatcher
+
+    @property
+    def webhook_path(self) -> str:
+        return f"/webhook/{self.name}"
+
+    @property
+    def webhook_secret(self) -> str:
+        # Telegram only accepts [A-Za-z0-9_-] here, so derive a per-bot hex token.
+        key = (settings.WEBHOOK_SECRET or self.bot.token).encode()
+        return hmac.new(key, self.name.encode(), hashlib.sha256).hexdigest()
+
+
+def telegram_api_server() -> TelegramAPIServer | None:
+    if not settings.TELEGRAM_API_URL:
+        return None
+    wrap_local_file: FilesPathWrapper = BareFilesPathWrapper()
+    if settings.TELEGRAM_API_SERVER_FILES_DIR and settings.TELEGRAM_API_LOCAL_FILES_DIR:
+        wrap_local_file = SimpleFilesPathWrapper(
+            Path(settings.TELEGRAM_API_SERVER_FILES_DIR), Path(settings.TELEGRAM_API_LOCAL_FILES_DIR)
+        )
+    return TelegramAPIServer.from_base(
+        settings.TELEGRAM_API_URL, is_local=settings.TELEGRAM_API_LOCAL, wrap_local_file=wrap_local_file
+    )
+
+
+def create_bot(token: str) -> Bot:
+    server = telegram_api_server()
+    bot = Bot(token=token, session=AiohttpSession(api=server)) if server else Bot(token=token)
+    bot.session.middleware(SendScheduler())
+    bot.session.middleware(ApiMetrics())
+    return bot
+
+
+def create_bot_apps() -> list[BotApp]:
+    # Shared by both dispatchers so the concurrency limit covers the whole process.
+    serializer = UpdateSerializer()
+    dp = Dispatcher()
+    dp.update.outer_middleware(serializer)
+    install_dispatcher_metrics(dp, "main")
+    register_handlers(dp)
+    apps = [BotApp("main", create_bot(settings.BOT_TOKEN), dp)]
+
+    if settings.ASSISTANT_TEST_BOT_TOKEN:
+        assistant_test_dp = Dispatcher()
+        assistant_test_dp.update.outer_middleware(serializer)
+        install_dispatcher_metrics(assistant_test_dp, "assistant_test")
+        register_assistant_test_handlers(assistant_test_dp)
+        apps.append(BotApp("assistant_test", create_bot(settings.ASSISTANT_TEST_BOT_TOKEN), assistant_test_dp))
+    register_bot_collectors(apps, serializer)
+    return apps
+
+
+async def resume_background_work(apps: list[BotApp]) -> None:
+    # Only the main bot asks for files.
+    main_app = next((bot_app for bot_app in apps if bot_app.name == "main"), None)
+    if main_app is not None:
+        await resume_file_ingestion(main_app.bot, on_file_ingested)
+
+
+async def start_polling(apps: list[BotApp]) -> list[asyncio.Task]:
+    await resume_background_work(apps)
+    tasks = []
+    for bot_app in apps:
+        await bot_app.bot.delete_webhook(drop_pending_updates=settings.BOT_DROP_PENDING_UPDATES)
+        tasks.append(
+            asyncio.create_task(
+                bot_app.dp.start_polling(
+                    bot_app.bot,
+                    allowed_updates=bot_app.dp.resolve_used_update_types(),
+                    handle_signals=False,
+                    close_bot_session=False,
+                )
+            )
+        )
+    return tasks
+
+
+async def setup_webhooks(apps: list[BotApp]) -> None:
+    if not settings.WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL is required when BOT_MODE=webhook")
+    base_url = settings.WEBHOOK_URL.rstrip("/")
+    await resume_background_work(apps)
+    for bot_app in apps:
+        url = f"{base_url}{bot_app.webhook_path}"
+        # Webhook mode runs as a single uvicorn worker: per-chat ordering and resumed downloads are per process.
+        await bot_app.bot.set_webhook(
+            url=url,
+            secret_token=bot_app.webhook_secret,
+            allowed_updates=bot_app.dp.resolve_used_update_types(),
+            drop_pending_updates=settings.BOT_DROP_PENDING_UPDATES,
+        )
+
+
+async def close_bot_apps(apps: list[BotApp]) -> None:
+    for bot_app in apps:
+        await bot_app.bot.session.close()
+
+
+async def run_polling() -> None:
+    from app.bot.cleanup import drain_cleanup_tasks
+    from app.bot.ingestion import drain_file_ingestion
+    from app.db import AsyncSessionLocal, init_db
+    from app.seed import seed_if_empty
+    from app.metrics import monitor_event_loop_lag
+    from app.services.media_cache import drain_media_cache_writes
+    from app.services.media_manifest import run_media_manifest
+    from app.web.metrics import start_metrics_server
+
+    await init_db()
+    async with AsyncSessionLocal() as session:
+        await seed_if_empty(session)
+    apps = create_bot_apps()
+    tasks = await start_polling(apps)
+    metrics_runner = await start_metrics_server(settings.METRICS_PORT) if settings.METRICS_PORT else None
+    # Same as the web app lifespan: questions are sent from this process, so it needs the media manifest.
+    background = [
+        asyncio.create_task(run_media_manifest()),
+        asyncio.create_task(monitor_event_loop_lag()),
+    ]
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, lambda: [task.cancel() for task in tasks])
+    try:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        for task in background:
+            task.cancel()
+        for task in background:
+            with suppress(asyncio.CancelledError):
+                await task
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await drain_file_ingestion()
+        await drain_cleanup_tasks()
+        await drain_media_cache_writes()
+        await close_bot_apps(apps)
+
+
+if __name__ == "__main__":
+    asyncio.run(run_polling())
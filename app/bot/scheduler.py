@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import itertools
+import logging
+from contextlib import contextmanager, suppress
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Iterator
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMediaGroup, TelegramMethod
+
+from app.config import settings
+from app.db import write_gate
+from app.metrics import detached_task
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    NOTIFICATION = 1
+    BACKGROUND = 2
+
+
+_current_priority: ContextVar[Priority] = ContextVar("send_priority", default=Priority.INTERACTIVE)
+# The chat whose update is being handled; set by UpdateSerializer.
+_reply_chat: ContextVar[int | str | None] = ContextVar("reply_chat", default=None)
+
+
+@contextmanager
+def send_priority(priority: Priority) -> Iterator[None]:
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+@contextmanager
+def replying_to(chat_id: int | str | None) -> Iterator[None]:
+    token = _reply_chat.set(chat_id)
+    try:
+        yield
+    finally:
+        _reply_chat.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def delay(self, now: float, cost: float = 1.0) -> float:
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        needed = min(cost, self.capacity)
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def take(self, now: float, cost: float = 1.0) -> None:
+        self._refill(now)
+        self.tokens -= cost
+
+    def drain(self, now: float, cost: float = 1.0) -> None:
+        # Like take(), but never goes into debt: an unthrottled reply must not stall the next send for long.
+        self._refill(now)
+        self.tokens = max(0.0, self.tokens - cost)
+
+    def blocked_for(self, now: float) -> float:
+        return max(0.0, self.blocked_until - now)
+
+    def block(self, now: float, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    chat_id: int | str = field(compare=False)
+    cost: float = field(compare=False)
+    chat_limited: bool = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+@dataclass
+class PriorityStats:
+    requests: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+
+class SendScheduler(BaseRequestMiddleware):
+    def __init__(
+        self,
+        global_rate: float | None = None,
+        chat_rate: float | None = None,
+        chat_burst: float | None = None,
+        group_rate: float | None = None,
+        max_retries: int | None = None,
+    ) -> None:
+        self.global_rate = global_rate or settings.TELEGRAM_GLOBAL_RATE
+        self.chat_rate = chat_rate or settings.TELEGRAM_CHAT_RATE
+        self.chat_burst = chat_burst or settings.TELEGRAM_CHAT_BURST
+        self.group_rate = group_rate or settings.TELEGRAM_GROUP_RATE
+        self.max_retries = settings.TELEGRAM_MAX_RETRIES if max_retries is None else max_retries
+        self.stats = {priority: PriorityStats() for priority in Priority}
+        self.retries = 0
+        self._waiters: list[_Waiter] = []
+        self._seq = itertools.count()
+        self._global: TokenBucket | None = None
+        self._chats: dict[int | str, TokenBucket] = {}
+        self._wake: asyncio.Event | None = None
+        self._runner: asyncio.Task | None = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[Any],
+        bot: Bot,
+        method: TelegramMethod[Any],
+    ) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        cost = float(len(method.media)) if isinstance(method, SendMediaGroup) else 1.0
+        priority = _current_priority.get()
+        # Replies to the user whose update is being handled skip the per-chat rate: one answer is an
+        # edit, an album and a message, and making the user wait for them is what the limit is meant to avoid.
+        # They still count towards the global rate and respect a 429 for the chat.
+        chat_limited = not (priority == Priority.INTERACTIVE and chat_id == _reply_chat.get())
+        if write_gate.held_by_current_task():
+            logger.warning("%s is sent while the SQLite write lock is held", type(method).__name__)
+        attempt = 0
+        while True:
+            await self._acquire(chat_id, cost, priority, chat_limited)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as exc:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+                loop = asyncio.get_running_loop()
+                self._chat_bucket(chat_id, loop.time()).block(loop.time(), float(exc.retry_after))
+
+    def _chat_bucket(self, chat_id: int | str, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = TokenBucket(rate, self.chat_burst, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id: int | str, cost: float, priority: Priority, chat_limited: bool = True) -> None:
+        loop = asyncio.get_running_loop()
+        if self._runner is None or self._runner.done():
+            self._wake = asyncio.Event()
+            self._global = TokenBucket(self.global_rate, self.global_rate, loop.time())
+            # Started by whichever send comes first; it must not keep that update's context for the process lifetime.
+            self._runner = detached_task(self._run())
+        waiter = _Waiter(int(priority), next(self._seq), chat_id, cost, chat_limited, loop.time(), loop.create_future())
+        bisect.insort(self._waiters, waiter)
+        self._wake.set()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with suppress(ValueError):
+                self._waiters.remove(waiter)
+            raise
+        waited = loop.time() - waiter.enqueued_at
+        stats = self.stats[priority]
+        stats.requests += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wake.clear()
+            now = loop.time()
+            self._waiters = [waiter for waiter in self._waiters if not waiter.future.done()]
+            if not self._waiters:
+                self._prune(now)
+                await self._wake.wait()
+                continue
+
+            timeout = self._global.delay(now)
+            if timeout == 0:
+                timeout = float("inf")
+                # Highest priority first; a chat that is over its limit does not hold back other chats.
+                for waiter in self._waiters:
+                    bucket = self._chat_bucket(waiter.chat_id, now)
+                    delay = bucket.delay(now, waiter.cost) if waiter.chat_limited else bucket.blocked_for(now)
+                    if delay == 0:
+                        if waiter.chat_limited:
+                            bucket.take(now, waiter.cost)
+                        else:
+                            bucket.drain(now, waiter.cost)
+                        self._global.take(now)
+                        self._waiters.remove(waiter)
+                        waiter.future.set_result(None)
+                        timeout = 0
+                        break
+                    timeout = min(timeout, delay)
+            if timeout > 0:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+
+    def _prune(self, now: float) -> None:
+        if len(self._chats) < 1000:
+            return
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.idle(now)]:
+            del self._chats[chat_id]
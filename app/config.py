@@ -8,6 +8,7 @@ BASE_DIR = Path(__file__).resolve().parents[1]
 DATA_DIR = BASE_DIR / "data"
 FILES_DIR = DATA_DIR / "files"
 QUESTION_IMAGES_DIR = DATA_DIR / "question_images"
+OPTIMIZED_IMAGES_DIR = DATA_DIR / "optimized"
 
 
 class Settings(BaseSettings):
@@ -16,11 +17,60 @@ class Settings(BaseSettings):
     BOT_TOKEN: str
     ASSISTANT_TEST_BOT_TOKEN: str = ""
     WEBHOOK_URL: str = ""
+    WEBHOOK_SECRET: str = ""
+    # polling: poll inside the web app, webhook: receive updates over HTTP,
+    # polling_process: the web app only serves HTTP, run `python -m app.bot.runner` to poll
+    BOT_MODE: str = "polling"
+    BOT_DROP_PENDING_UPDATES: bool = False
+    # Updates of one chat run in order; this many chats are handled at once across both bots
+    BOT_MAX_CONCURRENT_UPDATES: int = 64
+    # Repeated taps on the same button within this many seconds are ignored
+    BOT_DUPLICATE_TAP_WINDOW: float = 1.0
     FILES_BASE_URL: str
     ADMIN_TOKEN: str = ""
+    # Admin upload limits in bytes
+    ADMIN_MAX_PDF_SIZE: int = 20 * 1024 * 1024
+    ADMIN_MAX_IMAGE_SIZE: int = 10 * 1024 * 1024
+    # Candidate file downloads: browser cache lifetime, metadata cache entries and optional proxy offload
+    # (FILES_SENDFILE_MODE=x-accel for nginx, x-sendfile for Apache/lighttpd)
+    FILES_CACHE_MAX_AGE: int = 7 * 24 * 3600
+    FILES_META_CACHE_SIZE: int = 4096
+    FILES_SENDFILE_MODE: str = ""
+    FILES_ACCEL_PREFIX: str = "/protected-files/"
+    # Links to candidate files are HMAC-signed with this key (the bot token when empty);
+    # FILES_URL_TTL > 0 makes new links expire after that many seconds.
+    FILES_SIGNING_KEY: str = ""
+    FILES_URL_TTL: int = 0
+    # Keep serving /files/<id> links of files uploaded before signing, which are already in Sheets
+    FILES_ALLOW_LEGACY_IDS: bool = True
+    # Candidate uploads are downloaded from Telegram in the background by this many workers
+    FILE_INGEST_WORKERS: int = 4
+    FILE_INGEST_RETRIES: int = 3
+    # How long "Завершить загрузку" waits for downloads still in progress
+    FILE_INGEST_WAIT_TIMEOUT: float = 120.0
+    # GET /metrics in Prometheus text format; when set, scrapers must send "Authorization: Bearer <token>".
+    # METRICS_PORT serves the same page from `python -m app.bot.runner` (BOT_MODE=polling_process).
+    METRICS_TOKEN: str = ""
+    METRICS_PORT: int = 0
+    # Updates slower than this are logged with every SQL statement they ran (0 turns it off)
+    SLOW_UPDATE_SECONDS: float = 1.0
 
     DB_URL: str = f"sqlite+aiosqlite:///{(DATA_DIR / 'app.db').as_posix()}"
 
+    # SQLite profile: WAL, tuned pragmas and one writer at a time per process
+    SQLITE_TUNED: bool = True
+    SQLITE_BUSY_TIMEOUT: float = 5.0
+    SQLITE_CACHE_SIZE_KB: int = 20000
+    SQLITE_MMAP_SIZE: int = 268435456
+    SQLITE_WRITE_TIMEOUT: float = 30.0
+    SQLITE_WRITE_QUEUE_SIZE: int = 1000
+
+    # PostgreSQL connection pool (DB_URL=postgresql+asyncpg://...)
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+
     # Survey codes per bot
     ASSISTANT_MAIN_SURVEY_CODE: str = "assistant_v1"
     ASSISTANT_TEST_SURVEY_CODE: str = "assistant_test_v1"
@@ -28,6 +78,23 @@ class Settings(BaseSettings):
     # Assistant test PDFs
     ASSISTANT_TEST_PDF_DIR: str = str(DATA_DIR / "assistant_test_pdfs")
 
+    # Outbound Telegram rate limits (requests per second); replies to the chat being served skip the per-chat one
+    TELEGRAM_GLOBAL_RATE: float = 25.0
+    TELEGRAM_CHAT_RATE: float = 1.0
+    TELEGRAM_CHAT_BURST: float = 5.0
+    TELEGRAM_GROUP_RATE: float = 0.33
+    TELEGRAM_MAX_RETRIES: int = 3
+
+    # Self-hosted Bot API server (https://github.com/tdlib/telegram-bot-api), e.g. http://127.0.0.1:8081.
+    # With TELEGRAM_API_LOCAL=true (server started with --local) files up to 2 GB are read from its disk;
+    # set both *_FILES_DIR when that disk is mounted at another path here.
+    TELEGRAM_API_URL: str = ""
+    TELEGRAM_API_LOCAL: bool = False
+    TELEGRAM_API_SERVER_FILES_DIR: str = ""
+    TELEGRAM_API_LOCAL_FILES_DIR: str = ""
+    # Seconds allowed for one file download over HTTP
+    TELEGRAM_DOWNLOAD_TIMEOUT: int = 300
+
     # Google Sheets (optional)
     GOOGLE_SHEET_ID: str = ""
     GOOGLE_SHEET_TAB: str = "Sheet1"
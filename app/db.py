@@ -1,41 +1,186 @@
 from __future__ import annotations
 
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator
+
+from sqlalchemy import event, make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import ORMExecuteState, Session, SessionTransaction
+from sqlalchemy.util import await_only
 
 from app.config import settings
-from app.models import Base
+from app.metrics import instrument_engine
+from app.migrations import run_migrations
 
-engine = create_async_engine(settings.DB_URL, echo=False, future=True)
-AsyncSessionLocal = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+DEFER_COMMIT = "defer_commit"
+HOLDS_WRITE_LOCK = "holds_write_lock"
 
 
-async def init_db() -> None:
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        await conn.run_sync(_ensure_response_columns)
-        await conn.run_sync(_ensure_question_columns)
+class WriteGate:
+    def __init__(self, timeout: float, max_waiters: int) -> None:
+        self.timeout = timeout
+        self.max_waiters = max_waiters
+        self.waiting = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock: asyncio.Lock | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._owner: asyncio.Task | None = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+            self._owner = None
+        return self._lock
+
+    async def acquire(self) -> None:
+        lock = self._get_lock()
+        task = asyncio.current_task()
+        if self._owner is not None and self._owner is task:
+            # A second session writing from the same task would wait for itself forever.
+            raise RuntimeError("Nested SQLite write transaction in the same task")
+        if self.waiting >= self.max_waiters:
+            raise RuntimeError("SQLite write queue is full")
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(lock.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError("Timed out waiting for the SQLite write queue") from None
+        finally:
+            self.waiting -= 1
+        waited = loop.time() - started
+        self._owner = task
+        self.acquired += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def held_by_current_task(self) -> bool:
+        return self._owner is not None and self._owner is asyncio.current_task()
+
+    def release(self) -> None:
+        self._owner = None
+        if self._lock is not None and self._lock.locked():
+            self._lock.release()
+
+
+write_gate = WriteGate(settings.SQLITE_WRITE_TIMEOUT, settings.SQLITE_WRITE_QUEUE_SIZE)
+
+
+class SerializedWriteSession(Session):
+    pass
+
+
+def _acquire_write_lock(session: Session) -> None:
+    if session.info.get(HOLDS_WRITE_LOCK):
+        return
+    await_only(write_gate.acquire())
+    session.info[HOLDS_WRITE_LOCK] = True
+
+
+@event.listens_for(SerializedWriteSession, "before_flush")
+def _lock_before_flush(session: Session, flush_context: Any, instances: Any) -> None:
+    if session.new or session.dirty or session.deleted:
+        _acquire_write_lock(session)
+
+
+@event.listens_for(SerializedWriteSession, "do_orm_execute")
+def _lock_before_dml(state: ORMExecuteState) -> None:
+    if state.is_insert or state.is_update or state.is_delete:
+        _acquire_write_lock(state.session)
+
 
+@event.listens_for(SerializedWriteSession, "after_transaction_end")
+def _unlock_after_transaction(session: Session, transaction: SessionTransaction) -> None:
+    if transaction.parent is None and session.info.pop(HOLDS_WRITE_LOCK, False):
+        write_gate.release()
 
-def _ensure_response_columns(conn) -> None:
-    result = conn.exec_driver_sql("PRAGMA table_info(responses)")
-    existing = {row[1] for row in result.fetchall()}
-    if "question_message_ids" not in existing:
-        conn.exec_driver_sql("ALTER TABLE responses ADD COLUMN question_message_ids TEXT")
-    if "user_message_ids" not in existing:
-        conn.exec_driver_sql("ALTER TABLE responses ADD COLUMN user_message_ids TEXT")
 
+def _apply_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT * 1000)}")
+    cursor.execute(f"PRAGMA cache_size=-{settings.SQLITE_CACHE_SIZE_KB}")
+    cursor.execute(f"PRAGMA mmap_size={settings.SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
 
-def _ensure_question_columns(conn) -> None:
-    result = conn.exec_driver_sql("PRAGMA table_info(questions)")
-    existing = {row[1] for row in result.fetchall()}
-    if "image_path" not in existing:
-        conn.exec_driver_sql("ALTER TABLE questions ADD COLUMN image_path TEXT")
-    if "image_name" not in existing:
-        conn.exec_driver_sql("ALTER TABLE questions ADD COLUMN image_name TEXT")
-    if "image_mime" not in existing:
-        conn.exec_driver_sql("ALTER TABLE questions ADD COLUMN image_mime TEXT")
+
+def _engine_options(url: str) -> dict[str, Any]:
+    if make_url(url).get_backend_name() != "postgresql":
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+def build_engine(url: str, tuned: bool = True) -> AsyncEngine:
+    db_engine = create_async_engine(url, echo=False, future=True, **_engine_options(url))
+    if tuned and db_engine.dialect.name == "sqlite":
+        event.listen(db_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    return db_engine
+
+
+def build_sessionmaker(db_engine: AsyncEngine, tuned: bool = True) -> async_sessionmaker[AsyncSession]:
+    # SQLite allows one writer at a time: queue writers here instead of letting them spin on "database is locked".
+    serialize = tuned and db_engine.dialect.name == "sqlite"
+    return async_sessionmaker(
+        db_engine,
+        class_=AsyncSession,
+        sync_session_class=SerializedWriteSession if serialize else Session,
+        expire_on_commit=False,
+    )
+
+
+engine = build_engine(settings.DB_URL, settings.SQLITE_TUNED)
+instrument_engine(engine)
+AsyncSessionLocal = build_sessionmaker(engine, settings.SQLITE_TUNED)
+
+
+def dialect_insert(session: AsyncSession):
+    # Both backends support INSERT ... ON CONFLICT, but through their own insert() constructs.
+    return postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+
+
+async def init_db() -> None:
+    await run_migrations(engine)
 
 
 async def get_session() -> AsyncSession:
     async with AsyncSessionLocal() as session:
         yield session
+
+
+@asynccontextmanager
+async def unit_of_work() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as session:
+        session.info[DEFER_COMMIT] = True
+        try:
+            yield session
+        except BaseException:
+            await session.rollback()
+            raise
+        session.info.pop(DEFER_COMMIT, None)
+        await session.commit()
+
+
+async def commit_or_defer(session: AsyncSession, *instances: object) -> None:
+    if session.info.get(DEFER_COMMIT):
+        # Inside a unit of work only new rows are flushed, and only when their ids are needed.
+        if any(getattr(instance, "id", None) is None for instance in instances):
+            await session.flush()
+        return
+    await session.commit()
+    for instance in instances:
+        await session.refresh(instance)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
+
+from app.db import DEFER_COMMIT, build_engine, build_sessionmaker
+from app.models import Base, Question, Survey
+from app.seed import seed_if_empty
+from app.services.survey import (
+    advance_response,
+    append_question_message_id,
+    get_user_with_active_response,
+    save_option_answer,
+    start_new_response,
+)
+from app.services.survey_cache import compile_survey
+
+
+@dataclass
+class BenchResult:
+    profile: str
+    updates: int
+    failed: int
+    elapsed: float
+    latencies: list[float] = field(default_factory=list)
+
+    @property
+    def rate(self) -> float:
+        return self.updates / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, value: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * value))]
+
+
+async def run_profile(
+    profile: str, updates: int, concurrency: int, users: int, io_delay: float, url: str | None = None
+) -> BenchResult:
+    tuned = profile == "tuned"
+    with tempfile.TemporaryDirectory() as tmp:
+        db_engine = build_engine(url or f"sqlite+aiosqlite:///{(Path(tmp) / 'bench.db').as_posix()}", tuned)
+        sessionmaker = build_sessionmaker(db_engine, tuned)
+        async with db_engine.begin() as conn:
+            if url:
+                await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        async with sessionmaker() as session:
+            await seed_if_empty(session)
+            result = await session.execute(
+                select(Survey).options(selectinload(Survey.questions).selectinload(Question.options))
+            )
+            surveys = [compile_survey(survey) for survey in result.scalars().all()]
+        survey = next(s for s in surveys if all(q.options for q in s.questions))
+
+        # Each update mirrors a callback tap: load the user and response, save the answer, move on.
+        async def handle_update(tg_id: int) -> None:
+            async with sessionmaker() as session:
+                session.info[DEFER_COMMIT] = True
+                user, response = await get_user_with_active_response(session, survey.id, tg_id, "bench", "Bench", None)
+                if response is None or response.current_question_id is None:
+                    response = await start_new_response(session, user.id, survey.id, survey.first_question.id)
+                question = survey.question(response.current_question_id)
+                await save_option_answer(session, response.id, question.id, [random.choice(question.options).id])
+                await advance_response(session, response, survey)
+                if io_delay:
+                    await asyncio.sleep(io_delay)
+                await append_question_message_id(session, response.id, random.randint(1, 10**9))
+                await session.commit()
+
+        latencies: list[float] = []
+        failed = 0
+
+        # Updates of one chat arrive one after another, different chats run concurrently.
+        async def lane(index: int) -> None:
+            nonlocal failed
+            chats = range(index + 1, users + 1, concurrency) or [index + 1]
+            for _ in range(index, updates, concurrency):
+                started = time.perf_counter()
+                try:
+                    await handle_update(random.choice(chats))
+                except Exception:
+                    failed += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(lane(index) for index in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        await db_engine.dispose()
+    return BenchResult(db_engine.dialect.name if url else profile, updates - failed, failed, elapsed, latencies)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrent survey updates against a scratch database")
+    parser.add_argument("--profile", choices=["default", "tuned", "both"], default="both")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--io-delay", type=float, default=0.0, help="seconds spent 'sending' inside each update")
+    parser.add_argument("--url", help="run against this database instead of a temporary SQLite file; its tables are dropped")
+    args = parser.parse_args()
+
+    profiles = ["default", "tuned"] if args.profile == "both" and not args.url else [args.profile]
+    for profile in profiles:
+        result = await run_profile(profile, args.updates, args.concurrency, args.users, args.io_delay, args.url)
+        mean = statistics.mean(result.latencies) * 1000 if result.latencies else 0.0
+        print(
+            f"{result.profile:8} {result.rate:8.1f} updates/s  ok={result.updates} failed={result.failed}  "
+            f"mean={mean:.1f}ms p95={result.percentile(0.95) * 1000:.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
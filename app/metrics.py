@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import asyncio
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import Context, ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Coroutine, Iterator, Optional, TypeVar, Union
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+LOOP_LAG_INTERVAL = 0.5
+TRACE_LIMIT = 200
+TRACE_STATEMENT_LENGTH = 300
+
+Collector = Callable[[], Union[None, Awaitable[None]]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (), registry: Optional[Registry] = None) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: dict[tuple[str, ...], Any] = {}
+        (registry or REGISTRY).register(self)
+
+    def _key(self, labels: dict[str, Any]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _label_text(self, key: tuple[str, ...], extra: tuple[tuple[str, str], ...] = ()) -> str:
+        pairs = [*zip(self.labels, key), *extra]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{self._label_text(key)} {_format_value(value)}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value: float, **labels: Any) -> None:
+        # For totals counted by another component and copied in at scrape time.
+        self._values[self._key(labels)] = value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = value
+
+
+@dataclass
+class _HistogramValue:
+    buckets: list[int]
+    total: float = 0.0
+    count: int = 0
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        registry: Optional[Registry] = None,
+    ) -> None:
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labels, registry)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        item = self._values.get(key)
+        if item is None:
+            item = self._values[key] = _HistogramValue([0] * len(self.buckets))
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            item.buckets[index] += 1
+        item.total += value
+        item.count += 1
+
+    def samples(self) -> Iterator[str]:
+        for key, item in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, item.buckets):
+                cumulative += count
+                yield f"{self.name}_bucket{self._label_text(key, (('le', _format_value(bound)),))} {cumulative}"
+            yield f"{self.name}_bucket{self._label_text(key, (('le', '+Inf'),))} {item.count}"
+            yield f"{self.name}_sum{self._label_text(key)} {_format_value(item.total)}"
+            yield f"{self.name}_count{self._label_text(key)} {item.count}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+        self._collectors: dict[str, Collector] = {}
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def add_collector(self, name: str, collector: Collector) -> None:
+        # Collectors copy queue depths and similar state into gauges right before a scrape.
+        self._collectors[name] = collector
+
+    async def render(self) -> str:
+        for name, collector in list(self._collectors.items()):
+            try:
+                result = collector()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logger.exception("Metrics collector %s failed", name)
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+
+@dataclass
+class QueryTrace:
+    offset: float
+    seconds: float
+    statement: str
+
+
+@dataclass
+class UpdateStats:
+    label: str = ""
+    statements: int = 0
+    commits: int = 0
+    sql_seconds: float = 0.0
+    started: float = field(default_factory=time.perf_counter)
+    trace: list[QueryTrace] = field(default_factory=list)
+
+    def _record(self, seconds: float, statement: str) -> None:
+        if len(self.trace) < TRACE_LIMIT:
+            offset = time.perf_counter() - self.started - seconds
+            self.trace.append(QueryTrace(offset, seconds, " ".join(statement.split())[:TRACE_STATEMENT_LENGTH]))
+
+    def add_statement(self, statement: str, seconds: float) -> None:
+        self.statements += 1
+        self.sql_seconds += seconds
+        self._record(seconds, statement)
+
+    def add_commit(self) -> None:
+        self.commits += 1
+        self._record(0.0, "COMMIT")
+
+    def merge(self, other: UpdateStats) -> None:
+        self.statements += other.statements
+        self.commits += other.commits
+        self.sql_seconds += other.sql_seconds
+        for item in other.trace:
+            if len(self.trace) >= TRACE_LIMIT:
+                break
+            self.trace.append(QueryTrace(item.offset + other.started - self.started, item.seconds, item.statement))
+
+    def format_trace(self) -> str:
+        # Parameters are left out on purpose: they carry candidates' answers.
+        lines = [
+            f"{self.statements} statements, {self.commits} commits, {self.sql_seconds * 1000:.1f} ms in SQL",
+            *(f"  +{item.offset * 1000:8.1f} ms {item.seconds * 1000:7.1f} ms  {item.statement}" for item in self.trace),
+        ]
+        if self.statements + self.commits > len(self.trace):
+            lines.append(f"  ... {self.statements + self.commits - len(self.trace)} more not traced")
+        return "\n".join(lines)
+
+
+# Set for the duration of one Telegram update; SQL run on its behalf is counted here.
+current_update: ContextVar[Optional[UpdateStats]] = ContextVar("current_update", default=None)
+
+T = TypeVar("T")
+
+
+def detached_task(coro: Coroutine[Any, Any, T]) -> asyncio.Task[T]:
+    # A task copies the context it is created in. Work that outlives the update (cache writes, downloads,
+    # cleanups) starts from an empty one, so its SQL is not billed to that update and it inherits no send
+    # priority or reply chat.
+    return Context().run(asyncio.create_task, coro)
+
+DB_STATEMENT_SECONDS = Histogram("db_statement_seconds", "SQL statement execution time", ("operation",))
+DB_COMMITS = Counter("db_commits_total", "Committed database transactions")
+LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop woke up a sleeping task",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+LOOP_LAG_LAST = Gauge("event_loop_lag_last_seconds", "Event loop lag at the last measurement")
+
+
+def _operation(statement: str) -> str:
+    head = statement.lstrip().split(None, 1)
+    return head[0].upper() if head else "OTHER"
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_STATEMENT_SECONDS.observe(elapsed, operation=_operation(statement))
+        stats = current_update.get()
+        if stats is not None:
+            stats.add_statement(statement, elapsed)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _handle_error(context) -> None:
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+    @event.listens_for(sync_engine, "commit")
+    def _commit(conn) -> None:
+        DB_COMMITS.inc()
+        stats = current_update.get()
+        if stats is not None:
+            stats.add_commit()
+
+
+@contextmanager
+def query_budget(max_statements: int, max_commits: Optional[int] = None, label: str = "") -> Iterator[UpdateStats]:
+    # For tests: `with query_budget(8, max_commits=1): await handler(...)` fails with the trace when exceeded.
+    outer = current_update.get()
+    stats = UpdateStats(label=label)
+    token = current_update.set(stats)
+    try:
+        yield stats
+    finally:
+        current_update.reset(token)
+        if outer is not None:
+            outer.merge(stats)
+    problems = []
+    if stats.statements > max_statements:
+        problems.append(f"{stats.statements} statements (budget {max_statements})")
+    if max_commits is not None and stats.commits > max_commits:
+        problems.append(f"{stats.commits} commits (budget {max_commits})")
+    if problems:
+        raise AssertionError(f"{label or 'Query budget'} exceeded: {', '.join(problems)}\n{stats.format_trace()}")
+
+
+async def monitor_event_loop_lag(interval: float = LOOP_LAG_INTERVAL) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        LOOP_LAG_SECONDS.observe(lag)
+        LOOP_LAG_LAST.set(lag)
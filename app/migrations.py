@@ -0,0 +1,385 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import zlib
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Callable
+
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    and_,
+    bindparam,
+    func,
+    inspect,
+    literal,
+    or_,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.config import settings
+from app.models import Answer, Base, Option, Question, Response, StoredBlob, Survey, UploadedFile, User
+from app.services.scoring import classify_scores, score_key
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHUNK_SIZE = 1000
+# Serializes migration runs of several processes (web app and polling process) on PostgreSQL.
+ADVISORY_LOCK_KEY = zlib.crc32(b"schema_migrations")
+ADVISORY_LOCK_POLL_INTERVAL = 0.5
+# How long a second process waits on SQLite while another one migrates
+SQLITE_LOCK_TIMEOUT_MS = 10 * 60 * 1000
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+    # On PostgreSQL non-transactional steps run in autocommit mode: online index builds and chunked backfills.
+    transactional: bool = True
+
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(version: int, name: str, *, transactional: bool = True):
+    def decorator(fn: Callable[[Connection], None]) -> Callable[[Connection], None]:
+        if any(m.version == version for m in MIGRATIONS):
+            raise RuntimeError(f"Duplicate migration version {version}")
+        MIGRATIONS.append(Migration(version, name, fn, transactional))
+        return fn
+
+    return decorator
+
+
+def _autocommit(conn: Connection) -> bool:
+    return conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT"
+
+
+def add_column(conn: Connection, table: str, column: Column) -> None:
+    existing = {col["name"] for col in inspect(conn).get_columns(table)}
+    if column.name in existing:
+        return
+    preparer = conn.dialect.identifier_preparer
+    ddl = f"ALTER TABLE {preparer.quote(table)} ADD COLUMN {preparer.quote(column.name)} {column.type.compile(dialect=conn.dialect)}"
+    if column.server_default is not None:
+        default = literal(column.server_default.arg).compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        ddl += f" DEFAULT {default}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    conn.exec_driver_sql(ddl)
+
+
+def drop_column(conn: Connection, table: str, column: str) -> None:
+    existing = {col["name"] for col in inspect(conn).get_columns(table)}
+    if column not in existing:
+        return
+    preparer = conn.dialect.identifier_preparer
+    conn.exec_driver_sql(f"ALTER TABLE {preparer.quote(table)} DROP COLUMN {preparer.quote(column)}")
+
+
+def create_index(conn: Connection, index: Index) -> None:
+    preparer = conn.dialect.identifier_preparer
+    columns = ", ".join(preparer.quote(col.name) for col in index.columns)
+    unique = "UNIQUE " if index.unique else ""
+    # PostgreSQL builds the index without blocking writers; this needs an autocommit connection.
+    concurrently = "CONCURRENTLY " if conn.dialect.name == "postgresql" and _autocommit(conn) else ""
+    conn.exec_driver_sql(
+        f"CREATE {unique}INDEX {concurrently}IF NOT EXISTS {preparer.quote(index.name)} "
+        f"ON {preparer.quote(index.table.name)} ({columns})"
+    )
+
+
+@migration(1, "create tables")
+def _create_tables(conn: Connection) -> None:
+    Base.metadata.create_all(conn)
+
+
+@migration(2, "response message ids")
+def _response_message_ids(conn: Connection) -> None:
+    add_column(conn, "responses", Column("question_message_ids", JSON))
+    add_column(conn, "responses", Column("user_message_ids", JSON))
+
+
+@migration(3, "question images")
+def _question_images(conn: Connection) -> None:
+    add_column(conn, "questions", Column("image_path", Text))
+    add_column(conn, "questions", Column("image_name", String(255)))
+    add_column(conn, "questions", Column("image_mime", String(255)))
+
+
+@migration(4, "users keyset index", transactional=False)
+def _users_keyset_index(conn: Connection) -> None:
+    create_index(conn, _index(User, "ix_users_created_at_id"))
+
+
+@migration(5, "answers unique per question")
+def _answers_unique(conn: Connection) -> None:
+    # Concurrent saves used to insert a second answer for the same question. The app kept reading and
+    # updating the first row, so that one survives; file ids that landed in the duplicates are merged into it.
+    answers = Answer.__table__
+    duplicates = (
+        select(answers.c.response_id, answers.c.question_id)
+        .group_by(answers.c.response_id, answers.c.question_id)
+        .having(func.count() > 1)
+        .subquery()
+    )
+    rows = conn.execute(
+        select(answers.c.id, answers.c.response_id, answers.c.question_id, answers.c.file_ids)
+        .join(
+            duplicates,
+            (answers.c.response_id == duplicates.c.response_id) & (answers.c.question_id == duplicates.c.question_id),
+        )
+        .order_by(answers.c.id)
+    )
+    groups: dict[tuple[int, int], list[tuple[int, list[int]]]] = {}
+    for answer_id, response_id, question_id, file_ids in rows:
+        groups.setdefault((response_id, question_id), []).append((answer_id, file_ids or []))
+    for (keep_id, keep_files), *extra in groups.values():
+        merged = list(keep_files)
+        for _, file_ids in extra:
+            merged.extend(file_id for file_id in file_ids if file_id not in merged)
+        if merged != keep_files:
+            conn.execute(update(answers).where(answers.c.id == keep_id).values(file_ids=merged))
+        conn.execute(answers.delete().where(answers.c.id.in_([answer_id for answer_id, _ in extra])))
+    create_index(conn, _index(Answer, "ux_answers_response_question"))
+
+
+@migration(6, "hot query indexes", transactional=False)
+def _hot_query_indexes(conn: Connection) -> None:
+    create_index(conn, _index(Response, "ix_responses_user_survey_status_started"))
+    create_index(conn, _index(Question, "ix_questions_survey_order"))
+
+
+@migration(7, "postgresql native types")
+def _postgresql_native_types(conn: Connection) -> None:
+    # SQLite stores any integer in 64 bits and has no JSONB; only PostgreSQL needs changes.
+    if conn.dialect.name != "postgresql":
+        return
+    conn.exec_driver_sql("ALTER TABLE users ALTER COLUMN tg_id TYPE BIGINT")
+    json_columns = {
+        "questions": ["settings"],
+        "responses": ["question_message_ids", "user_message_ids"],
+        "answers": ["option_values", "file_ids"],
+        "sheets_outbox": ["payload"],
+    }
+    for table, columns in json_columns.items():
+        for column in columns:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE JSONB USING {column}::jsonb")
+
+
+@migration(8, "assistant test scores", transactional=False)
+def _assistant_test_scores(conn: Connection) -> None:
+    for name in ("score_a", "score_b", "score_c"):
+        add_column(conn, "responses", Column(name, Integer, nullable=False, server_default="0"))
+    add_column(conn, "responses", Column("result_type", String(32)))
+    _backfill_test_scores(conn)
+
+
+def _backfill_test_scores(conn: Connection) -> None:
+    survey_id = conn.execute(select(Survey.id).where(Survey.code == settings.ASSISTANT_TEST_SURVEY_CODE)).scalar()
+    if survey_id is None:
+        return
+    option_scores = {
+        option_id: score_key(value)
+        for option_id, value in conn.execute(
+            select(Option.id, Option.value).join(Question, Question.id == Option.question_id).where(
+                Question.survey_id == survey_id
+            )
+        )
+    }
+    responses = Response.__table__
+    stmt = (
+        update(responses)
+        .where(responses.c.id == bindparam("response_id"))
+        .values(
+            score_a=bindparam("a"),
+            score_b=bindparam("b"),
+            score_c=bindparam("c"),
+            result_type=bindparam("result"),
+        )
+    )
+    # Running tests need their scores too; only finished ones get a result type.
+    pending = or_(
+        responses.c.status == "in_progress",
+        and_(responses.c.status == "completed", responses.c.result_type.is_(None)),
+    )
+    last_id = 0
+    while True:
+        statuses = dict(
+            conn.execute(
+                select(responses.c.id, responses.c.status)
+                .where(responses.c.survey_id == survey_id, pending, responses.c.id > last_id)
+                .order_by(responses.c.id)
+                .limit(BACKFILL_CHUNK_SIZE)
+            ).all()
+        )
+        if not statuses:
+            return
+        ids = list(statuses)
+        scores = {response_id: {"A": 0, "B": 0, "C": 0} for response_id in ids}
+        for response_id, option_ids in conn.execute(
+            select(Answer.response_id, Answer.option_values).where(Answer.response_id.in_(ids))
+        ):
+            for option_id in option_ids or []:
+                key = option_scores.get(option_id)
+                if key:
+                    scores[response_id][key] += 1
+        conn.execute(
+            stmt,
+            [
+                {
+                    "response_id": response_id,
+                    "a": s["A"],
+                    "b": s["B"],
+                    "c": s["C"],
+                    "result": classify_scores(s["A"], s["B"], s["C"]) if statuses[response_id] == "completed" else None,
+                }
+                for response_id, s in scores.items()
+            ],
+        )
+        last_id = ids[-1]
+
+
+@migration(9, "content-addressed uploads", transactional=False)
+def _content_addressed_uploads(conn: Connection) -> None:
+    StoredBlob.__table__.create(conn, checkfirst=True)
+    add_column(conn, "uploaded_files", Column("blob_id", Integer))
+    create_index(conn, _index(UploadedFile, "ix_uploaded_files_tg_unique_id"))
+    create_index(conn, _index(UploadedFile, "ix_uploaded_files_blob_id"))
+
+
+@migration(10, "background file ingestion", transactional=False)
+def _background_file_ingestion(conn: Connection) -> None:
+    add_column(conn, "uploaded_files", Column("status", String(16), nullable=False, server_default="ready"))
+    add_column(conn, "uploaded_files", Column("attempts", Integer, nullable=False, server_default="0"))
+    create_index(conn, _index(UploadedFile, "ix_uploaded_files_status"))
+
+
+@migration(11, "drop blob reference counts")
+def _drop_blob_ref_counts(conn: Connection) -> None:
+    # Nothing deletes uploads, so the counter was never decremented.
+    drop_column(conn, "stored_blobs", "ref_count")
+
+
+def _index(model: type[Base], name: str) -> Index:
+    return next(index for index in model.__table__.indexes if index.name == name)
+
+
+def _applied_versions(conn: Connection) -> set[int]:
+    return set(conn.execute(select(schema_migrations.c.version)).scalars())
+
+
+def _record(conn: Connection, migrations: list[Migration]) -> None:
+    if migrations:
+        now = datetime.utcnow()
+        conn.execute(
+            schema_migrations.insert(),
+            [{"version": m.version, "name": m.name, "applied_at": now} for m in migrations],
+        )
+
+
+def _prepare(conn: Connection) -> set[int]:
+    inspector = inspect(conn)
+    if inspector.has_table("schema_migrations"):
+        return _applied_versions(conn)
+    fresh = not inspector.has_table("surveys")
+    schema_migrations.create(conn)
+    if fresh:
+        # A new database gets the current schema in one go; every step counts as applied.
+        Base.metadata.create_all(conn)
+        _record(conn, MIGRATIONS)
+        return {m.version for m in MIGRATIONS}
+    return set()
+
+
+def _apply(conn: Connection, step: Migration) -> None:
+    step.upgrade(conn)
+    _record(conn, [step])
+
+
+def _pending(applied: set[int]) -> list[Migration]:
+    return sorted((m for m in MIGRATIONS if m.version not in applied), key=lambda m: m.version)
+
+
+def _log_applied(steps: list[Migration]) -> list[int]:
+    for step in steps:
+        logger.info("Applied migration %s: %s", step.version, step.name)
+    return [step.version for step in steps]
+
+
+def _migrate_sqlite(conn: Connection) -> list[int]:
+    # SQLite has a single writer: BEGIN IMMEDIATE takes the write lock up front, so a second process waits here
+    # instead of racing, and the whole run commits or rolls back as one transaction.
+    busy_timeout = conn.exec_driver_sql("PRAGMA busy_timeout").scalar()
+    conn.exec_driver_sql(f"PRAGMA busy_timeout={SQLITE_LOCK_TIMEOUT_MS}")
+    try:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    finally:
+        conn.exec_driver_sql(f"PRAGMA busy_timeout={busy_timeout}")
+    try:
+        steps = _pending(_prepare(conn))
+        for step in steps:
+            _apply(conn, step)
+    except BaseException:
+        conn.exec_driver_sql("ROLLBACK")
+        raise
+    conn.exec_driver_sql("COMMIT")
+    return _log_applied(steps)
+
+
+@asynccontextmanager
+async def _advisory_lock(engine: AsyncEngine) -> AsyncIterator[None]:
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # Polled instead of waited for: a session blocked in pg_advisory_lock() holds a snapshot,
+        # and CREATE INDEX CONCURRENTLY in the process that owns the lock would wait for it forever.
+        while not await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY}):
+            await asyncio.sleep(ADVISORY_LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+
+
+async def run_migrations(engine: AsyncEngine) -> list[int]:
+    if engine.dialect.name == "sqlite":
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            return await conn.run_sync(_migrate_sqlite)
+    async with _advisory_lock(engine):
+        # Read under the lock: another process may have just created the schema or applied steps.
+        async with engine.begin() as conn:
+            steps = _pending(await conn.run_sync(_prepare))
+        for step in steps:
+            if step.transactional:
+                async with engine.begin() as conn:
+                    await conn.run_sync(_apply, step)
+            else:
+                async with engine.connect() as conn:
+                    conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                    await conn.run_sync(_apply, step)
+    return _log_applied(steps)
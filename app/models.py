@@ -3,9 +3,13 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Any, Optional
 
-from sqlalchemy import Boolean, DateTime, ForeignKey, Integer, String, Text, JSON
+from sqlalchemy import BigInteger, Boolean, DateTime, ForeignKey, Index, Integer, String, Text, JSON, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
+# Native JSONB on PostgreSQL, JSON text elsewhere.
+JSONType = JSON().with_variant(JSONB(), "postgresql")
+
 
 class Base(DeclarativeBase):
     pass
@@ -24,12 +28,13 @@ class Survey(Base):
         "Question",
         back_populates="survey",
         cascade="all, delete-orphan",
-        lazy="selectin",
+        lazy="raise",
     )
 
 
 class Question(Base):
     __tablename__ = "questions"
+    __table_args__ = (Index("ix_questions_survey_order", "survey_id", "order"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     survey_id: Mapped[int] = mapped_column(ForeignKey("surveys.id"), index=True)
@@ -40,7 +45,7 @@ class Question(Base):
     order: Mapped[int] = mapped_column(Integer, default=0)
     allow_multiple: Mapped[bool] = mapped_column(Boolean, default=False)
     help_text: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
-    settings: Mapped[dict[str, Any]] = mapped_column(JSON, default=dict)
+    settings: Mapped[dict[str, Any]] = mapped_column(JSONType, default=dict)
     image_path: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     image_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     image_mime: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
@@ -69,9 +74,10 @@ class Option(Base):
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (Index("ix_users_created_at_id", "created_at", "id"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    tg_id: Mapped[int] = mapped_column(Integer, unique=True, index=True)
+    tg_id: Mapped[int] = mapped_column(BigInteger, unique=True, index=True)
     username: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     first_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     last_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
@@ -79,12 +85,13 @@ class User(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     responses: Mapped[list[Response]] = relationship(
-        "Response", back_populates="user", lazy="selectin"
+        "Response", back_populates="user", lazy="raise"
     )
 
 
 class Response(Base):
     __tablename__ = "responses"
+    __table_args__ = (Index("ix_responses_user_survey_status_started", "user_id", "survey_id", "status", "started_at"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
@@ -93,35 +100,55 @@ class Response(Base):
     started_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     current_question_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
-    question_message_ids: Mapped[list[int]] = mapped_column(JSON, default=list)
-    user_message_ids: Mapped[list[int]] = mapped_column(JSON, default=list)
+    question_message_ids: Mapped[list[int]] = mapped_column(JSONType, default=list)
+    user_message_ids: Mapped[list[int]] = mapped_column(JSONType, default=list)
+    # Assistant test: running counts of A/B/C options and the final type
+    score_a: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    score_b: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    score_c: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    result_type: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
 
     user: Mapped[User] = relationship("User", back_populates="responses")
     answers: Mapped[list[Answer]] = relationship(
-        "Answer", back_populates="response", cascade="all, delete-orphan", lazy="selectin"
+        "Answer", back_populates="response", cascade="all, delete-orphan", lazy="raise"
     )
 
 
 class Answer(Base):
     __tablename__ = "answers"
+    __table_args__ = (Index("ux_answers_response_question", "response_id", "question_id", unique=True),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     response_id: Mapped[int] = mapped_column(ForeignKey("responses.id"), index=True)
     question_id: Mapped[int] = mapped_column(ForeignKey("questions.id"), index=True)
     text_value: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
-    option_values: Mapped[list[int]] = mapped_column(JSON, default=list)
-    file_ids: Mapped[list[int]] = mapped_column(JSON, default=list)
+    option_values: Mapped[list[int]] = mapped_column(JSONType, default=list)
+    file_ids: Mapped[list[int]] = mapped_column(JSONType, default=list)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
     response: Mapped[Response] = relationship("Response", back_populates="answers")
 
 
+class StoredBlob(Base):
+    __tablename__ = "stored_blobs"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    sha256: Mapped[str] = mapped_column(String(64), unique=True)
+    size: Mapped[int] = mapped_column(BigInteger)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
 class UploadedFile(Base):
     __tablename__ = "uploaded_files"
+    __table_args__ = (
+        Index("ix_uploaded_files_tg_unique_id", "tg_unique_id"),
+        Index("ix_uploaded_files_status", "status"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     response_id: Mapped[int] = mapped_column(ForeignKey("responses.id"), index=True)
     question_id: Mapped[int] = mapped_column(ForeignKey("questions.id"), index=True)
+    blob_id: Mapped[Optional[int]] = mapped_column(ForeignKey("stored_blobs.id"), nullable=True, index=True)
     tg_file_id: Mapped[str] = mapped_column(String(255))
     tg_unique_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     file_name: Mapped[str] = mapped_column(String(255))
@@ -130,4 +157,38 @@ class UploadedFile(Base):
     local_path: Mapped[str] = mapped_column(Text)
     public_url: Mapped[str] = mapped_column(Text)
     file_type: Mapped[str] = mapped_column(String(32))
+    # pending: recorded, download still running; ready: stored in a blob; failed: gave up after retries
+    status: Mapped[str] = mapped_column(String(16), default="ready", server_default="ready")
+    attempts: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class MediaCacheEntry(Base):
+    __tablename__ = "media_cache"
+    __table_args__ = (UniqueConstraint("bot_id", "path", "kind", name="uq_media_cache_bot_path_kind"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    bot_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    path: Mapped[str] = mapped_column(Text)
+    kind: Mapped[str] = mapped_column(String(32))  # photo, document
+    size: Mapped[int] = mapped_column(BigInteger)
+    mtime_ns: Mapped[int] = mapped_column(BigInteger)
+    sha256: Mapped[str] = mapped_column(String(64))
+    file_id: Mapped[str] = mapped_column(String(255))
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+
+class SheetsOutbox(Base):
+    __tablename__ = "sheets_outbox"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    response_id: Mapped[int] = mapped_column(ForeignKey("responses.id"), index=True)
+    payload: Mapped[dict[str, Any]] = mapped_column(JSONType)
+    status: Mapped[str] = mapped_column(String(32), default="pending", index=True)  # pending, sent
+    attempts: Mapped[int] = mapped_column(Integer, default=0)
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    claim_token: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    locked_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
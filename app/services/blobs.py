@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import FILES_DIR
+from app.db import dialect_insert
+from app.models import StoredBlob, UploadedFile
+from app.services.hashing import sha256_file
+
+BLOBS_DIR = FILES_DIR / "blobs"
+TMP_DIR = BLOBS_DIR / "tmp"
+
+
+def blob_path(sha256: str) -> Path:
+    # Two levels of 256 shards keep directories small even with hundreds of thousands of files.
+    return BLOBS_DIR / sha256[:2] / sha256[2:4] / sha256
+
+
+def new_tmp_path() -> Path:
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    return TMP_DIR / f"{uuid.uuid4().hex}.part"
+
+
+def _store(tmp_path: Path) -> tuple[str, int]:
+    sha256, size = sha256_file(tmp_path)
+    target = blob_path(sha256)
+    if target.exists():
+        tmp_path.unlink()
+    else:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, target)
+    return sha256, size
+
+
+async def store_file(tmp_path: Path) -> tuple[str, int]:
+    return await asyncio.to_thread(_store, tmp_path)
+
+
+def _store_copy(source: Path) -> tuple[str, int]:
+    sha256, size = sha256_file(source)
+    target = blob_path(sha256)
+    if not target.exists():
+        tmp_path = new_tmp_path()
+        try:
+            shutil.copyfile(source, tmp_path)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp_path, target)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    return sha256, size
+
+
+async def store_copy(source: str | Path) -> tuple[str, int]:
+    # Hash in place first, so a file we already have is never copied.
+    return await asyncio.to_thread(_store_copy, Path(source))
+
+
+async def find_blob_by_unique_id(session: AsyncSession, tg_unique_id: str) -> Optional[StoredBlob]:
+    result = await session.execute(
+        select(StoredBlob)
+        .join(UploadedFile, UploadedFile.blob_id == StoredBlob.id)
+        .where(UploadedFile.tg_unique_id == tg_unique_id)
+        .limit(1)
+    )
+    blob = result.scalars().first()
+    if blob is None or not await asyncio.to_thread(blob_path(blob.sha256).exists):
+        return None
+    return blob
+
+
+async def get_or_create_blob(session: AsyncSession, sha256: str, size: int) -> StoredBlob:
+    # Concurrent downloads of the same content both end up with the one row.
+    stmt = (
+        dialect_insert(session)(StoredBlob)
+        .values(sha256=sha256, size=size)
+        .on_conflict_do_update(index_elements=[StoredBlob.sha256], set_={"size": size})
+        .returning(StoredBlob)
+    )
+    result = await session.execute(stmt, execution_options={"populate_existing": True})
+    return result.scalars().one()
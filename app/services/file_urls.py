@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from app.config import FILES_DIR, settings
+
+SIGNATURE_BYTES = 16
+
+
+class InvalidFileToken(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class SignedFile:
+    # Storage key: path relative to FILES_DIR.
+    key: str
+    file_name: Optional[str]
+    mime_type: Optional[str]
+    expires: int = 0
+
+    @property
+    def path(self) -> Path:
+        return FILES_DIR / self.key
+
+
+def _signing_key() -> bytes:
+    return (settings.FILES_SIGNING_KEY or settings.BOT_TOKEN).encode()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + "=" * (-len(value) % 4))
+
+
+def _signature(payload: str) -> str:
+    digest = hmac.new(_signing_key(), payload.encode(), hashlib.sha256).digest()
+    return _b64encode(digest[:SIGNATURE_BYTES])
+
+
+def storage_key(local_path: str | Path) -> str:
+    return Path(local_path).resolve().relative_to(FILES_DIR.resolve()).as_posix()
+
+
+def sign_file(
+    local_path: str | Path,
+    file_name: Optional[str],
+    mime_type: Optional[str],
+    ttl: Optional[int] = None,
+) -> str:
+    ttl = settings.FILES_URL_TTL if ttl is None else ttl
+    data = {"k": storage_key(local_path), "n": file_name, "m": mime_type}
+    if ttl:
+        data["e"] = int(time.time()) + ttl
+    payload = _b64encode(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode())
+    return f"{payload}.{_signature(payload)}"
+
+
+def signed_file_url(
+    local_path: str | Path,
+    file_name: Optional[str],
+    mime_type: Optional[str],
+    ttl: Optional[int] = None,
+) -> str:
+    base_url = settings.FILES_BASE_URL.rstrip("/")
+    return f"{base_url}/files/{sign_file(local_path, file_name, mime_type, ttl)}"
+
+
+def verify_file_token(token: str, now: Optional[float] = None) -> SignedFile:
+    payload, _, signature = token.partition(".")
+    if not payload or not hmac.compare_digest(signature.encode(), _signature(payload).encode()):
+        raise InvalidFileToken("Bad signature")
+    try:
+        data = json.loads(_b64decode(payload))
+        signed = SignedFile(str(data["k"]), data.get("n"), data.get("m"), int(data.get("e") or 0))
+    except (ValueError, KeyError, TypeError):
+        raise InvalidFileToken("Malformed token") from None
+    if signed.expires and signed.expires < (time.time() if now is None else now):
+        raise InvalidFileToken("Link expired")
+    if ".." in Path(signed.key).parts or Path(signed.key).is_absolute():
+        raise InvalidFileToken("Bad storage key")
+    return signed
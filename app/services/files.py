@@ -2,14 +2,25 @@ from __future__ import annotations
 
 import re
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional
 
 from aiogram import Bot
 from aiogram.types import Message
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.config import FILES_DIR, settings
-from app.models import UploadedFile
+from app.config import settings
+from app.db import AsyncSessionLocal, commit_or_defer
+from app.models import StoredBlob, UploadedFile
+from app.services.blobs import (
+    blob_path,
+    find_blob_by_unique_id,
+    get_or_create_blob,
+    new_tmp_path,
+    store_copy,
+    store_file,
+)
+from app.services.file_urls import signed_file_url
 
 
 def _safe_filename(value: str) -> str:
@@ -18,62 +29,123 @@ def _safe_filename(value: str) -> str:
     return value or "file"
 
 
-async def extract_telegram_file(message: Message) -> tuple[str, str, Optional[str], Optional[int], str]:
+async def extract_telegram_file(message: Message) -> tuple[str, str, str, Optional[str], Optional[int], str]:
     if message.document:
         doc = message.document
-        return doc.file_id, doc.file_name or "document.pdf", doc.mime_type, doc.file_size, "document"
+        return doc.file_id, doc.file_unique_id, doc.file_name or "document.pdf", doc.mime_type, doc.file_size, "document"
     if message.photo:
         photo = message.photo[-1]
-        return photo.file_id, f"photo_{photo.file_unique_id}.jpg", "image/jpeg", photo.file_size, "photo"
+        return photo.file_id, photo.file_unique_id, f"photo_{photo.file_unique_id}.jpg", "image/jpeg", photo.file_size, "photo"
     if message.video:
         video = message.video
-        return video.file_id, video.file_name or f"video_{video.file_unique_id}.mp4", video.mime_type, video.file_size, "video"
+        name = video.file_name or f"video_{video.file_unique_id}.mp4"
+        return video.file_id, video.file_unique_id, name, video.mime_type, video.file_size, "video"
     if message.video_note:
         note = message.video_note
-        return note.file_id, f"video_note_{note.file_unique_id}.mp4", "video/mp4", note.file_size, "video_note"
+        return note.file_id, note.file_unique_id, f"video_note_{note.file_unique_id}.mp4", "video/mp4", note.file_size, "video_note"
     if message.voice:
         voice = message.voice
-        return voice.file_id, f"voice_{voice.file_unique_id}.ogg", voice.mime_type, voice.file_size, "voice"
+        return voice.file_id, voice.file_unique_id, f"voice_{voice.file_unique_id}.ogg", voice.mime_type, voice.file_size, "voice"
     if message.audio:
         audio = message.audio
-        return audio.file_id, audio.file_name or f"audio_{audio.file_unique_id}.mp3", audio.mime_type, audio.file_size, "audio"
+        name = audio.file_name or f"audio_{audio.file_unique_id}.mp3"
+        return audio.file_id, audio.file_unique_id, name, audio.mime_type, audio.file_size, "audio"
     raise ValueError("Unsupported file type")
 
 
-async def download_telegram_file(
-    bot: Bot,
+async def _download_blob(bot: Bot, file_id: str) -> tuple[str, int]:
+    tg_file = await bot.get_file(file_id)
+    api = bot.session.api
+    if api.is_local:
+        # A local Bot API server returns a path on its own disk instead of a download URL.
+        return await store_copy(api.wrap_local_file.to_local(tg_file.file_path))
+    tmp_path = new_tmp_path()
+    try:
+        await bot.download_file(tg_file.file_path, destination=tmp_path, timeout=settings.TELEGRAM_DOWNLOAD_TIMEOUT)
+        return await store_file(tmp_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _ready_fields(blob: StoredBlob, file_name: str, mime_type: Optional[str]) -> dict:
+    local_path = blob_path(blob.sha256)
+    return {
+        "blob_id": blob.id,
+        "size": blob.size,
+        "local_path": str(local_path),
+        "public_url": signed_file_url(local_path, file_name, mime_type),
+        "status": "ready",
+    }
+
+
+async def register_telegram_file(
     session: AsyncSession,
     response_id: int,
     question_id: int,
     message: Message,
 ) -> UploadedFile:
-    file_id, file_name, mime_type, size, file_type = await extract_telegram_file(message)
-    tg_file = await bot.get_file(file_id)
-
-    FILES_DIR.mkdir(parents=True, exist_ok=True)
+    file_id, unique_id, file_name, mime_type, size, file_type = await extract_telegram_file(message)
     safe_name = _safe_filename(file_name)
-    local_path = FILES_DIR / f"{tg_file.file_unique_id}_{safe_name}"
-
-    await bot.download(tg_file, destination=local_path)
-
+    fields = {"size": size, "local_path": "", "public_url": "", "status": "pending"}
+    # The same file re-sent (e.g. a resume after restarting the survey) keeps its file_unique_id.
+    blob = await find_blob_by_unique_id(session, unique_id)
+    if blob is not None:
+        fields = _ready_fields(blob, safe_name, mime_type)
     uploaded = UploadedFile(
         response_id=response_id,
         question_id=question_id,
         tg_file_id=file_id,
-        tg_unique_id=tg_file.file_unique_id,
+        tg_unique_id=unique_id,
         file_name=safe_name,
         mime_type=mime_type,
-        size=size,
-        local_path=str(local_path),
-        public_url="",
         file_type=file_type,
+        **fields,
     )
     session.add(uploaded)
-    await session.commit()
-    await session.refresh(uploaded)
-
-    base_url = settings.FILES_BASE_URL.rstrip("/")
-    uploaded.public_url = f"{base_url}/files/{uploaded.id}"
-    await session.commit()
-    await session.refresh(uploaded)
+    await commit_or_defer(session, uploaded)
     return uploaded
+
+
+async def ingest_pending_file(bot: Bot, uploaded_id: int) -> bool:
+    async with AsyncSessionLocal() as session:
+        uploaded = await session.get(UploadedFile, uploaded_id)
+        if not uploaded or uploaded.status != "pending":
+            return False
+        uploaded.attempts += 1
+        file_id, file_name, mime_type = uploaded.tg_file_id, uploaded.file_name, uploaded.mime_type
+        await session.commit()
+
+    # No session is open while the file streams to disk, so a slow download holds no connection or lock.
+    sha256, size = await _download_blob(bot, file_id)
+
+    async with AsyncSessionLocal() as session:
+        blob = await get_or_create_blob(session, sha256, size)
+        # Another process may have resumed the same row; only the one that flips it from pending wins.
+        result = await session.execute(
+            update(UploadedFile)
+            .where(UploadedFile.id == uploaded_id, UploadedFile.status == "pending")
+            .values(**_ready_fields(blob, file_name, mime_type))
+        )
+        if result.rowcount != 1:
+            await session.rollback()
+            return False
+        await session.commit()
+    return True
+
+
+async def mark_file_failed(uploaded_id: int) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(UploadedFile)
+            .where(UploadedFile.id == uploaded_id, UploadedFile.status == "pending")
+            .values(status="failed")
+        )
+        await session.commit()
+
+
+async def get_pending_file_ids(session: AsyncSession, file_ids: Optional[Iterable[int]] = None) -> list[int]:
+    stmt = select(UploadedFile.id).where(UploadedFile.status == "pending")
+    if file_ids is not None:
+        stmt = stmt.where(UploadedFile.id.in_(list(file_ids)))
+    result = await session.execute(stmt.order_by(UploadedFile.id))
+    return list(result.scalars().all())
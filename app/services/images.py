@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import uuid
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from app.config import OPTIMIZED_IMAGES_DIR
+from app.services.hashing import sha256_file
+
+logger = logging.getLogger(__name__)
+
+# Telegram downsizes photos to 1280px on the long side anyway; sending more is wasted upload.
+MAX_DIMENSION = 1280
+JPEG_QUALITY = 82
+# Bump when the settings above change so old variants are not reused.
+PIPELINE_VERSION = 1
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+_variants: dict[tuple[str, int, int], Path] = {}
+_inflight: dict[tuple[str, int, int], asyncio.Task] = {}
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    if image.mode == "RGB":
+        return image
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _build_variant(source: str) -> Path:
+    digest, _ = sha256_file(source)
+    target = OPTIMIZED_IMAGES_DIR / digest[:2] / f"{digest}-v{PIPELINE_VERSION}.jpg"
+    if target.exists():
+        return target
+    with Image.open(source) as original:
+        # Apply the EXIF rotation before dropping EXIF, otherwise portrait shots arrive sideways.
+        image = _flatten(ImageOps.exif_transpose(original))
+        image.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.Resampling.LANCZOS)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f".{uuid.uuid4().hex}.tmp")
+        try:
+            image.save(tmp_path, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+            os.replace(tmp_path, target)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+    return target
+
+
+async def optimized_photo(path: str | Path) -> Path:
+    source = Path(path).resolve()
+    stat = source.stat()
+    key = (str(source), stat.st_size, stat.st_mtime_ns)
+    variant = _variants.get(key)
+    if variant is not None and variant.exists():
+        return variant
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(asyncio.to_thread(_build_variant, str(source)))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    try:
+        variant = await asyncio.shield(task)
+    except Exception:
+        logger.exception("Failed to optimize %s, sending the original", source)
+        return source
+    _variants[key] = variant
+    return variant
+
@@ -0,0 +1,229 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional, Sequence
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputMediaPhoto, Message
+from sqlalchemy import delete, select
+
+from app.db import AsyncSessionLocal, dialect_insert
+from app.metrics import detached_task
+from app.models import MediaCacheEntry
+from app.services.hashing import sha256_file
+from app.services.images import optimized_photo
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class MediaFingerprint:
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+@dataclass(frozen=True)
+class _CachedFile:
+    fingerprint: MediaFingerprint
+    file_id: str
+
+
+_digests: dict[tuple[str, int, int], str] = {}
+_file_ids: dict[tuple[int, str, str], _CachedFile] = {}
+_loaded_bots: set[int] = set()
+_load_lock = asyncio.Lock()
+_pending_writes: set[asyncio.Task] = set()
+
+
+def _resolve(path: str | Path) -> str:
+    return str(Path(path).resolve())
+
+
+async def fingerprint(path: str | Path) -> MediaFingerprint:
+    resolved = _resolve(path)
+    stat = os.stat(resolved)
+    key = (resolved, stat.st_size, stat.st_mtime_ns)
+    digest = _digests.get(key)
+    if digest is None:
+        digest, _ = await asyncio.to_thread(sha256_file, resolved)
+        _digests[key] = digest
+    return MediaFingerprint(resolved, stat.st_size, stat.st_mtime_ns, digest)
+
+
+async def _ensure_loaded(bot_id: int) -> None:
+    if bot_id in _loaded_bots:
+        return
+    async with _load_lock:
+        if bot_id in _loaded_bots:
+            return
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(MediaCacheEntry).where(MediaCacheEntry.bot_id == bot_id))
+            for entry in result.scalars().all():
+                _file_ids[(bot_id, entry.path, entry.kind)] = _CachedFile(
+                    MediaFingerprint(entry.path, entry.size, entry.mtime_ns, entry.sha256),
+                    entry.file_id,
+                )
+        _loaded_bots.add(bot_id)
+
+
+async def lookup_file_id(bot: Bot, fp: MediaFingerprint, kind: str) -> Optional[str]:
+    await _ensure_loaded(bot.id)
+    cached = _file_ids.get((bot.id, fp.path, kind))
+    if not cached:
+        return None
+    # Same bytes under a new mtime (e.g. the admin re-uploaded the same PDF) keep the file_id.
+    if cached.fingerprint.size != fp.size or cached.fingerprint.sha256 != fp.sha256:
+        return None
+    return cached.file_id
+
+
+async def _run_write(coro: Awaitable[None]) -> None:
+    try:
+        await coro
+    except Exception:
+        logger.exception("Failed to update the media cache")
+
+
+def _schedule_write(coro: Awaitable[None]) -> None:
+    # Senders usually run inside a unit of work that already holds the SQLite write lock,
+    # so the cache table is updated from a separate task once that transaction ends.
+    task = detached_task(_run_write(coro))
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+
+async def _store_file_id(bot_id: int, fp: MediaFingerprint, kind: str, file_id: str) -> None:
+    values = {
+        "size": fp.size,
+        "mtime_ns": fp.mtime_ns,
+        "sha256": fp.sha256,
+        "file_id": file_id,
+        "updated_at": datetime.utcnow(),
+    }
+    async with AsyncSessionLocal() as session:
+        # Two first sends of the same file race to create the row; the later file_id wins.
+        await session.execute(
+            dialect_insert(session)(MediaCacheEntry)
+            .values(bot_id=bot_id, path=fp.path, kind=kind, **values)
+            .on_conflict_do_update(
+                index_elements=[MediaCacheEntry.bot_id, MediaCacheEntry.path, MediaCacheEntry.kind],
+                set_=values,
+            )
+        )
+        await session.commit()
+
+
+async def _delete_entries(path: str, bot_id: int | None) -> None:
+    stmt = delete(MediaCacheEntry).where(MediaCacheEntry.path == path)
+    if bot_id is not None:
+        stmt = stmt.where(MediaCacheEntry.bot_id == bot_id)
+    async with AsyncSessionLocal() as session:
+        await session.execute(stmt)
+        await session.commit()
+
+
+async def remember_file_id(bot: Bot, fp: MediaFingerprint, kind: str, file_id: str) -> None:
+    _file_ids[(bot.id, fp.path, kind)] = _CachedFile(fp, file_id)
+    _schedule_write(_store_file_id(bot.id, fp, kind, file_id))
+
+
+async def forget_media(path: str | Path, bot: Bot | None = None) -> None:
+    resolved = _resolve(path)
+    for key in [key for key in _file_ids if key[1] == resolved and (bot is None or key[0] == bot.id)]:
+        _file_ids.pop(key, None)
+    for key in [key for key in _digests if key[0] == resolved]:
+        _digests.pop(key, None)
+    _schedule_write(_delete_entries(resolved, bot.id if bot is not None else None))
+
+
+async def drain_media_cache_writes() -> None:
+    if _pending_writes:
+        await asyncio.gather(*list(_pending_writes), return_exceptions=True)
+
+
+def _photo_file_id(message: Message) -> Optional[str]:
+    return message.photo[-1].file_id if message.photo else None
+
+
+def _document_file_id(message: Message) -> Optional[str]:
+    return message.document.file_id if message.document else None
+
+
+async def _photo_fingerprint(photo: MediaFingerprint | str | Path) -> MediaFingerprint:
+    if isinstance(photo, MediaFingerprint):
+        return photo
+    return await fingerprint(await optimized_photo(photo))
+
+
+async def _send_cached(
+    bot: Bot,
+    fp: MediaFingerprint,
+    kind: str,
+    send: Callable[[Any], Awaitable[Message]],
+    extract: Callable[[Message], Optional[str]],
+) -> Message:
+    file_id = await lookup_file_id(bot, fp, kind)
+    if file_id:
+        try:
+            return await send(file_id)
+        except TelegramBadRequest:
+            await forget_media(fp.path, bot)
+
+    message = await send(FSInputFile(fp.path))
+    new_file_id = extract(message)
+    if new_file_id:
+        await remember_file_id(bot, fp, kind, new_file_id)
+    return message
+
+
+async def send_cached_photo(bot: Bot, chat_id: int, photo: MediaFingerprint | str | Path, **kwargs: Any) -> Message:
+    return await _send_cached(
+        bot,
+        await _photo_fingerprint(photo),
+        "photo",
+        lambda media: bot.send_photo(chat_id, media, **kwargs),
+        _photo_file_id,
+    )
+
+
+async def send_cached_document(bot: Bot, chat_id: int, path: str | Path, **kwargs: Any) -> Message:
+    return await _send_cached(
+        bot,
+        await fingerprint(path),
+        "document",
+        lambda media: bot.send_document(chat_id, media, **kwargs),
+        _document_file_id,
+    )
+
+
+async def send_cached_photo_album(
+    bot: Bot, chat_id: int, photos: Sequence[MediaFingerprint | str | Path]
+) -> list[Message]:
+    fingerprints = [await _photo_fingerprint(photo) for photo in photos]
+    file_ids = [await lookup_file_id(bot, fp, "photo") for fp in fingerprints]
+    if all(file_ids):
+        try:
+            return await bot.send_media_group(chat_id, [InputMediaPhoto(media=file_id) for file_id in file_ids])
+        except TelegramBadRequest:
+            for fp in fingerprints:
+                await forget_media(fp.path, bot)
+            file_ids = [None] * len(fingerprints)
+
+    media = [
+        InputMediaPhoto(media=file_id or FSInputFile(fp.path))
+        for fp, file_id in zip(fingerprints, file_ids)
+    ]
+    messages = await bot.send_media_group(chat_id, media)
+    for fp, file_id, message in zip(fingerprints, file_ids, messages):
+        new_file_id = _photo_file_id(message)
+        if new_file_id and not file_id:
+            await remember_file_id(bot, fp, "photo", new_file_id)
+    return messages
@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from app.config import BASE_DIR, QUESTION_IMAGES_DIR
+from app.services.images import IMAGE_SUFFIXES, optimized_photo
+from app.services.media_cache import MediaFingerprint, fingerprint, forget_media
+
+if TYPE_CHECKING:
+    from app.services.survey_cache import CompiledQuestion
+
+logger = logging.getLogger(__name__)
+
+# Admin edits (new files dropped into a question folder) show up in the bot within this many seconds.
+POLL_INTERVAL = 5.0
+ASSISTANT_IMAGES_DIR = BASE_DIR / "assistant_images_questions"
+
+# (name, size, mtime_ns) of every image in a directory, or of the single file.
+Signature = tuple[tuple[str, int, int], ...]
+
+
+@dataclass(frozen=True)
+class _Entry:
+    signature: Signature
+    photos: tuple[MediaFingerprint, ...]
+
+
+_entries: dict[str, _Entry] = {}
+_index_lock = asyncio.Lock()
+
+
+def _key(source: str | Path) -> str:
+    # abspath is pure string work; resolve() would stat every path component on each send.
+    return os.path.abspath(str(source))
+
+
+def question_image_dir(question: CompiledQuestion) -> Optional[Path]:
+    image_dir = (question.settings or {}).get("image_dir")
+    if not image_dir:
+        code = (question.code or "").lower()
+        if not (code.startswith("q") and code[1:].isdigit()):
+            return None
+        image_dir = str(Path("assistant_images_questions") / f"question{int(code[1:])}")
+    path = Path(str(image_dir))
+    return path if path.is_absolute() else BASE_DIR / path
+
+
+def _scan(source: str) -> tuple[Signature, list[str]]:
+    try:
+        if os.path.isdir(source):
+            names = sorted(
+                entry.name
+                for entry in os.scandir(source)
+                if entry.is_file() and Path(entry.name).suffix.lower() in IMAGE_SUFFIXES
+            )
+            paths = [os.path.join(source, name) for name in names]
+        else:
+            paths = [source]
+        signature = []
+        for path in paths:
+            stat = os.stat(path)
+            signature.append((os.path.basename(path), stat.st_size, stat.st_mtime_ns))
+        return tuple(signature), paths
+    except FileNotFoundError:
+        return (), []
+
+
+async def _index(source: str) -> _Entry:
+    signature, paths = await asyncio.to_thread(_scan, source)
+    photos = []
+    for path in paths:
+        try:
+            photos.append(await fingerprint(await optimized_photo(path)))
+        except OSError:
+            logger.exception("Failed to index %s", path)
+    entry = _Entry(signature, tuple(photos))
+    previous = _entries.get(source)
+    _entries[source] = entry
+    if previous is not None:
+        # A replaced image gets a new variant; drop the file_ids of variants nothing points to anymore.
+        current = {photo.path for photo in entry.photos}
+        for photo in previous.photos:
+            if photo.path not in current:
+                await forget_media(photo.path)
+    return entry
+
+
+async def photos_for(source: str | Path) -> tuple[MediaFingerprint, ...]:
+    key = _key(source)
+    entry = _entries.get(key)
+    if entry is None:
+        async with _index_lock:
+            entry = _entries.get(key) or await _index(key)
+    return entry.photos
+
+
+async def question_album(question: CompiledQuestion) -> tuple[MediaFingerprint, ...]:
+    image_dir = question_image_dir(question)
+    return await photos_for(image_dir) if image_dir else ()
+
+
+async def question_photo(question: CompiledQuestion) -> Optional[MediaFingerprint]:
+    if not question.image_path:
+        return None
+    photos = await photos_for(question.image_path)
+    return photos[0] if photos else None
+
+
+async def refresh_media_source(source: str | Path) -> None:
+    async with _index_lock:
+        await _index(_key(source))
+
+
+async def forget_media_source(source: str | Path) -> None:
+    # Photos are cached under their optimized variant, so the original's own path matches no entry.
+    key = _key(source)
+    entry = _entries.get(key)
+    if entry is not None:
+        variants = [photo.path for photo in entry.photos]
+    else:
+        _, paths = await asyncio.to_thread(_scan, key)
+        variants = [await optimized_photo(path) for path in paths]
+    for variant in variants:
+        await forget_media(variant)
+
+
+def _startup_sources() -> list[Path]:
+    sources = [BASE_DIR / "bot_intro.jpg"]
+    if ASSISTANT_IMAGES_DIR.is_dir():
+        sources.extend(sorted(p for p in ASSISTANT_IMAGES_DIR.iterdir() if p.is_dir()))
+    if QUESTION_IMAGES_DIR.is_dir():
+        sources.extend(
+            sorted(p for p in QUESTION_IMAGES_DIR.iterdir() if p.is_file() and p.suffix.lower() in IMAGE_SUFFIXES)
+        )
+    return sources
+
+
+async def refresh_media_manifest() -> int:
+    changed = 0
+    for source, entry in list(_entries.items()):
+        signature, _ = await asyncio.to_thread(_scan, source)
+        if signature != entry.signature:
+            async with _index_lock:
+                await _index(source)
+            changed += 1
+    return changed
+
+
+async def run_media_manifest() -> None:
+    try:
+        for source in await asyncio.to_thread(_startup_sources):
+            await photos_for(source)
+    except Exception:
+        logger.exception("Initial media indexing failed")
+    while True:
+        await asyncio.sleep(POLL_INTERVAL)
+        try:
+            changed = await refresh_media_manifest()
+        except Exception:
+            logger.exception("Media manifest refresh failed")
+            continue
+        if changed:
+            logger.info("Media manifest: %d sources changed", changed)
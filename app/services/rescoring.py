@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+from array import array
+from collections import Counter
+from dataclasses import dataclass, field
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models import Response, Survey
+from app.services.scoring import DEFAULT_RULE, RESULT_TYPES, ScoringRule, classify_scores
+
+
+@dataclass
+class ScoreMatrix:
+    # One row per distinct (A, B, C) score triple with the number of responses that have it.
+    # A test of N questions has at most (N + 1) ** 3 rows however many responses there are.
+    score_a: array = field(default_factory=lambda: array("i"))
+    score_b: array = field(default_factory=lambda: array("i"))
+    score_c: array = field(default_factory=lambda: array("i"))
+    counts: array = field(default_factory=lambda: array("q"))
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+
+@dataclass
+class RuleOutcome:
+    rule: ScoringRule
+    distribution: dict[str, int]
+    # (result under the baseline rule, result under this rule) -> responses
+    transitions: Counter[tuple[str, str]]
+
+    @property
+    def changed(self) -> int:
+        return sum(count for (before, after), count in self.transitions.items() if before != after)
+
+
+async def load_score_matrix(session: AsyncSession, survey_code: str | None = None) -> ScoreMatrix:
+    code = survey_code or settings.ASSISTANT_TEST_SURVEY_CODE
+    result = await session.execute(
+        select(Response.score_a, Response.score_b, Response.score_c, func.count(Response.id))
+        .join(Survey, Survey.id == Response.survey_id)
+        .where(Survey.code == code, Response.status == "completed")
+        .group_by(Response.score_a, Response.score_b, Response.score_c)
+    )
+    matrix = ScoreMatrix()
+    for score_a, score_b, score_c, count in result.all():
+        matrix.score_a.append(score_a or 0)
+        matrix.score_b.append(score_b or 0)
+        matrix.score_c.append(score_c or 0)
+        matrix.counts.append(int(count))
+    return matrix
+
+
+def classify_matrix(matrix: ScoreMatrix, rule: ScoringRule) -> list[str]:
+    return [classify_scores(a, b, c, rule) for a, b, c in zip(matrix.score_a, matrix.score_b, matrix.score_c)]
+
+
+def compare_rules(
+    matrix: ScoreMatrix, rules: list[ScoringRule], baseline: ScoringRule = DEFAULT_RULE
+) -> list[RuleOutcome]:
+    base_types = classify_matrix(matrix, baseline)
+    outcomes = []
+    for rule in [baseline, *[rule for rule in rules if rule != baseline]]:
+        distribution = {result_type: 0 for result_type in RESULT_TYPES}
+        transitions: Counter[tuple[str, str]] = Counter()
+        types = base_types if rule == baseline else classify_matrix(matrix, rule)
+        for before, after, count in zip(base_types, types, matrix.counts):
+            distribution[after] += count
+            transitions[(before, after)] += count
+        outcomes.append(RuleOutcome(rule, distribution, transitions))
+    return outcomes
+
+
+def _format_outcomes(outcomes: list[RuleOutcome], total: int) -> str:
+    header = f"{'rule':>8} " + " ".join(f"{result_type:>16}" for result_type in RESULT_TYPES) + f" {'changed':>9}"
+    lines = [header]
+    for outcome in outcomes:
+        cells = []
+        for result_type in RESULT_TYPES:
+            count = outcome.distribution[result_type]
+            share = count / total * 100 if total else 0.0
+            cells.append(f"{count:>8} ({share:5.1f}%)")
+        lines.append(f"{outcome.rule.label:>8} " + " ".join(cells) + f" {outcome.changed:>9}")
+    return "\n".join(lines)
+
+
+async def main() -> None:
+    from app.db import AsyncSessionLocal
+
+    parser = argparse.ArgumentParser(description="Re-score completed assistant tests under other thresholds")
+    parser.add_argument("rules", nargs="*", help="MIN_TOP:MIN_LEAD, e.g. 4:1 6:2")
+    parser.add_argument("--survey", default=settings.ASSISTANT_TEST_SURVEY_CODE)
+    args = parser.parse_args()
+    try:
+        rules = [ScoringRule.parse(value) for value in args.rules]
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    async with AsyncSessionLocal() as session:
+        matrix = await load_score_matrix(session, args.survey)
+    print(f"{matrix.total} completed responses, {len(matrix)} distinct score triples; baseline {DEFAULT_RULE.label}")
+    print(_format_outcomes(compare_rules(matrix, rules), matrix.total))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
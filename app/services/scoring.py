@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Iterable, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Response, Survey
+
+if TYPE_CHECKING:
+    from app.services.survey_cache import CompiledQuestion
+
+# Option value -> result type it counts towards.
+SCORE_TYPES = {"A": "OFFICE", "B": "PERSONAL", "C": "BUSINESS"}
+RESULT_TYPES = ("OFFICE", "PERSONAL", "BUSINESS", "MULTI")
+
+
+@dataclass(frozen=True)
+class ScoringRule:
+    # A single type wins when its score is at least min_top and beats the runner-up by min_lead.
+    min_top: int = 5
+    min_lead: int = 2
+
+    @property
+    def label(self) -> str:
+        return f"{self.min_top}:{self.min_lead}"
+
+    @classmethod
+    def parse(cls, value: str) -> ScoringRule:
+        try:
+            min_top, min_lead = (int(part) for part in value.split(":"))
+        except ValueError:
+            raise ValueError(f"Rule must look like MIN_TOP:MIN_LEAD, got {value!r}") from None
+        return cls(min_top=min_top, min_lead=min_lead)
+
+
+DEFAULT_RULE = ScoringRule()
+
+
+def score_key(value: Optional[str]) -> Optional[str]:
+    key = (value or "").strip().upper()
+    return key if key in SCORE_TYPES else None
+
+
+def classify_scores(score_a: int, score_b: int, score_c: int, rule: ScoringRule = DEFAULT_RULE) -> str:
+    scores = {"OFFICE": score_a, "PERSONAL": score_b, "BUSINESS": score_c}
+    ordered = sorted(scores.values(), reverse=True)
+    top, second = ordered[0], ordered[1]
+    if top >= rule.min_top and (top - second) >= rule.min_lead:
+        for key, value in scores.items():
+            if value == top:
+                return key
+    return "MULTI"
+
+
+def add_option_scores(response: Response, question: CompiledQuestion, option_ids: Iterable[int]) -> None:
+    for option_id in option_ids:
+        option = question.option(option_id)
+        key = option.score if option else None
+        if key == "A":
+            response.score_a = (response.score_a or 0) + 1
+        elif key == "B":
+            response.score_b = (response.score_b or 0) + 1
+        elif key == "C":
+            response.score_c = (response.score_c or 0) + 1
+
+
+def store_result_type(response: Response) -> str:
+    result_type = classify_scores(response.score_a or 0, response.score_b or 0, response.score_c or 0)
+    response.result_type = result_type
+    return result_type
+
+
+async def get_result_counts(session: AsyncSession, survey_code: str) -> dict[str, int]:
+    result = await session.execute(
+        select(Response.result_type, func.count(Response.id))
+        .join(Survey, Survey.id == Response.survey_id)
+        .where(Survey.code == survey_code, Response.result_type.is_not(None))
+        .group_by(Response.result_type)
+    )
+    counts = {result_type: 0 for result_type in RESULT_TYPES}
+    for result_type, count in result.all():
+        counts[result_type] = int(count)
+    return counts
@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import asyncio
 import json
 from datetime import datetime
 from typing import Any
@@ -54,24 +53,34 @@ def _prepare_payload(raw: dict[str, Any]) -> tuple[list[str], list[str]]:
     return headers, row
 
 
-def _send_sync(raw: dict[str, Any]) -> None:
-    credentials = _load_credentials()
-    client = gspread.authorize(credentials)
-    spreadsheet = client.open_by_key(settings.GOOGLE_SHEET_ID)
-    worksheet = spreadsheet.worksheet(settings.GOOGLE_SHEET_TAB)
-
-    headers, row = _prepare_payload(raw)
-    existing_headers = worksheet.row_values(1)
-    if not existing_headers:
-        worksheet.update([headers], "A1")
-    worksheet.append_row(row, value_input_option="USER_ENTERED")
-
-
-async def send_to_google_sheets(session: AsyncSession, response_id: int) -> None:
-    raw = await build_payload(session, response_id)
-    if not raw:
-        return
-    await asyncio.to_thread(_send_sync, raw)
+class SheetsClient:
+    def __init__(self) -> None:
+        self._worksheet: gspread.Worksheet | None = None
+        self._has_headers = False
+
+    def _get_worksheet(self) -> gspread.Worksheet:
+        if self._worksheet is None:
+            client = gspread.authorize(_load_credentials())
+            spreadsheet = client.open_by_key(settings.GOOGLE_SHEET_ID)
+            self._worksheet = spreadsheet.worksheet(settings.GOOGLE_SHEET_TAB)
+            self._has_headers = False
+        return self._worksheet
+
+    def append_payloads(self, payloads: list[dict[str, Any]]) -> None:
+        if not payloads:
+            return
+        try:
+            worksheet = self._get_worksheet()
+            prepared = [_prepare_payload(raw) for raw in payloads]
+            if not self._has_headers:
+                if not worksheet.row_values(1):
+                    worksheet.update([prepared[0][0]], "A1")
+                self._has_headers = True
+            worksheet.append_rows([row for _, row in prepared], value_input_option="USER_ENTERED")
+        except Exception:
+            # Re-authorize on the next batch in case the token or the worksheet went stale.
+            self._worksheet = None
+            raise
 
 
 async def build_payload(session: AsyncSession, response_id: int) -> dict[str, Any] | None:
@@ -107,7 +116,7 @@ async def build_payload(session: AsyncSession, response_id: int) -> dict[str, An
                 value = "; ".join([t for t in texts if t])
             if answer.file_ids:
                 files = await get_uploaded_files(session, answer.file_ids)
-                file_urls = [f.public_url for f in files]
+                file_urls = [f.public_url for f in files if f.public_url]
                 value = "; ".join(file_urls)
                 files_links.extend(file_urls)
 
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import AsyncSessionLocal, commit_or_defer
+from app.models import SheetsOutbox
+from app.services.sheets import SheetsClient, build_payload, sheets_enabled
+from app.services.sheets_stub import append_stub_payloads
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+POLL_INTERVAL = 5.0
+CLAIM_TIMEOUT = timedelta(minutes=5)
+MAX_BACKOFF = timedelta(minutes=30)
+
+_wakeup: asyncio.Event | None = None
+
+
+@dataclass
+class OutboxStats:
+    pending: int
+    retrying: int
+    oldest_pending_at: Optional[datetime]
+
+
+async def enqueue_sheets_export(session: AsyncSession, response_id: int) -> Optional[SheetsOutbox]:
+    payload = await build_payload(session, response_id)
+    if not payload:
+        return None
+    entry = SheetsOutbox(response_id=response_id, payload=payload, status="pending", next_attempt_at=datetime.utcnow())
+    session.add(entry)
+    await commit_or_defer(session, entry)
+    if _wakeup is not None:
+        _wakeup.set()
+    return entry
+
+
+async def get_outbox_stats(session: AsyncSession) -> OutboxStats:
+    result = await session.execute(
+        select(
+            func.count(SheetsOutbox.id),
+            func.count(SheetsOutbox.id).filter(SheetsOutbox.attempts > 0),
+            func.min(SheetsOutbox.created_at),
+        ).where(SheetsOutbox.status == "pending")
+    )
+    pending, retrying, oldest = result.one()
+    return OutboxStats(pending=int(pending or 0), retrying=int(retrying or 0), oldest_pending_at=oldest)
+
+
+def _backoff(attempts: int) -> timedelta:
+    return min(timedelta(seconds=5 * 2 ** min(attempts, 10)), MAX_BACKOFF)
+
+
+async def _claim_batch(session: AsyncSession) -> list[SheetsOutbox]:
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    unlocked = or_(SheetsOutbox.locked_until.is_(None), SheetsOutbox.locked_until < now)
+    candidates = (
+        select(SheetsOutbox.id)
+        .where(SheetsOutbox.status == "pending", SheetsOutbox.next_attempt_at <= now, unlocked)
+        .order_by(SheetsOutbox.id.asc())
+        .limit(BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+    )
+    # The lock condition is repeated on the outer UPDATE so concurrent workers never claim the same row.
+    await session.execute(
+        update(SheetsOutbox)
+        .where(SheetsOutbox.id.in_(candidates.scalar_subquery()), unlocked)
+        .values(claim_token=token, locked_until=now + CLAIM_TIMEOUT)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    result = await session.execute(
+        select(SheetsOutbox).where(SheetsOutbox.claim_token == token).order_by(SheetsOutbox.id.asc())
+    )
+    return list(result.scalars().all())
+
+
+def _deliver(client: SheetsClient | None, payloads: list[dict[str, Any]]) -> None:
+    if client is not None:
+        client.append_payloads(payloads)
+    else:
+        append_stub_payloads(payloads)
+
+
+async def flush_sheets_outbox(client: SheetsClient | None) -> int:
+    async with AsyncSessionLocal() as session:
+        entries = await _claim_batch(session)
+        if not entries:
+            return 0
+        try:
+            await asyncio.to_thread(_deliver, client, [entry.payload for entry in entries])
+        except Exception as exc:
+            now = datetime.utcnow()
+            for entry in entries:
+                entry.attempts += 1
+                entry.last_error = repr(exc)[:2000]
+                entry.next_attempt_at = now + _backoff(entry.attempts)
+                entry.claim_token = None
+                entry.locked_until = None
+            await session.commit()
+            logger.exception("Sheets export of %d rows failed, retrying later", len(entries))
+            return 0
+
+        now = datetime.utcnow()
+        for entry in entries:
+            entry.status = "sent"
+            entry.sent_at = now
+            entry.attempts += 1
+            entry.last_error = None
+            entry.claim_token = None
+            entry.locked_until = None
+        await session.commit()
+        return len(entries)
+
+
+async def run_sheets_outbox_worker() -> None:
+    global _wakeup
+    _wakeup = asyncio.Event()
+    client = SheetsClient() if sheets_enabled() else None
+    while True:
+        try:
+            sent = await flush_sheets_outbox(client)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Sheets outbox worker iteration failed")
+            sent = 0
+        if sent >= BATCH_SIZE:
+            continue
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
@@ -1,13 +1,25 @@
 from __future__ import annotations
 
+import base64
+import json
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Iterable, Optional
+from typing import TYPE_CHECKING, Iterable, Optional, Union
 
-from sqlalchemy import select, update, func
+from sqlalchemy import cast, func, literal, or_, select, tuple_, update
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.db import commit_or_defer, dialect_insert, unit_of_work
 from app.models import Answer, Option, Question, Response, Survey, UploadedFile, User
 
+if TYPE_CHECKING:
+    from app.services.survey_cache import CompiledQuestion, CompiledSurvey
+
+
+class StaleResponse(RuntimeError):
+    pass
+
 
 async def get_active_survey(session: AsyncSession, code: str | None = None) -> Survey:
     stmt = select(Survey).where(Survey.is_active.is_(True))
@@ -50,28 +62,70 @@ async def get_question(session: AsyncSession, question_id: int) -> Question:
     return question
 
 
+def _apply_user_profile(user: User, username: str | None, first_name: str | None, last_name: str | None) -> None:
+    if user.username != username:
+        user.username = username
+    if user.first_name != first_name:
+        user.first_name = first_name
+    if user.last_name != last_name:
+        user.last_name = last_name
+
+
 async def get_or_create_user(session: AsyncSession, tg_id: int, username: str | None, first_name: str | None, last_name: str | None) -> User:
     result = await session.execute(select(User).where(User.tg_id == tg_id))
     user = result.scalars().first()
     if user:
-        user.username = username
-        user.first_name = first_name
-        user.last_name = last_name
-        await session.commit()
+        _apply_user_profile(user, username, first_name, last_name)
+        await commit_or_defer(session)
         return user
 
-    user = User(
-        tg_id=tg_id,
-        username=username,
-        first_name=first_name,
-        last_name=last_name,
+    # The first updates of a new chat can arrive together; the loser of the insert race gets the same row.
+    profile = {"username": username, "first_name": first_name, "last_name": last_name}
+    stmt = (
+        dialect_insert(session)(User)
+        .values(tg_id=tg_id, **profile)
+        .on_conflict_do_update(index_elements=[User.tg_id], set_=profile)
+        .returning(User)
     )
-    session.add(user)
-    await session.commit()
-    await session.refresh(user)
+    result = await session.execute(stmt, execution_options={"populate_existing": True})
+    user = result.scalars().one()
+    await commit_or_defer(session)
     return user
 
 
+async def get_user_with_active_response(
+    session: AsyncSession,
+    survey_id: int,
+    tg_id: int,
+    username: str | None,
+    first_name: str | None,
+    last_name: str | None,
+) -> tuple[User, Optional[Response]]:
+    active_response_id = (
+        select(Response.id)
+        .where(Response.user_id == User.id, Response.survey_id == survey_id)
+        .where(Response.status == "in_progress")
+        .order_by(Response.started_at.desc())
+        .limit(1)
+        .correlate(User)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        select(User, Response)
+        .outerjoin(Response, Response.id == active_response_id)
+        .where(User.tg_id == tg_id)
+    )
+    row = result.first()
+    if row:
+        user, response = row
+        _apply_user_profile(user, username, first_name, last_name)
+        await commit_or_defer(session)
+        return user, response
+
+    user = await get_or_create_user(session, tg_id, username, first_name, last_name)
+    return user, None
+
+
 async def get_active_response(session: AsyncSession, user_id: int, survey_id: int) -> Optional[Response]:
     result = await session.execute(
         select(Response)
@@ -89,7 +143,7 @@ async def abandon_active_responses(session: AsyncSession, user_id: int, survey_i
         .where(Response.status == "in_progress")
         .values(status="abandoned")
     )
-    await session.commit()
+    await commit_or_defer(session)
 
 
 async def start_new_response(session: AsyncSession, user_id: int, survey_id: int, first_question_id: int) -> Response:
@@ -101,8 +155,7 @@ async def start_new_response(session: AsyncSession, user_id: int, survey_id: int
         current_question_id=first_question_id,
     )
     session.add(response)
-    await session.commit()
-    await session.refresh(response)
+    await commit_or_defer(session, response)
     return response
 
 
@@ -113,37 +166,47 @@ async def get_answer(session: AsyncSession, response_id: int, question_id: int)
     return result.scalars().first()
 
 
-async def save_text_answer(session: AsyncSession, response_id: int, question_id: int, value: str) -> Answer:
-    answer = await get_answer(session, response_id, question_id)
-    if answer:
-        answer.text_value = value
-    else:
-        answer = Answer(response_id=response_id, question_id=question_id, text_value=value)
-        session.add(answer)
-    await session.commit()
-    await session.refresh(answer)
+def _json_append(session: AsyncSession, column, value: int):
+    if session.bind.dialect.name == "postgresql":
+        empty = cast(literal("[]"), postgresql.JSONB)
+        return func.coalesce(column, empty).op("||", return_type=postgresql.JSONB)(func.jsonb_build_array(value))
+    return func.json_insert(func.coalesce(column, "[]"), "$[#]", value)
+
+
+async def _upsert_answer(
+    session: AsyncSession,
+    response_id: int,
+    question_id: int,
+    values: dict[str, object],
+    on_conflict: dict[str, object] | None = None,
+) -> Answer:
+    stmt = (
+        dialect_insert(session)(Answer)
+        .values(response_id=response_id, question_id=question_id, **values)
+        .on_conflict_do_update(
+            index_elements=[Answer.response_id, Answer.question_id],
+            set_=on_conflict if on_conflict is not None else values,
+        )
+        .returning(Answer)
+    )
+    result = await session.execute(stmt, execution_options={"populate_existing": True})
+    answer = result.scalars().one()
+    await commit_or_defer(session)
     return answer
 
 
+async def save_text_answer(session: AsyncSession, response_id: int, question_id: int, value: str) -> Answer:
+    return await _upsert_answer(session, response_id, question_id, {"text_value": value})
+
+
 async def save_option_answer(session: AsyncSession, response_id: int, question_id: int, option_ids: list[int]) -> Answer:
-    answer = await get_answer(session, response_id, question_id)
-    if answer:
-        answer.option_values = option_ids
-    else:
-        answer = Answer(response_id=response_id, question_id=question_id, option_values=option_ids)
-        session.add(answer)
-    await session.commit()
-    await session.refresh(answer)
-    return answer
+    return await _upsert_answer(session, response_id, question_id, {"option_values": option_ids})
 
 
 async def toggle_option_answer(session: AsyncSession, response_id: int, question_id: int, option_id: int) -> Answer:
     answer = await get_answer(session, response_id, question_id)
     if not answer:
-        answer = Answer(response_id=response_id, question_id=question_id, option_values=[])
-        session.add(answer)
-        await session.commit()
-        await session.refresh(answer)
+        return await _upsert_answer(session, response_id, question_id, {"option_values": [option_id]})
 
     selected = set(answer.option_values or [])
     if option_id in selected:
@@ -151,23 +214,19 @@ async def toggle_option_answer(session: AsyncSession, response_id: int, question
     else:
         selected.add(option_id)
     answer.option_values = list(sorted(selected))
-    await session.commit()
-    await session.refresh(answer)
+    await commit_or_defer(session, answer)
     return answer
 
 
 async def append_file_answer(session: AsyncSession, response_id: int, question_id: int, file_id: int) -> Answer:
-    answer = await get_answer(session, response_id, question_id)
-    if not answer:
-        answer = Answer(response_id=response_id, question_id=question_id, file_ids=[file_id])
-        session.add(answer)
-    else:
-        current = list(answer.file_ids or [])
-        current.append(file_id)
-        answer.file_ids = current
-    await session.commit()
-    await session.refresh(answer)
-    return answer
+    # Album parts arrive concurrently; appending in SQL keeps every file id.
+    return await _upsert_answer(
+        session,
+        response_id,
+        question_id,
+        {"file_ids": [file_id]},
+        {"file_ids": _json_append(session, Answer.file_ids, file_id)},
+    )
 
 
 async def get_next_question(session: AsyncSession, survey_id: int, current_question_id: int | None) -> Optional[Question]:
@@ -186,28 +245,110 @@ async def get_next_question(session: AsyncSession, survey_id: int, current_quest
     return result.scalars().first()
 
 
-async def advance_response(session: AsyncSession, response: Response) -> Optional[Question]:
-    next_question = await get_next_question(session, response.survey_id, response.current_question_id)
+async def advance_response(
+    session: AsyncSession, response: Response, survey: CompiledSurvey | None = None
+) -> Optional[Union[Question, CompiledQuestion]]:
+    current_question_id = response.current_question_id
+    if survey is not None:
+        next_question = survey.next_question(current_question_id)
+    else:
+        next_question = await get_next_question(session, response.survey_id, current_question_id)
     if next_question:
-        response.current_question_id = next_question.id
-        await session.commit()
-        return next_question
-
-    response.status = "completed"
-    response.completed_at = datetime.utcnow()
-    response.current_question_id = None
-    await session.commit()
-    return None
+        values = {"current_question_id": next_question.id}
+    else:
+        values = {"status": "completed", "completed_at": datetime.utcnow(), "current_question_id": None}
+    # Compare-and-set: the same tap handled by another process must not move the user past a question.
+    result = await session.execute(
+        update(Response)
+        .where(Response.id == response.id, Response.current_question_id == current_question_id)
+        .values(**values)
+    )
+    if result.rowcount == 0:
+        raise StaleResponse("Response was already advanced")
+    await commit_or_defer(session)
+    return next_question
 
 
 async def update_user_phone(session: AsyncSession, user_id: int, phone: str) -> None:
     await session.execute(update(User).where(User.id == user_id).values(phone=phone))
-    await session.commit()
-
+    await commit_or_defer(session)
+
+
+USER_SORT_COLUMNS = {
+    "created_at": User.created_at,
+    "tg_id": User.tg_id,
+    "username": func.coalesce(User.username, ""),
+    "first_name": func.coalesce(User.first_name, ""),
+}
+
+
+@dataclass
+class UsersPage:
+    users: list[User]
+    next_cursor: Optional[str]
+
+
+def _encode_cursor(value: object, user_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, user_id], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, sort: str) -> tuple[object, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, user_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if sort == "created_at":
+            value = datetime.fromisoformat(value)
+        return value, int(user_id)
+    except (ValueError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+async def list_users_page(
+    session: AsyncSession,
+    *,
+    sort: str = "created_at",
+    descending: bool = True,
+    search: str | None = None,
+    cursor: str | None = None,
+    limit: int = 50,
+) -> UsersPage:
+    sort_column = USER_SORT_COLUMNS.get(sort)
+    if sort_column is None:
+        raise ValueError("Unknown sort column")
+
+    stmt = select(User, sort_column.label("sort_value"))
+    if search:
+        pattern = f"%{search.strip()}%"
+        conditions = [
+            User.username.ilike(pattern),
+            User.first_name.ilike(pattern),
+            User.last_name.ilike(pattern),
+            User.phone.ilike(pattern),
+        ]
+        if search.strip().isdigit():
+            conditions.append(User.tg_id == int(search.strip()))
+        stmt = stmt.where(or_(*conditions))
+    if cursor:
+        value, user_id = _decode_cursor(cursor, sort)
+        key = tuple_(sort_column, User.id)
+        stmt = stmt.where(key < tuple_(value, user_id) if descending else key > tuple_(value, user_id))
+
+    if descending:
+        stmt = stmt.order_by(sort_column.desc(), User.id.desc())
+    else:
+        stmt = stmt.order_by(sort_column.asc(), User.id.asc())
 
-async def list_users(session: AsyncSession) -> list[User]:
-    result = await session.execute(select(User).order_by(User.created_at.desc()))
-    return list(result.scalars().all())
+    result = await session.execute(stmt.limit(limit + 1))
+    rows = result.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_user, last_value = rows[-1]
+        next_cursor = _encode_cursor(last_value, last_user.id)
+    return UsersPage(users=[row[0] for row in rows], next_cursor=next_cursor)
 
 
 async def get_options_map(session: AsyncSession, question_ids: Iterable[int]) -> dict[int, dict[int, str]]:
@@ -245,7 +386,18 @@ async def append_question_message_id(session: AsyncSession, response_id: int, me
     current = list(response.question_message_ids or [])
     current.append(message_id)
     response.question_message_ids = current
-    await session.commit()
+    await commit_or_defer(session)
+
+
+async def record_question_messages(response_id: int, message_ids: list[int]) -> None:
+    # Runs after the messages are sent, as one UPDATE in its own short transaction.
+    if not message_ids:
+        return
+    async with unit_of_work() as session:
+        value = Response.question_message_ids
+        for message_id in message_ids:
+            value = _json_append(session, value, message_id)
+        await session.execute(update(Response).where(Response.id == response_id).values(question_message_ids=value))
 
 
 async def append_user_message_id(session: AsyncSession, response_id: int, message_id: int) -> None:
@@ -255,4 +407,4 @@ async def append_user_message_id(session: AsyncSession, response_id: int, messag
     current = list(response.user_message_ids or [])
     current.append(message_id)
     response.user_message_ids = current
-    await session.commit()
+    await commit_or_defer(session)
@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Union
+
+from aiogram.types import InlineKeyboardMarkup, ReplyKeyboardMarkup
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from app.bot.keyboards import (
+    build_contact_keyboard,
+    build_file_keyboard,
+    build_multi_choice_keyboard,
+    build_single_choice_keyboard,
+    format_question_text,
+)
+from app.config import DATA_DIR
+from app.db import AsyncSessionLocal
+from app.models import Question, Survey
+from app.services.scoring import score_key
+
+
+@dataclass(frozen=True)
+class CompiledOption:
+    id: int
+    question_id: int
+    text: str
+    value: str
+    order: int
+    score: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class CompiledQuestion:
+    id: int
+    survey_id: int
+    code: str
+    text: str
+    type: str
+    required: bool
+    order: int
+    allow_multiple: bool
+    help_text: Optional[str]
+    settings: Mapping[str, Any]
+    image_path: Optional[str]
+    image_name: Optional[str]
+    image_mime: Optional[str]
+    options: tuple[CompiledOption, ...]
+    rendered_text: str = ""
+    keyboard: Union[InlineKeyboardMarkup, ReplyKeyboardMarkup, None] = field(default=None, compare=False)
+
+    def option(self, option_id: int) -> Optional[CompiledOption]:
+        for opt in self.options:
+            if opt.id == option_id:
+                return opt
+        return None
+
+
+@dataclass(frozen=True)
+class CompiledSurvey:
+    id: int
+    code: str
+    title: str
+    is_active: bool
+    questions: tuple[CompiledQuestion, ...]
+    questions_by_id: Mapping[int, CompiledQuestion]
+    next_question_ids: Mapping[int, Optional[int]]
+
+    @property
+    def first_question(self) -> Optional[CompiledQuestion]:
+        return self.questions[0] if self.questions else None
+
+    def question(self, question_id: int) -> CompiledQuestion:
+        question = self.questions_by_id.get(question_id)
+        if not question:
+            raise RuntimeError("Question not found")
+        return question
+
+    def next_question(self, current_question_id: int | None) -> Optional[CompiledQuestion]:
+        if current_question_id is None:
+            return self.first_question
+        next_id = self.next_question_ids.get(current_question_id)
+        return self.questions_by_id[next_id] if next_id is not None else None
+
+    def options_map(self) -> dict[int, dict[int, str]]:
+        return {q.id: {opt.id: opt.text for opt in q.options} for q in self.questions}
+
+
+# Admin edits touch this file so other processes (the polling process) reload too.
+STAMP_PATH = DATA_DIR / "survey_cache.stamp"
+STAMP_CHECK_INTERVAL = 1.0
+
+_snapshots: Mapping[str, CompiledSurvey] = MappingProxyType({})
+_lock = asyncio.Lock()
+_seen_stamp: Optional[int] = None
+_stamp_checked_at = 0.0
+
+
+def _render_keyboard(
+    question_type: str, question_id: int, options: tuple[CompiledOption, ...]
+) -> Union[InlineKeyboardMarkup, ReplyKeyboardMarkup, None]:
+    if question_type == "single_choice":
+        return build_single_choice_keyboard(question_id, list(options))
+    if question_type == "multi_choice":
+        return build_multi_choice_keyboard(question_id, list(options), set())
+    if question_type == "file":
+        return build_file_keyboard(question_id)
+    if question_type == "contact":
+        return build_contact_keyboard()
+    return None
+
+
+def _compile_question(question: Question) -> CompiledQuestion:
+    options = tuple(
+        CompiledOption(
+            id=opt.id,
+            question_id=question.id,
+            text=opt.text,
+            value=opt.value,
+            order=opt.order,
+            score=score_key(opt.value),
+        )
+        for opt in sorted(question.options, key=lambda opt: (opt.order, opt.id))
+    )
+    return CompiledQuestion(
+        id=question.id,
+        survey_id=question.survey_id,
+        code=question.code,
+        text=question.text,
+        type=question.type,
+        required=question.required,
+        order=question.order,
+        allow_multiple=question.allow_multiple,
+        help_text=question.help_text,
+        settings=MappingProxyType(dict(question.settings or {})),
+        image_path=question.image_path,
+        image_name=question.image_name,
+        image_mime=question.image_mime,
+        options=options,
+        rendered_text=format_question_text(question),
+        keyboard=_render_keyboard(question.type, question.id, options),
+    )
+
+
+def compile_survey(survey: Survey) -> CompiledSurvey:
+    ordered = sorted(survey.questions, key=lambda q: (q.order, q.id))
+    questions = tuple(_compile_question(q) for q in ordered)
+    next_ids: dict[int, Optional[int]] = {}
+    for idx, question in enumerate(questions):
+        # Same rule as get_next_question: the first question with a strictly greater order.
+        next_ids[question.id] = next((q.id for q in questions[idx + 1 :] if q.order > question.order), None)
+    return CompiledSurvey(
+        id=survey.id,
+        code=survey.code,
+        title=survey.title,
+        is_active=survey.is_active,
+        questions=questions,
+        questions_by_id=MappingProxyType({q.id: q for q in questions}),
+        next_question_ids=MappingProxyType(next_ids),
+    )
+
+
+async def _load(session: AsyncSession, code: str) -> Optional[CompiledSurvey]:
+    result = await session.execute(
+        select(Survey)
+        .where(Survey.code == code)
+        .options(selectinload(Survey.questions).selectinload(Question.options))
+    )
+    survey = result.scalars().first()
+    return compile_survey(survey) if survey else None
+
+
+def _read_stamp() -> int:
+    try:
+        return STAMP_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def _touch_stamp() -> int:
+    STAMP_PATH.parent.mkdir(parents=True, exist_ok=True)
+    STAMP_PATH.write_text(str(time.time_ns()))
+    return _read_stamp()
+
+
+async def _revalidate() -> None:
+    global _seen_stamp, _stamp_checked_at
+    now = time.monotonic()
+    if now - _stamp_checked_at < STAMP_CHECK_INTERVAL:
+        return
+    _stamp_checked_at = now
+    stamp = _read_stamp()
+    if _seen_stamp is None:
+        _seen_stamp = stamp
+    elif stamp != _seen_stamp:
+        _seen_stamp = stamp
+        await reload_compiled_surveys(notify=False)
+
+
+async def get_compiled_survey(code: str, *, require_active: bool = False) -> CompiledSurvey:
+    await _revalidate()
+    snapshot = _snapshots.get(code)
+    if snapshot is None:
+        async with _lock:
+            snapshot = _snapshots.get(code)
+            if snapshot is None:
+                async with AsyncSessionLocal() as session:
+                    snapshot = await _load(session, code)
+                if snapshot is None:
+                    raise RuntimeError("Survey not found")
+                _swap({**_snapshots, code: snapshot})
+    if require_active and not snapshot.is_active:
+        raise RuntimeError("No active survey found")
+    return snapshot
+
+
+async def get_compiled_survey_by_id(survey_id: int) -> CompiledSurvey:
+    for snapshot in _snapshots.values():
+        if snapshot.id == survey_id:
+            return snapshot
+    async with AsyncSessionLocal() as session:
+        survey = await session.get(Survey, survey_id)
+        if not survey:
+            raise RuntimeError("Survey not found")
+        code = survey.code
+    return await get_compiled_survey(code)
+
+
+async def reload_compiled_surveys(notify: bool = True) -> None:
+    global _seen_stamp
+    async with _lock:
+        codes = list(_snapshots.keys())
+        fresh: dict[str, CompiledSurvey] = {}
+        async with AsyncSessionLocal() as session:
+            for code in codes:
+                snapshot = await _load(session, code)
+                if snapshot is not None:
+                    fresh[code] = snapshot
+        _swap(fresh)
+        if notify:
+            _seen_stamp = _touch_stamp()
+
+
+def _swap(snapshots: dict[str, CompiledSurvey]) -> None:
+    global _snapshots
+    _snapshots = MappingProxyType(snapshots)
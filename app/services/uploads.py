@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import aiofiles
+import aiofiles.os
+from starlette.datastructures import UploadFile
+
+from app.services.media_cache import forget_media
+
+CHUNK_SIZE = 256 * 1024
+
+PDF_TYPES = {"application/pdf"}
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+
+class UploadRejected(ValueError):
+    def __init__(self, message: str, status_code: int = 400) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    # The browser-supplied content type and extension are only hints; trust the first bytes.
+    if head.startswith(b"%PDF-"):
+        return "application/pdf"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+async def save_upload(upload: UploadFile, target: Path, *, allowed_types: set[str], max_size: int) -> str:
+    await aiofiles.os.makedirs(target.parent, exist_ok=True)
+    tmp_path = target.with_name(f".{target.name}.{uuid.uuid4().hex}.part")
+    mime_type = None
+    written = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while chunk := await upload.read(CHUNK_SIZE):
+                if mime_type is None:
+                    mime_type = sniff_mime(chunk)
+                    if mime_type not in allowed_types:
+                        raise UploadRejected(f"{upload.filename}: unsupported file type")
+                written += len(chunk)
+                if written > max_size:
+                    raise UploadRejected(f"{upload.filename}: file is larger than {max_size} bytes", 413)
+                await out.write(chunk)
+        if mime_type is None:
+            raise UploadRejected(f"{upload.filename}: empty file")
+        await aiofiles.os.replace(tmp_path, target)
+    finally:
+        if await aiofiles.os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
+    await forget_media(target)
+    return mime_type
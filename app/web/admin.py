@@ -14,12 +14,20 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.config import BASE_DIR, QUESTION_IMAGES_DIR, settings
 from app.db import AsyncSessionLocal
 from app.models import Option, Question
-from app.services.survey import get_active_survey, get_survey_by_code, list_surveys, list_users
+from app.services.media_manifest import forget_media_source, refresh_media_source
+from app.services.rescoring import compare_rules, load_score_matrix
+from app.services.scoring import RESULT_TYPES, ScoringRule, get_result_counts
+from app.services.sheets_outbox import get_outbox_stats
+from app.services.survey import USER_SORT_COLUMNS, get_active_survey, get_survey_by_code, list_surveys, list_users_page
+from app.services.survey_cache import reload_compiled_surveys
+from app.services.uploads import IMAGE_TYPES, PDF_TYPES, UploadRejected, save_upload
 
 router = APIRouter(prefix="/admin")
 
 templates = Jinja2Templates(directory=str(BASE_DIR / "app" / "web" / "templates"))
 
+USERS_PAGE_SIZE = 50
+
 
 def _safe_filename(value: str) -> str:
     value = value.strip().replace(" ", "_")
@@ -63,6 +71,8 @@ async def assistant_test_files(request: Request, token: str = Depends(require_ad
         "MULTI": base_dir / "multi_assistant.pdf",
     }
     statuses = {key: path.exists() for key, path in files.items()}
+    async with AsyncSessionLocal() as session:
+        result_counts = await get_result_counts(session, settings.ASSISTANT_TEST_SURVEY_CODE)
     return templates.TemplateResponse(
         "assistant_test_files.html",
         {
@@ -70,6 +80,29 @@ async def assistant_test_files(request: Request, token: str = Depends(require_ad
             "token": token,
             "files": files,
             "statuses": statuses,
+            "result_counts": result_counts,
+        },
+    )
+
+
+@router.get("/assistant-test-rescore")
+async def assistant_test_rescore(request: Request, token: str = Depends(require_admin)):
+    raw_rules = request.query_params.get("rules", "").strip()
+    try:
+        rules = [ScoringRule.parse(value.strip()) for value in raw_rules.split(",") if value.strip()]
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    async with AsyncSessionLocal() as session:
+        matrix = await load_score_matrix(session)
+    return templates.TemplateResponse(
+        "rescore.html",
+        {
+            "request": request,
+            "token": token,
+            "raw_rules": raw_rules,
+            "total": matrix.total,
+            "outcomes": compare_rules(matrix, rules),
+            "result_types": RESULT_TYPES,
         },
     )
 
@@ -78,7 +111,6 @@ async def assistant_test_files(request: Request, token: str = Depends(require_ad
 async def assistant_test_files_upload(request: Request, token: str = Depends(require_admin)):
     form = await request.form()
     base_dir = Path(settings.ASSISTANT_TEST_PDF_DIR)
-    base_dir.mkdir(parents=True, exist_ok=True)
 
     mapping = {
         "office": "office_assistant.pdf",
@@ -93,10 +125,10 @@ async def assistant_test_files_upload(request: Request, token: str = Depends(req
             continue
         if not str(upload.filename).lower().endswith(".pdf"):
             continue
-        content = await upload.read()
-        target_path = base_dir / filename
-        with target_path.open("wb") as f:
-            f.write(content)
+        try:
+            await save_upload(upload, base_dir / filename, allowed_types=PDF_TYPES, max_size=settings.ADMIN_MAX_PDF_SIZE)
+        except UploadRejected as exc:
+            raise HTTPException(status_code=exc.status_code, detail=str(exc))
 
     return RedirectResponse(url=f"/admin/assistant-test-files?token={token}", status_code=303)
 
@@ -166,23 +198,31 @@ async def update_question(request: Request, question_id: int, token: str = Depen
 
         if "remove_image" in form:
             if question.image_path and os.path.exists(question.image_path):
+                await forget_media_source(question.image_path)
                 with suppress(Exception):
                     os.remove(question.image_path)
+                await refresh_media_source(question.image_path)
             question.image_path = None
             question.image_name = None
             question.image_mime = None
 
         upload = form.get("image")
         if upload is not None and getattr(upload, "filename", None):
-            QUESTION_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
             safe_name = _safe_filename(upload.filename)
             target_path = QUESTION_IMAGES_DIR / f"q{question.id}_{safe_name}"
-            content = await upload.read()
-            with target_path.open("wb") as f:
-                f.write(content)
+            if question.image_path:
+                # Resolved before the upload can overwrite the file under the same name.
+                await forget_media_source(question.image_path)
+            try:
+                mime_type = await save_upload(
+                    upload, target_path, allowed_types=IMAGE_TYPES, max_size=settings.ADMIN_MAX_IMAGE_SIZE
+                )
+            except UploadRejected as exc:
+                raise HTTPException(status_code=exc.status_code, detail=str(exc))
+            await refresh_media_source(target_path)
             question.image_path = str(target_path)
             question.image_name = safe_name
-            question.image_mime = getattr(upload, "content_type", None)
+            question.image_mime = mime_type
 
         for opt in question.options:
             text = form.get(f"opt_{opt.id}_text")
@@ -209,6 +249,8 @@ async def update_question(request: Request, question_id: int, token: str = Depen
 
         await session.commit()
 
+    await reload_compiled_surveys()
+
     redirect_url = f"/admin/questions/{question_id}?token={token}"
     if survey_code:
         redirect_url = f"{redirect_url}&survey_code={survey_code}"
@@ -233,13 +275,45 @@ async def question_image(question_id: int, token: str = Depends(require_admin)):
 
 @router.get("/users")
 async def users_list(request: Request, token: str = Depends(require_admin)):
+    sort = request.query_params.get("sort", "created_at")
+    if sort not in USER_SORT_COLUMNS:
+        sort = "created_at"
+    order = "asc" if request.query_params.get("order") == "asc" else "desc"
+    search = request.query_params.get("q", "").strip()
+    cursor = request.query_params.get("after") or None
     async with AsyncSessionLocal() as session:
-        users = await list_users(session)
+        try:
+            page = await list_users_page(
+                session,
+                sort=sort,
+                descending=order == "desc",
+                search=search or None,
+                cursor=cursor,
+                limit=USERS_PAGE_SIZE,
+            )
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     return templates.TemplateResponse(
         "users.html",
         {
             "request": request,
-            "users": users,
+            "users": page.users,
+            "next_cursor": page.next_cursor,
+            "sort": sort,
+            "order": order,
+            "search": search,
+            "is_first_page": cursor is None,
             "token": token,
         },
     )
+
+
+@router.get("/sheets-outbox")
+async def sheets_outbox_status(token: str = Depends(require_admin)):
+    async with AsyncSessionLocal() as session:
+        stats = await get_outbox_stats(session)
+    return {
+        "pending": stats.pending,
+        "retrying": stats.retrying,
+        "oldest_pending_at": stats.oldest_pending_at.isoformat() if stats.oldest_pending_at else None,
+    }
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import asyncio
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Hashable, Optional
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+from app.config import FILES_DIR, settings
+from app.db import AsyncSessionLocal
+from app.models import UploadedFile
+from app.services.file_urls import InvalidFileToken, verify_file_token
+
+router = APIRouter()
+
+
+@dataclass(frozen=True)
+class FileMeta:
+    path: str
+    file_name: Optional[str]
+    mime_type: Optional[str]
+    stat: os.stat_result
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.stat.st_size:x}-{self.stat.st_mtime_ns:x}"'
+
+    @property
+    def last_modified(self) -> str:
+        return formatdate(self.stat.st_mtime, usegmt=True)
+
+
+class _MetaCache:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._items: OrderedDict[Hashable, FileMeta] = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[FileMeta]:
+        meta = self._items.get(key)
+        if meta is not None:
+            self._items.move_to_end(key)
+        return meta
+
+    def put(self, key: Hashable, meta: FileMeta) -> None:
+        self._items[key] = meta
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+_meta_cache = _MetaCache(settings.FILES_META_CACHE_SIZE)
+
+
+def _stat_file(path: str) -> Optional[os.stat_result]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat if os.path.isfile(path) else None
+
+
+async def get_file_meta(file_id: int) -> FileMeta:
+    meta = _meta_cache.get(file_id)
+    if meta is not None:
+        return meta
+    async with AsyncSessionLocal() as session:
+        file = await session.get(UploadedFile, file_id)
+    # Only rows whose stored link is still the bare id; anything newer is reachable by its signed link alone.
+    if not file or file.blob_id is not None or not file.public_url.endswith(f"/files/{file_id}"):
+        raise HTTPException(status_code=404, detail="File not found")
+    stat = await asyncio.to_thread(_stat_file, file.local_path)
+    if stat is None:
+        raise HTTPException(status_code=404, detail="File missing")
+    # Stored uploads are never rewritten in place, so the stat stays valid for the lifetime of the entry.
+    meta = FileMeta(file.local_path, file.file_name, file.mime_type, stat)
+    _meta_cache.put(file_id, meta)
+    return meta
+
+
+async def get_signed_file_meta(token: str) -> FileMeta:
+    try:
+        signed = verify_file_token(token)
+    except InvalidFileToken:
+        raise HTTPException(status_code=404, detail="File not found")
+    # Deduplicated uploads share one blob, so only the file is cached; name and type come from each token.
+    cached = _meta_cache.get(signed.key)
+    if cached is None:
+        path = str(signed.path)
+        stat = await asyncio.to_thread(_stat_file, path)
+        if stat is None:
+            raise HTTPException(status_code=404, detail="File missing")
+        cached = FileMeta(path, None, None, stat)
+        _meta_cache.put(signed.key, cached)
+    return FileMeta(cached.path, signed.file_name, signed.mime_type, cached.stat)
+
+
+def _not_modified(request: Request, meta: FileMeta) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or meta.etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(meta.stat.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _content_disposition(file_name: Optional[str]) -> Optional[str]:
+    if not file_name:
+        return None
+    quoted = quote(file_name)
+    if quoted != file_name:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{file_name}"'
+
+
+def _offload_headers(meta: FileMeta) -> Optional[dict[str, str]]:
+    mode = settings.FILES_SENDFILE_MODE.lower()
+    if mode == "x-sendfile":
+        return {"X-Sendfile": meta.path}
+    if mode == "x-accel":
+        try:
+            relative = Path(meta.path).resolve().relative_to(FILES_DIR.resolve())
+        except ValueError:
+            return None
+        return {"X-Accel-Redirect": settings.FILES_ACCEL_PREFIX.rstrip("/") + "/" + quote(relative.as_posix())}
+    return None
+
+
+def file_response(request: Request, meta: FileMeta) -> Response:
+    headers = {
+        "ETag": meta.etag,
+        "Last-Modified": meta.last_modified,
+        "Cache-Control": f"private, max-age={settings.FILES_CACHE_MAX_AGE}, immutable",
+    }
+    if _not_modified(request, meta):
+        return Response(status_code=304, headers=headers)
+
+    offload = _offload_headers(meta)
+    if offload is not None:
+        # The proxy streams the file itself, including Range handling; the app only answers the lookup.
+        headers.update(offload)
+        disposition = _content_disposition(meta.file_name)
+        if disposition:
+            headers["Content-Disposition"] = disposition
+        return Response(media_type=meta.mime_type or "application/octet-stream", headers=headers)
+
+    return FileResponse(
+        path=meta.path,
+        media_type=meta.mime_type,
+        filename=meta.file_name,
+        headers=headers,
+        stat_result=meta.stat,
+    )
+
+
+@router.api_route("/files/{file_ref}", methods=["GET", "HEAD"])
+async def download_file(request: Request, file_ref: str):
+    if file_ref.isdigit():
+        # Links written before signing was introduced.
+        if not settings.FILES_ALLOW_LEGACY_IDS:
+            raise HTTPException(status_code=404, detail="File not found")
+        meta = await get_file_meta(int(file_ref))
+    else:
+        meta = await get_signed_file_meta(file_ref)
+    return file_response(request, meta)
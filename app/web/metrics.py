@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import hmac
+from datetime import datetime
+
+from aiohttp import web
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+
+from app.bot import ingestion
+from app.config import settings
+from app.db import AsyncSessionLocal, write_gate
+from app.metrics import REGISTRY, Counter, Gauge
+from app.services import media_cache
+from app.services.sheets_outbox import get_outbox_stats
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+router = APIRouter()
+
+OUTBOX_PENDING = Gauge("sheets_outbox_pending", "Rows waiting to be exported to Google Sheets")
+OUTBOX_RETRYING = Gauge("sheets_outbox_retrying", "Pending rows that already failed at least once")
+OUTBOX_OLDEST_AGE = Gauge("sheets_outbox_oldest_age_seconds", "Age of the oldest pending export")
+FILE_INGEST_JOBS = Gauge("file_ingest_jobs", "Candidate files being downloaded or waiting for a worker")
+MEDIA_CACHE_WRITES = Gauge("media_cache_pending_writes", "file_id cache rows not written yet")
+WRITE_GATE_WAITING = Gauge("sqlite_write_gate_waiting", "Sessions waiting for the SQLite write lock")
+WRITE_GATE_ACQUIRED = Counter("sqlite_write_gate_acquired_total", "SQLite write lock acquisitions")
+WRITE_GATE_WAIT = Counter("sqlite_write_gate_wait_seconds_total", "Time spent waiting for the SQLite write lock")
+WRITE_GATE_MAX_WAIT = Gauge("sqlite_write_gate_max_wait_seconds", "Longest wait for the SQLite write lock")
+
+
+async def _collect_outbox() -> None:
+    async with AsyncSessionLocal() as session:
+        stats = await get_outbox_stats(session)
+    OUTBOX_PENDING.set(stats.pending)
+    OUTBOX_RETRYING.set(stats.retrying)
+    age = (datetime.utcnow() - stats.oldest_pending_at).total_seconds() if stats.oldest_pending_at else 0
+    OUTBOX_OLDEST_AGE.set(max(0.0, age))
+
+
+def _collect_queues() -> None:
+    FILE_INGEST_JOBS.set(len(ingestion._jobs))
+    MEDIA_CACHE_WRITES.set(len(media_cache._pending_writes))
+    WRITE_GATE_WAITING.set(write_gate.waiting)
+    WRITE_GATE_ACQUIRED.set_total(write_gate.acquired)
+    WRITE_GATE_WAIT.set_total(write_gate.total_wait)
+    WRITE_GATE_MAX_WAIT.set(write_gate.max_wait)
+
+
+REGISTRY.add_collector("sheets_outbox", _collect_outbox)
+REGISTRY.add_collector("queues", _collect_queues)
+
+
+def metrics_authorized(authorization: str) -> bool:
+    if not settings.METRICS_TOKEN:
+        return True
+    return hmac.compare_digest(authorization.encode(), f"Bearer {settings.METRICS_TOKEN}".encode())
+
+
+@router.get("/metrics")
+async def metrics(request: Request) -> PlainTextResponse:
+    if not metrics_authorized(request.headers.get("Authorization", "")):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return PlainTextResponse(await REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+async def _standalone_metrics(request: web.Request) -> web.Response:
+    if not metrics_authorized(request.headers.get("Authorization", "")):
+        raise web.HTTPForbidden()
+    return web.Response(body=(await REGISTRY.render()).encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_metrics_server(port: int) -> web.AppRunner:
+    # The polling process has no FastAPI app, so it serves /metrics with the aiohttp that aiogram already uses.
+    metrics_app = web.Application()
+    metrics_app.router.add_get("/metrics", _standalone_metrics)
+    runner = web.AppRunner(metrics_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+    return runner
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+import asyncio
+import hmac
+import logging
+from typing import Any
+
+from fastapi import APIRouter, HTTPException, Request
+
+from app.bot.runner import BotApp
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def _feed_update(bot_app: BotApp, payload: dict[str, Any]) -> None:
+    try:
+        await bot_app.dp.feed_raw_update(bot_app.bot, payload)
+    except Exception:
+        logger.exception("Failed to process update %s for bot %s", payload.get("update_id"), bot_app.name)
+
+
+def _build_endpoint(bot_app: BotApp):
+    async def endpoint(request: Request) -> dict[str, bool]:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), bot_app.webhook_secret.encode()):
+            raise HTTPException(status_code=403, detail="Forbidden")
+        payload = await request.json()
+        # Reply right away so Telegram does not redeliver while a slow handler is running.
+        task = asyncio.create_task(_feed_update(bot_app, payload))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        return {"ok": True}
+
+    return endpoint
+
+
+def build_webhook_router(apps: list[BotApp]) -> APIRouter:
+    router = APIRouter()
+    for bot_app in apps:
+        router.add_api_route(
+            bot_app.webhook_path,
+            _build_endpoint(bot_app),
+            methods=["POST"],
+            include_in_schema=False,
+        )
+    return router
+
+
+async def drain_webhook_tasks() -> None:
+    if _background_tasks:
+        await asyncio.gather(*list(_background_tasks), return_exceptions=True)
@@ -1,32 +1,28 @@
 from __future__ import annotations
 
 import asyncio
-import os
 from contextlib import asynccontextmanager, suppress
 from pathlib import Path
 
-from aiogram import Bot, Dispatcher
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI
 
-from app.bot.assistant_test_handlers import register_assistant_test_handlers
-from app.bot.handlers import register_handlers
+from app.bot.cleanup import drain_cleanup_tasks
+from app.bot.ingestion import drain_file_ingestion
+from app.bot.runner import close_bot_apps, create_bot_apps, setup_webhooks, start_polling
 from app.config import FILES_DIR, QUESTION_IMAGES_DIR, settings
 from app.db import AsyncSessionLocal, init_db
-from app.models import UploadedFile
+from app.metrics import monitor_event_loop_lag
 from app.seed import seed_if_empty
+from app.services.media_cache import drain_media_cache_writes
+from app.services.media_manifest import run_media_manifest
+from app.services.sheets_outbox import run_sheets_outbox_worker
 from app.web.admin import router as admin_router
+from app.web.files import router as files_router
+from app.web.metrics import router as metrics_router
+from app.web.webhook import build_webhook_router, drain_webhook_tasks
 
-bot = Bot(token=settings.BOT_TOKEN)
-dp = Dispatcher()
-register_handlers(dp)
+bot_apps = create_bot_apps()
 
-assistant_test_bot = None
-assistant_test_dp = None
-if settings.ASSISTANT_TEST_BOT_TOKEN:
-    assistant_test_bot = Bot(token=settings.ASSISTANT_TEST_BOT_TOKEN)
-    assistant_test_dp = Dispatcher()
-    register_assistant_test_handlers(assistant_test_dp)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -37,20 +33,17 @@ async def lifespan(app: FastAPI):
     async with AsyncSessionLocal() as session:
         await seed_if_empty(session)
 
-    await bot.delete_webhook(drop_pending_updates=True)
     tasks = [
-        asyncio.create_task(dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types()))
+        asyncio.create_task(run_sheets_outbox_worker()),
+        asyncio.create_task(run_media_manifest()),
+        asyncio.create_task(monitor_event_loop_lag()),
     ]
-    if assistant_test_bot and assistant_test_dp:
-        await assistant_test_bot.delete_webhook(drop_pending_updates=True)
-        tasks.append(
-            asyncio.create_task(
-                assistant_test_dp.start_polling(
-                    assistant_test_bot,
-                    allowed_updates=assistant_test_dp.resolve_used_update_types(),
-                )
-            )
-        )
+    if settings.BOT_MODE == "polling":
+        tasks.extend(await start_polling(bot_apps))
+    elif settings.BOT_MODE == "webhook":
+        await setup_webhooks(bot_apps)
+    elif settings.BOT_MODE != "polling_process":
+        raise RuntimeError(f"Unknown BOT_MODE: {settings.BOT_MODE}")
     app.state.bot_tasks = tasks
     try:
         yield
@@ -61,22 +54,17 @@ async def lifespan(app: FastAPI):
         for task in tasks:
             with suppress(asyncio.CancelledError):
                 await task
-        await bot.session.close()
-        if assistant_test_bot:
-            await assistant_test_bot.session.close()
+        await drain_webhook_tasks()
+        await drain_file_ingestion()
+        await drain_cleanup_tasks()
+        await drain_media_cache_writes()
+        await close_bot_apps(bot_apps)
 
 
 app = FastAPI(lifespan=lifespan)
 app.include_router(admin_router)
+app.include_router(files_router)
+app.include_router(metrics_router)
+if settings.BOT_MODE == "webhook":
+    app.include_router(build_webhook_router(bot_apps))
 
-
-@app.get("/files/{file_id}")
-async def download_file(file_id: int):
-    async with AsyncSessionLocal() as session:
-        file = await session.get(UploadedFile, file_id)
-        if not file:
-            raise HTTPException(status_code=404, detail="File not found")
-        if not os.path.exists(file.local_path):
-            raise HTTPException(status_code=404, detail="File missing")
-
-    return FileResponse(path=file.local_path, media_type=file.mime_type, filename=file.file_name)
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Settings are read on import: point the app at a throwaway database before any test imports it.
+# TEST_DB_URL=postgresql+asyncpg://... runs the suite against PostgreSQL; that database is wiped per test.
+_TMP_DIR = Path(tempfile.mkdtemp(prefix="assistant-bot-tests-"))
+TEST_DB_URL = os.environ.get("TEST_DB_URL", "")
+os.environ.setdefault("BOT_TOKEN", "123456:TEST-TOKEN")
+os.environ.setdefault("FILES_BASE_URL", "http://testserver")
+os.environ["DB_URL"] = TEST_DB_URL or f"sqlite+aiosqlite:///{(_TMP_DIR / 'app.db').as_posix()}"
+
+
+async def _reset_postgres(url: str) -> None:
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("DROP SCHEMA public CASCADE")
+        await conn.exec_driver_sql("CREATE SCHEMA public")
+    await engine.dispose()
+
+
+@pytest.fixture
+def db_url(tmp_path: Path) -> str:
+    if TEST_DB_URL:
+        asyncio.run(_reset_postgres(TEST_DB_URL))
+        return TEST_DB_URL
+    return f"sqlite+aiosqlite:///{(tmp_path / 'test.db').as_posix()}"
+
+
+@pytest.fixture
+def app_db():
+    # A migrated copy of the app's own database (app.db.engine); returns a runner for coroutines that use it.
+    from app import db
+
+    async def prepare() -> None:
+        if TEST_DB_URL:
+            await _reset_postgres(TEST_DB_URL)
+        else:
+            for suffix in ("", "-wal", "-shm"):
+                (_TMP_DIR / f"app.db{suffix}").unlink(missing_ok=True)
+        await db.init_db()
+        await db.engine.dispose()
+
+    asyncio.run(prepare())
+
+    def run(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                # Pooled connections belong to this event loop; the next asyncio.run gets fresh ones.
+                await db.engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,59 @@
+import itertools
+from types import SimpleNamespace
+
+_message_ids = itertools.count(1)
+
+
+class FakeBot:
+    id = 1
+
+    def __init__(self) -> None:
+        self.calls: list[str] = []
+
+    def __getattr__(self, name: str):
+        async def method(*args, **kwargs):
+            self.calls.append(name)
+            return fake_message(self, photo=[SimpleNamespace(file_id=f"photo-{name}")])
+
+        return method
+
+
+def fake_message(bot: FakeBot, text: str | None = None, **fields) -> SimpleNamespace:
+    user = SimpleNamespace(id=42, username="candidate", first_name="Ivan", last_name="Petrov")
+    message = SimpleNamespace(
+        message_id=next(_message_ids),
+        bot=bot,
+        chat=SimpleNamespace(id=user.id),
+        from_user=user,
+        text=text,
+        photo=None,
+        document=SimpleNamespace(file_id="document"),
+        contact=None,
+        video=None,
+        video_note=None,
+        voice=None,
+        audio=None,
+    )
+    for name, value in fields.items():
+        setattr(message, name, value)
+
+    async def answer(*args, **kwargs):
+        bot.calls.append("answer")
+        return fake_message(bot)
+
+    async def edit(*args, **kwargs):
+        bot.calls.append("edit")
+        return True
+
+    message.answer = answer
+    message.edit_text = message.edit_caption = message.edit_reply_markup = message.delete = edit
+    return message
+
+
+def fake_callback(bot: FakeBot, data: str) -> SimpleNamespace:
+    message = fake_message(bot)
+
+    async def answer(*args, **kwargs):
+        bot.calls.append("callback_answer")
+
+    return SimpleNamespace(id=str(next(_message_ids)), data=data, from_user=message.from_user, message=message, answer=answer)
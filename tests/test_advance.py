@@ -0,0 +1,50 @@
+import asyncio
+
+from sqlalchemy import select
+
+from app.db import AsyncSessionLocal, unit_of_work
+from app.models import Question, Response, Survey, User
+from app.services.survey import StaleResponse, advance_response
+
+
+async def _seed_response() -> tuple[int, list[int]]:
+    async with unit_of_work() as session:
+        survey = Survey(code="s", title="Survey")
+        user = User(tg_id=1)
+        session.add_all([survey, user])
+        await session.flush()
+        questions = [
+            Question(survey_id=survey.id, code=f"q{n}", text=f"Q{n}", type="single_choice", order=n) for n in range(3)
+        ]
+        session.add_all(questions)
+        await session.flush()
+        response = Response(user_id=user.id, survey_id=survey.id, current_question_id=questions[0].id)
+        session.add(response)
+        await session.flush()
+        return response.id, [question.id for question in questions]
+
+
+async def _double_tap() -> tuple[list, int, list[int]]:
+    response_id, question_ids = await _seed_response()
+    # Both taps read the response before either of them moves it on, as two workers would.
+    both_read = asyncio.Barrier(2)
+
+    async def tap():
+        try:
+            async with unit_of_work() as session:
+                response = await session.get(Response, response_id)
+                await both_read.wait()
+                return (await advance_response(session, response)).id
+        except StaleResponse:
+            return "stale"
+
+    results = await asyncio.gather(tap(), tap())
+    async with AsyncSessionLocal() as session:
+        current = await session.scalar(select(Response.current_question_id).where(Response.id == response_id))
+    return results, current, question_ids
+
+
+def test_double_tap_advances_once(app_db):
+    results, current, question_ids = app_db(_double_tap())
+    assert sorted(results, key=str) == sorted([question_ids[1], "stale"], key=str)
+    assert current == question_ids[1]
@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.config import FILES_DIR, settings
+from app.db import AsyncSessionLocal
+from app.models import Question, Response, StoredBlob, Survey, UploadedFile, User
+from app.services import file_urls
+from app.services.file_urls import InvalidFileToken, sign_file, signed_file_url, verify_file_token
+from app.web.files import download_file
+
+BLOB = FILES_DIR / "blobs" / "ab" / "cd" / "abcd"
+
+
+def test_signed_token_round_trip():
+    signed = verify_file_token(sign_file(BLOB, "резюме.pdf", "application/pdf", ttl=0))
+    assert signed.key == "blobs/ab/cd/abcd"
+    assert signed.file_name == "резюме.pdf"
+    assert signed.mime_type == "application/pdf"
+    assert signed.path == FILES_DIR / "blobs" / "ab" / "cd" / "abcd"
+
+
+@pytest.mark.parametrize(
+    "tamper",
+    [
+        lambda token: token.replace(".", "x.", 1),
+        lambda token: token[:-2] + ("AA" if token[-2:] != "AA" else "BB"),
+        lambda token: token.split(".")[0] + ".ёжик",
+        lambda token: token.split(".")[0],
+    ],
+)
+def test_tampered_tokens_are_rejected(tamper):
+    with pytest.raises(InvalidFileToken):
+        verify_file_token(tamper(sign_file(BLOB, "cv.pdf", None, ttl=0)))
+
+
+def test_expired_token_is_rejected():
+    token = sign_file(BLOB, "cv.pdf", None, ttl=60)
+    assert verify_file_token(token, now=time.time() + 30)
+    with pytest.raises(InvalidFileToken):
+        verify_file_token(token, now=time.time() + 120)
+
+
+def _request() -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/files", "headers": [], "query_string": b""})
+
+
+async def _seed_uploads(tmp_path) -> tuple[int, int]:
+    legacy_path = tmp_path / "legacy.pdf"
+    legacy_path.write_bytes(b"%PDF-1.4 legacy")
+    async with AsyncSessionLocal() as session:
+        survey = Survey(code="s", title="Survey")
+        user = User(tg_id=1)
+        blob = StoredBlob(sha256="abcd", size=15)
+        session.add_all([survey, user, blob])
+        await session.flush()
+        question = Question(survey_id=survey.id, code="files", text="Files", type="file")
+        response = Response(user_id=user.id, survey_id=survey.id)
+        session.add_all([question, response])
+        await session.flush()
+        fields = {"response_id": response.id, "question_id": question.id, "tg_file_id": "f", "file_type": "document"}
+        legacy = UploadedFile(file_name="legacy.pdf", local_path=str(legacy_path), public_url="", **fields)
+        signed = UploadedFile(
+            file_name="new.pdf",
+            local_path=str(BLOB),
+            public_url=signed_file_url(BLOB, "new.pdf", None),
+            blob_id=blob.id,
+            **fields,
+        )
+        session.add_all([legacy, signed])
+        await session.flush()
+        legacy.public_url = f"{settings.FILES_BASE_URL}/files/{legacy.id}"
+        await session.commit()
+        return legacy.id, signed.id
+
+
+async def _status(file_id: int) -> int:
+    try:
+        response = await download_file(_request(), str(file_id))
+    except HTTPException as exc:
+        return exc.status_code
+    return response.status_code
+
+
+def test_legacy_ids_only_open_pre_signing_files(app_db, tmp_path, monkeypatch):
+    legacy_id, signed_id = app_db(_seed_uploads(tmp_path))
+    assert app_db(_status(legacy_id)) == 200
+    assert app_db(_status(signed_id)) == 404
+
+    monkeypatch.setattr(settings, "FILES_ALLOW_LEGACY_IDS", False)
+    assert app_db(_status(legacy_id)) == 404
+
+
+async def _download_headers(url: str) -> dict[str, str]:
+    response = await download_file(_request(), url.rsplit("/", 1)[1])
+    return {name: response.headers[name] for name in ("content-type", "content-disposition")}
+
+
+def test_shared_blob_keeps_each_uploads_name(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_urls, "FILES_DIR", tmp_path)
+    blob = tmp_path / "blobs" / "ef" / "01" / "ef01"
+    blob.parent.mkdir(parents=True)
+    blob.write_bytes(b"%PDF-1.4 shared")
+    first = asyncio.run(_download_headers(signed_file_url(blob, "first.pdf", "application/pdf")))
+    second = asyncio.run(_download_headers(signed_file_url(blob, "second.txt", "text/plain")))
+    assert first == {"content-type": "application/pdf", "content-disposition": 'attachment; filename="first.pdf"'}
+    assert second["content-type"].startswith("text/plain")
+    assert second["content-disposition"] == 'attachment; filename="second.txt"'
@@ -0,0 +1,77 @@
+import asyncio
+
+from sqlalchemy import select, update
+
+from app.bot import handlers, ingestion
+from app.config import settings
+from app.db import AsyncSessionLocal, unit_of_work
+from app.models import Answer, Response, UploadedFile
+from app.seed import seed_if_empty
+from app.services.survey_cache import get_compiled_survey
+from fakes import FakeBot, fake_callback, fake_message
+
+
+async def _on_file_question(bot: FakeBot) -> tuple[int, int]:
+    async with AsyncSessionLocal() as session:
+        await seed_if_empty(session)
+    survey = await get_compiled_survey(settings.ASSISTANT_MAIN_SURVEY_CODE)
+    question = next(question for question in survey.questions if question.type == "file")
+    await handlers.start_command(fake_message(bot, "/start"))
+    async with unit_of_work() as session:
+        response = await session.scalar(select(Response))
+        response.current_question_id = question.id
+        upload = UploadedFile(
+            response_id=response.id,
+            question_id=question.id,
+            tg_file_id="document",
+            file_name="cv.pdf",
+            file_type="document",
+            local_path="",
+            public_url="",
+            status="pending",
+        )
+        session.add(upload)
+        await session.flush()
+        session.add(Answer(response_id=response.id, question_id=question.id, file_ids=[upload.id]))
+    return question.id, upload.id
+
+
+async def _current_question_id() -> int | None:
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(Response.current_question_id))
+
+
+async def _done_while_downloading() -> None:
+    bot = FakeBot()
+    question_id, upload_id = await _on_file_question(bot)
+    # The handler returns at once instead of holding the chat's turn for the whole download.
+    await asyncio.wait_for(handlers.handle_callbacks(fake_callback(bot, f"q{question_id}:done_files")), timeout=1)
+    assert bot.calls[-1] == "callback_answer"
+    assert await _current_question_id() == question_id
+
+    async with unit_of_work() as session:
+        await session.execute(
+            update(UploadedFile).where(UploadedFile.id == upload_id).values(status="ready", public_url="http://testserver/f")
+        )
+    await asyncio.wait_for(asyncio.gather(*ingestion._waiters), timeout=5)
+    assert await _current_question_id() != question_id
+
+
+def test_files_done_finishes_after_the_download(app_db, monkeypatch):
+    monkeypatch.setattr(ingestion, "PENDING_POLL_INTERVAL", 0.05)
+    app_db(_done_while_downloading())
+
+
+async def _done_with_download_stuck() -> list[str]:
+    bot = FakeBot()
+    question_id, _ = await _on_file_question(bot)
+    await handlers.handle_callbacks(fake_callback(bot, f"q{question_id}:done_files"))
+    await asyncio.wait_for(asyncio.gather(*ingestion._waiters), timeout=5)
+    assert await _current_question_id() == question_id
+    return bot.calls
+
+
+def test_files_done_gives_up_after_the_timeout(app_db, monkeypatch):
+    monkeypatch.setattr(ingestion, "PENDING_POLL_INTERVAL", 0.05)
+    monkeypatch.setattr(settings, "FILE_INGEST_WAIT_TIMEOUT", 0.2)
+    assert app_db(_done_with_download_stuck())[-1] == "answer"
@@ -0,0 +1,67 @@
+import asyncio
+import hashlib
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from app.bot.runner import create_bot, telegram_api_server
+from app.config import settings
+from app.services import blobs
+from app.services.files import _download_blob
+
+
+@pytest.fixture
+def local_server(monkeypatch, tmp_path: Path) -> Path:
+    # The Bot API server writes to /var/lib/telegram-bot-api, mounted here under tmp_path/mount.
+    monkeypatch.setattr(settings, "TELEGRAM_API_URL", "http://telegram-bot-api:8081")
+    monkeypatch.setattr(settings, "TELEGRAM_API_LOCAL", True)
+    monkeypatch.setattr(settings, "TELEGRAM_API_SERVER_FILES_DIR", "/var/lib/telegram-bot-api")
+    monkeypatch.setattr(settings, "TELEGRAM_API_LOCAL_FILES_DIR", str(tmp_path / "mount"))
+    monkeypatch.setattr(blobs, "BLOBS_DIR", tmp_path / "blobs")
+    monkeypatch.setattr(blobs, "TMP_DIR", tmp_path / "blobs" / "tmp")
+    return tmp_path / "mount"
+
+
+def test_default_server_is_telegram(monkeypatch):
+    monkeypatch.setattr(settings, "TELEGRAM_API_URL", "")
+    assert telegram_api_server() is None
+
+
+def test_server_paths_are_mapped_to_the_mount(local_server: Path):
+    server = telegram_api_server()
+    assert server.is_local
+    assert server.api_url("TOKEN", "getMe") == "http://telegram-bot-api:8081/botTOKEN/getMe"
+    local = server.wrap_local_file.to_local("/var/lib/telegram-bot-api/TOKEN/documents/file_1.pdf")
+    assert Path(local) == local_server / "TOKEN" / "documents" / "file_1.pdf"
+
+
+async def _download_from_local_server(server_path: str) -> tuple[str, int]:
+    bot = create_bot(settings.BOT_TOKEN)
+
+    async def get_file(file_id: str):
+        return SimpleNamespace(file_id=file_id, file_path=server_path)
+
+    async def download_file(*args, **kwargs):
+        raise AssertionError("a local server's file must not be downloaded over HTTP")
+
+    bot.get_file = get_file
+    bot.download_file = download_file
+    try:
+        return await _download_blob(bot, "document")
+    finally:
+        await bot.session.close()
+
+
+def test_local_files_are_copied_without_downloading(local_server: Path):
+    content = b"%PDF-1.4 candidate cv"
+    source = local_server / "TOKEN" / "documents" / "file_1.pdf"
+    source.parent.mkdir(parents=True)
+    source.write_bytes(content)
+
+    sha256, size = asyncio.run(_download_from_local_server("/var/lib/telegram-bot-api/TOKEN/documents/file_1.pdf"))
+
+    assert (sha256, size) == (hashlib.sha256(content).hexdigest(), len(content))
+    assert blobs.blob_path(sha256).read_bytes() == content
+    # The server owns its copy; it is not moved into the blob store.
+    assert source.exists()
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+from PIL import Image
+from sqlalchemy import func, select
+
+from app.db import AsyncSessionLocal
+from app.models import MediaCacheEntry
+from app.services import images
+from app.services.media_cache import drain_media_cache_writes, lookup_file_id, remember_file_id
+from app.services.media_manifest import forget_media_source, photos_for, refresh_media_source
+
+BOT = SimpleNamespace(id=1)
+
+
+async def _cached_photo_after(source, forget) -> tuple:
+    photo = (await photos_for(source))[0]
+    await remember_file_id(BOT, photo, "photo", "photo-file-id")
+    await drain_media_cache_writes()
+    await forget(source)
+    await drain_media_cache_writes()
+    async with AsyncSessionLocal() as session:
+        rows = await session.scalar(select(func.count()).select_from(MediaCacheEntry))
+    return await lookup_file_id(BOT, photo, "photo"), rows
+
+
+async def _remove(source) -> None:
+    await forget_media_source(source)
+    source.unlink()
+    await refresh_media_source(source)
+
+
+def test_forgetting_a_source_drops_its_variant_file_id(app_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(images, "OPTIMIZED_IMAGES_DIR", tmp_path / "optimized")
+    source = tmp_path / "q1_intro.png"
+    Image.new("RGB", (20, 10), (200, 10, 10)).save(source)
+    assert app_db(_cached_photo_after(source, forget_media_source)) == (None, 0)
+
+
+def test_removed_image_leaves_the_manifest(app_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(images, "OPTIMIZED_IMAGES_DIR", tmp_path / "optimized")
+    source = tmp_path / "q2_intro.png"
+    Image.new("RGB", (20, 10), (10, 200, 10)).save(source)
+    assert app_db(_cached_photo_after(source, _remove)) == (None, 0)
+    assert app_db(photos_for(source)) == ()
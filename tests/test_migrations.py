@@ -0,0 +1,272 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import JSON, Boolean, Column, DateTime, ForeignKey, Integer, MetaData, String, Table, Text, inspect, select
+
+from app.config import settings
+from app.db import build_engine
+from app.migrations import MIGRATIONS, _answers_unique, _backfill_test_scores, run_migrations, schema_migrations
+from app.models import Answer, Base, Option, Question, Response, Survey, UploadedFile, User
+
+
+def _seed_duplicate_answers(conn) -> None:
+    Base.metadata.create_all(conn)
+    conn.exec_driver_sql("DROP INDEX ux_answers_response_question")
+    conn.execute(Survey.__table__.insert().values(id=1, code="s", title="Survey"))
+    conn.execute(Question.__table__.insert().values(id=1, survey_id=1, code="q", text="Q", type="file"))
+    conn.execute(User.__table__.insert().values(id=1, tg_id=1))
+    conn.execute(Response.__table__.insert().values(id=1, user_id=1, survey_id=1, status="in_progress"))
+    conn.execute(
+        Answer.__table__.insert(),
+        [
+            {"id": 1, "response_id": 1, "question_id": 1, "text_value": "first", "file_ids": [10, 11]},
+            {"id": 2, "response_id": 1, "question_id": 1, "text_value": "second", "file_ids": [11, 12]},
+            {"id": 3, "response_id": 1, "question_id": 1, "text_value": "third", "file_ids": None},
+        ],
+    )
+
+
+async def _migrate_duplicates(db_url: str) -> list[tuple]:
+    engine = build_engine(db_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(_seed_duplicate_answers)
+    async with engine.begin() as conn:
+        await conn.run_sync(_answers_unique)
+    async with engine.connect() as conn:
+        rows = (await conn.execute(select(Answer.id, Answer.text_value, Answer.file_ids))).all()
+    await engine.dispose()
+    return [tuple(row) for row in rows]
+
+
+def test_duplicate_answers_keep_first_row_and_merge_files(db_url):
+    assert asyncio.run(_migrate_duplicates(db_url)) == [(1, "first", [10, 11, 12])]
+
+
+async def _migrate_concurrently(db_url: str) -> tuple[list, list[int]]:
+    # Separate engines stand in for the web app and the polling process starting together.
+    engines = [build_engine(db_url) for _ in range(3)]
+    results = await asyncio.gather(*(run_migrations(engine) for engine in engines), return_exceptions=True)
+    async with engines[0].connect() as conn:
+        versions = list((await conn.execute(select(schema_migrations.c.version))).scalars())
+    for engine in engines:
+        await engine.dispose()
+    return results, versions
+
+
+def test_concurrent_runs_on_fresh_database(db_url):
+    results, versions = asyncio.run(_migrate_concurrently(db_url))
+    assert results == [[], [], []]
+    assert sorted(versions) == sorted(m.version for m in MIGRATIONS)
+
+
+def _seed_test_responses(conn) -> None:
+    Base.metadata.create_all(conn)
+    conn.execute(Survey.__table__.insert().values(id=1, code=settings.ASSISTANT_TEST_SURVEY_CODE, title="Test"))
+    conn.execute(
+        Question.__table__.insert(),
+        [
+            {"id": n, "survey_id": 1, "code": f"q{n}", "text": "Q", "type": "single_choice", "order": n}
+            for n in range(1, 7)
+        ],
+    )
+    conn.execute(
+        Option.__table__.insert(),
+        [
+            {"id": question * 10 + n, "question_id": question, "text": value, "value": value}
+            for question in range(1, 7)
+            for n, value in enumerate("ABC")
+        ],
+    )
+    conn.execute(User.__table__.insert().values(id=1, tg_id=1))
+    conn.execute(
+        Response.__table__.insert(),
+        [
+            {"id": 1, "user_id": 1, "survey_id": 1, "status": "completed"},
+            {"id": 2, "user_id": 1, "survey_id": 1, "status": "in_progress"},
+        ],
+    )
+    # The finished test picked A six times; the running one has answered two questions so far.
+    answers = [{"response_id": 1, "question_id": q, "option_values": [q * 10]} for q in range(1, 7)]
+    answers += [
+        {"response_id": 2, "question_id": 1, "option_values": [11]},
+        {"response_id": 2, "question_id": 2, "option_values": [22]},
+    ]
+    conn.execute(Answer.__table__.insert(), answers)
+
+
+async def _backfill_scores(db_url: str) -> list[tuple]:
+    engine = build_engine(db_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(_seed_test_responses)
+    async with engine.begin() as conn:
+        await conn.run_sync(_backfill_test_scores)
+    columns = [Response.id, Response.score_a, Response.score_b, Response.score_c, Response.result_type]
+    async with engine.connect() as conn:
+        rows = (await conn.execute(select(*columns).order_by(Response.id))).all()
+    await engine.dispose()
+    return [tuple(row) for row in rows]
+
+
+def test_score_backfill_covers_running_tests(db_url):
+    assert asyncio.run(_backfill_scores(db_url)) == [(1, 6, 0, 0, "OFFICE"), (2, 0, 1, 1, None)]
+
+
+def _legacy_metadata() -> MetaData:
+    # The schema as the first release created it, before the PRAGMA-patched columns and any migration.
+    metadata = MetaData()
+    Table(
+        "surveys",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("code", String(64), unique=True, index=True),
+        Column("title", String(255)),
+        Column("is_active", Boolean),
+        Column("created_at", DateTime),
+    )
+    Table(
+        "questions",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("survey_id", ForeignKey("surveys.id"), index=True),
+        Column("code", String(64), index=True),
+        Column("text", Text),
+        Column("type", String(32)),
+        Column("required", Boolean),
+        Column("order", Integer),
+        Column("allow_multiple", Boolean),
+        Column("help_text", Text),
+        Column("settings", JSON),
+    )
+    Table(
+        "options",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("question_id", ForeignKey("questions.id"), index=True),
+        Column("text", String(255)),
+        Column("value", String(255)),
+        Column("order", Integer),
+    )
+    Table(
+        "users",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("tg_id", Integer, unique=True, index=True),
+        Column("username", String(255)),
+        Column("first_name", String(255)),
+        Column("last_name", String(255)),
+        Column("phone", String(64)),
+        Column("created_at", DateTime),
+    )
+    Table(
+        "responses",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("user_id", ForeignKey("users.id"), index=True),
+        Column("survey_id", ForeignKey("surveys.id"), index=True),
+        Column("status", String(32)),
+        Column("started_at", DateTime),
+        Column("completed_at", DateTime),
+        Column("current_question_id", Integer),
+    )
+    Table(
+        "answers",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("response_id", ForeignKey("responses.id"), index=True),
+        Column("question_id", ForeignKey("questions.id"), index=True),
+        Column("text_value", Text),
+        Column("option_values", JSON),
+        Column("file_ids", JSON),
+        Column("created_at", DateTime),
+    )
+    Table(
+        "uploaded_files",
+        metadata,
+        Column("id", Integer, primary_key=True),
+        Column("response_id", ForeignKey("responses.id"), index=True),
+        Column("question_id", ForeignKey("questions.id"), index=True),
+        Column("tg_file_id", String(255)),
+        Column("tg_unique_id", String(255)),
+        Column("file_name", String(255)),
+        Column("mime_type", String(255)),
+        Column("size", Integer),
+        Column("local_path", Text),
+        Column("public_url", Text),
+        Column("file_type", String(32)),
+        Column("created_at", DateTime),
+    )
+    return metadata
+
+
+def _seed_legacy(conn) -> None:
+    metadata = _legacy_metadata()
+    metadata.create_all(conn)
+    tables = metadata.tables
+    now = datetime(2024, 1, 1)
+    conn.execute(tables["surveys"].insert().values(id=1, code="main", title="Survey", is_active=True, created_at=now))
+    conn.execute(tables["questions"].insert().values(id=1, survey_id=1, code="cv", text="CV", type="file", order=1))
+    conn.execute(tables["users"].insert().values(id=1, tg_id=123, created_at=now))
+    conn.execute(
+        tables["responses"].insert().values(id=1, user_id=1, survey_id=1, status="completed", started_at=now)
+    )
+    conn.execute(tables["answers"].insert().values(id=1, response_id=1, question_id=1, file_ids=[1], created_at=now))
+    conn.execute(
+        tables["uploaded_files"].insert().values(
+            id=1,
+            response_id=1,
+            question_id=1,
+            tg_file_id="f",
+            file_name="cv.pdf",
+            local_path="/data/files/cv.pdf",
+            public_url="http://testserver/files/1",
+            file_type="document",
+            created_at=now,
+        )
+    )
+
+
+def _schema(conn) -> dict[str, set[str]]:
+    inspector = inspect(conn)
+    return {
+        table: {column["name"] for column in inspector.get_columns(table)}
+        | {index["name"] for index in inspector.get_indexes(table)}
+        for table in inspector.get_table_names()
+    }
+
+
+async def _migrate(db_url: str, seed=None) -> tuple[list[int], list[int], dict[str, set[str]], tuple]:
+    engine = build_engine(db_url)
+    if seed is not None:
+        async with engine.begin() as conn:
+            await conn.run_sync(seed)
+    applied = await run_migrations(engine)
+    again = await run_migrations(engine)
+    async with engine.connect() as conn:
+        schema = await conn.run_sync(_schema)
+        upload = (await conn.execute(select(UploadedFile.status, UploadedFile.attempts, UploadedFile.blob_id))).first()
+    await engine.dispose()
+    return applied, again, schema, tuple(upload) if upload else ()
+
+
+def _model_schema() -> dict[str, set[str]]:
+    return {
+        table.name: {column.name for column in table.columns} | {index.name for index in table.indexes}
+        for table in Base.metadata.sorted_tables
+    }
+
+
+def test_fresh_database_gets_current_schema(db_url):
+    applied, again, schema, _ = asyncio.run(_migrate(db_url))
+    assert applied == [] and again == []
+    for table, names in _model_schema().items():
+        assert names <= schema[table], table
+
+
+def test_legacy_database_is_upgraded_in_place(db_url):
+    applied, again, schema, upload = asyncio.run(_migrate(db_url, _seed_legacy))
+    assert applied == sorted(m.version for m in MIGRATIONS)
+    assert again == []
+    for table, names in _model_schema().items():
+        assert names <= schema[table], table
+    assert "ref_count" not in schema["stored_blobs"]
+    assert upload == ("ready", 0, None)
@@ -0,0 +1,51 @@
+from sqlalchemy import select
+
+from app.bot import handlers
+from app.config import settings
+from app.db import AsyncSessionLocal
+from app.metrics import detached_task, query_budget
+from app.models import Survey
+from app.seed import seed_if_empty
+from app.services.media_cache import drain_media_cache_writes
+from app.services.survey_cache import get_compiled_survey
+from fakes import FakeBot, fake_callback, fake_message
+
+
+async def _seed() -> None:
+    async with AsyncSessionLocal() as session:
+        await seed_if_empty(session)
+
+
+async def _touch_database() -> None:
+    async with AsyncSessionLocal() as session:
+        await session.scalar(select(Survey.id).limit(1))
+
+
+async def _typed_answer_budget() -> None:
+    await _seed()
+    bot = FakeBot()
+    survey = await get_compiled_survey(settings.ASSISTANT_MAIN_SURVEY_CODE)
+    consent = survey.questions[0]
+    await handlers.start_command(fake_message(bot, "/start"))
+    await handlers.handle_callbacks(fake_callback(bot, f"q{consent.id}:opt{consent.options[0].id}"))
+    # Lookup, answer upsert, message id bookkeeping, advance; the next question's id is recorded after the commit.
+    with query_budget(5, max_commits=2, label="typed answer"):
+        await handlers.handle_messages(fake_message(bot, "Иван Петров"))
+        await drain_media_cache_writes()
+    assert bot.calls[-1] == "send_message"
+
+
+def test_typed_answer_stays_within_budget(app_db):
+    app_db(_typed_answer_budget())
+
+
+async def _detached_work_is_not_billed() -> None:
+    with query_budget(1) as stats:
+        await _touch_database()
+    assert stats.statements == 1
+    with query_budget(0, max_commits=0, label="detached"):
+        await detached_task(_touch_database())
+
+
+def test_detached_tasks_do_not_count_towards_the_update(app_db):
+    app_db(_detached_work_is_not_billed())
@@ -0,0 +1,66 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import event
+
+from app.db import build_engine, build_sessionmaker
+from app.migrations import run_migrations
+from app.models import Answer, Question, Response, Survey, User
+from app.services.survey import get_answer, get_next_question, get_user_with_active_response
+
+
+def _explain(conn, statement, parameters) -> str:
+    if conn.dialect.name == "postgresql":
+        # The test tables hold a few rows; without this PostgreSQL would scan them whatever the indexes.
+        conn.exec_driver_sql("SET enable_seqscan = off")
+        rows = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+        return "\n".join(row[0] for row in rows)
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    return "\n".join(row[-1] for row in rows)
+
+
+async def _hot_query_plans(db_url: str) -> str:
+    engine = build_engine(db_url)
+    await run_migrations(engine)
+    sessionmaker = build_sessionmaker(engine)
+    async with sessionmaker() as session:
+        survey = Survey(code="s", title="Survey")
+        session.add(survey)
+        await session.flush()
+        first = Question(survey_id=survey.id, code="q1", text="Q1", type="text", order=1)
+        second = Question(survey_id=survey.id, code="q2", text="Q2", type="text", order=2)
+        user = User(tg_id=1)
+        session.add_all([first, second, user])
+        await session.flush()
+        response = Response(user_id=user.id, survey_id=survey.id, started_at=datetime.utcnow())
+        session.add(response)
+        await session.flush()
+        session.add(Answer(response_id=response.id, question_id=first.id, text_value="a"))
+        await session.commit()
+
+    captured: list[tuple[str, object]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", capture)
+    async with sessionmaker() as session:
+        await get_user_with_active_response(session, survey.id, 1, None, None, None)
+        await get_next_question(session, survey.id, first.id)
+        await get_answer(session, response.id, first.id)
+    event.remove(engine.sync_engine, "before_cursor_execute", capture)
+
+    plans = []
+    async with engine.connect() as conn:
+        for statement, parameters in captured:
+            plans.append(await conn.run_sync(_explain, statement, parameters))
+    await engine.dispose()
+    return "\n".join(plans)
+
+
+def test_hot_queries_use_composite_indexes(db_url):
+    plans = asyncio.run(_hot_query_plans(db_url))
+    assert "ix_responses_user_survey_status_started" in plans
+    assert "ix_questions_survey_order" in plans
+    assert "ux_answers_response_question" in plans
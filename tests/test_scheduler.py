@@ -0,0 +1,85 @@
+import asyncio
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from app.bot.scheduler import Priority, SendScheduler, replying_to, send_priority
+
+
+class FakeApi:
+    def __init__(self, retry_after: dict[int, int] | None = None) -> None:
+        self.sent: list[tuple[int | str, str, float]] = []
+        self.retry_after = dict(retry_after or {})
+
+    async def __call__(self, bot, method: SendMessage):
+        loop = asyncio.get_running_loop()
+        seconds = self.retry_after.pop(method.chat_id, None)
+        if seconds is not None:
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=seconds)
+        self.sent.append((method.chat_id, method.text, loop.time()))
+        return True
+
+
+async def _send(scheduler: SendScheduler, api: FakeApi, chat_id: int, text: str, priority=Priority.INTERACTIVE):
+    with send_priority(priority):
+        return await scheduler(api, None, SendMessage(chat_id=chat_id, text=text))
+
+
+def _offsets(api: FakeApi, started_at: float) -> list[float]:
+    return [round(sent_at - started_at, 2) for _, _, sent_at in api.sent]
+
+
+async def _chat_throttle() -> tuple[list[float], list[float]]:
+    loop = asyncio.get_running_loop()
+    scheduler = SendScheduler(global_rate=100, chat_rate=10, chat_burst=2)
+    api = FakeApi()
+    started_at = loop.time()
+    await asyncio.gather(*(_send(scheduler, api, 1, str(n)) for n in range(4)))
+    limited = _offsets(api, started_at)
+
+    api = FakeApi()
+    started_at = loop.time()
+    with replying_to(2):
+        await asyncio.gather(*(_send(scheduler, api, 2, str(n)) for n in range(4)))
+    replies = _offsets(api, started_at)
+    return limited, replies
+
+
+def test_chat_rate_applies_except_to_replies():
+    limited, replies = asyncio.run(_chat_throttle())
+    assert max(limited[:2]) < 0.05
+    assert limited[2] >= 0.09 and limited[3] >= 0.19
+    assert max(replies) < 0.05
+
+
+async def _priority_order() -> list[str]:
+    scheduler = SendScheduler(global_rate=2, chat_rate=10, chat_burst=10)
+    api = FakeApi()
+    # Use up the global burst so the next sends have to queue.
+    await asyncio.gather(_send(scheduler, api, 1, "warmup"), _send(scheduler, api, 2, "warmup"))
+    background = asyncio.create_task(_send(scheduler, api, 3, "background", Priority.BACKGROUND))
+    notification = asyncio.create_task(_send(scheduler, api, 4, "notification", Priority.NOTIFICATION))
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(_send(scheduler, api, 5, "interactive"))
+    await asyncio.gather(background, notification, interactive)
+    return [text for _, text, _ in api.sent[2:]]
+
+
+def test_interactive_sends_go_first():
+    assert asyncio.run(_priority_order()) == ["interactive", "notification", "background"]
+
+
+async def _retry_after() -> tuple[list[float], int]:
+    loop = asyncio.get_running_loop()
+    scheduler = SendScheduler(global_rate=100, chat_rate=10, chat_burst=2)
+    api = FakeApi(retry_after={1: 1})
+    started_at = loop.time()
+    with replying_to(1):
+        await asyncio.gather(_send(scheduler, api, 1, "reply"), _send(scheduler, api, 2, "other chat"))
+    return [offset for (chat_id, _, _), offset in zip(api.sent, _offsets(api, started_at)) if chat_id == 1], scheduler.retries
+
+
+def test_retry_after_blocks_the_chat_even_for_replies():
+    offsets, retries = asyncio.run(_retry_after())
+    assert retries == 1
+    assert len(offsets) == 1 and offsets[0] >= 1
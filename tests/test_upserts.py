@@ -0,0 +1,121 @@
+import asyncio
+
+from sqlalchemy import func, select
+
+from app.db import AsyncSessionLocal, unit_of_work
+from app.models import Answer, MediaCacheEntry, Question, Response, StoredBlob, Survey, User
+from app.services.blobs import get_or_create_blob
+from app.services.media_cache import MediaFingerprint, _store_file_id
+from app.services.survey import (
+    append_file_answer,
+    get_or_create_user,
+    record_question_messages,
+    save_option_answer,
+    save_text_answer,
+)
+
+CONCURRENCY = 5
+
+
+async def _count(model) -> int:
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(func.count()).select_from(model))
+
+
+async def _seed_response() -> tuple[int, int]:
+    async with unit_of_work() as session:
+        survey = Survey(code="s", title="Survey")
+        user = User(tg_id=1)
+        session.add_all([survey, user])
+        await session.flush()
+        question = Question(survey_id=survey.id, code="q", text="Q", type="file")
+        response = Response(user_id=user.id, survey_id=survey.id)
+        session.add_all([question, response])
+        await session.flush()
+        return response.id, question.id
+
+
+async def _concurrent_users() -> set[int]:
+    async def create() -> int:
+        async with unit_of_work() as session:
+            return (await get_or_create_user(session, 777, "user", "First", "Last")).id
+
+    ids = set(await asyncio.gather(*(create() for _ in range(CONCURRENCY))))
+    assert await _count(User) == 1
+    return ids
+
+
+def test_first_updates_of_a_chat_create_one_user(app_db):
+    assert len(app_db(_concurrent_users())) == 1
+
+
+async def _repeated_answers() -> Answer:
+    response_id, question_id = await _seed_response()
+    async with unit_of_work() as session:
+        await save_text_answer(session, response_id, question_id, "first")
+    async with unit_of_work() as session:
+        await save_text_answer(session, response_id, question_id, "second")
+    async with unit_of_work() as session:
+        await save_option_answer(session, response_id, question_id, [3, 4])
+    assert await _count(Answer) == 1
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(Answer))
+
+
+def test_saving_an_answer_again_updates_the_row(app_db):
+    answer = app_db(_repeated_answers())
+    assert (answer.text_value, answer.option_values) == ("second", [3, 4])
+
+
+async def _concurrent_file_appends() -> list[int]:
+    response_id, question_id = await _seed_response()
+
+    async def append(file_id: int) -> None:
+        async with unit_of_work() as session:
+            await append_file_answer(session, response_id, question_id, file_id)
+
+    await asyncio.gather(*(append(file_id) for file_id in range(1, CONCURRENCY + 1)))
+    assert await _count(Answer) == 1
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(Answer.file_ids))
+
+
+def test_album_parts_keep_every_file_id(app_db):
+    assert sorted(app_db(_concurrent_file_appends())) == list(range(1, CONCURRENCY + 1))
+
+
+async def _concurrent_message_ids() -> list[int]:
+    response_id, _ = await _seed_response()
+    await asyncio.gather(*(record_question_messages(response_id, [n, n + 100]) for n in range(CONCURRENCY)))
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(Response.question_message_ids).where(Response.id == response_id))
+
+
+def test_question_message_ids_are_appended(app_db):
+    assert sorted(app_db(_concurrent_message_ids())) == sorted([*range(CONCURRENCY), *range(100, 100 + CONCURRENCY)])
+
+
+async def _concurrent_blobs() -> set[int]:
+    async def create() -> int:
+        async with unit_of_work() as session:
+            return (await get_or_create_blob(session, "ab" * 32, 10)).id
+
+    ids = set(await asyncio.gather(*(create() for _ in range(CONCURRENCY))))
+    assert await _count(StoredBlob) == 1
+    return ids
+
+
+def test_same_content_gets_one_blob(app_db):
+    assert len(app_db(_concurrent_blobs())) == 1
+
+
+async def _concurrent_media_cache() -> str:
+    fingerprint = MediaFingerprint("/media/intro.jpg", 10, 1, "cd" * 32)
+    await asyncio.gather(*(_store_file_id(1, fingerprint, "photo", f"file-{n}") for n in range(CONCURRENCY)))
+    assert await _count(MediaCacheEntry) == 1
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(MediaCacheEntry.file_id))
+
+
+def test_media_cache_keeps_one_row_per_file(app_db):
+    assert app_db(_concurrent_media_cache()).startswith("file-")